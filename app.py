@@ -1,14 +1,26 @@
 import io
 import math
+import os
 import re
 import requests
 import asyncio
-from urllib.parse import urlencode
-from flask import Flask, request, jsonify, send_file, abort, render_template, g
+from functools import partial
+from flask import Flask, request, send_file, abort, render_template, g
+from json_fragments import jsonify
 from ollam import parse_natural_query, llama_fallback
+import bayut
+import cache_policy
+import canonical_filters
 import database
+import gazetteer
+import ingestion
+import map_tiles
+import market_snapshot
+import query_planner
+import search_cache
+import synthetic_data
+import warehouse
 import test_prop as tp
-import property_finder
 from datetime import datetime
 import sqlite3
 from intelligent_agent import agent
@@ -19,22 +31,7 @@ def generate_agent_insights(listings, query, filters):
     
     if listings:
         # Price analysis
-        prices = [item.get("price", 0) for item in listings if item.get("price")]
-        if prices:
-            avg_price = sum(prices) / len(prices)
-            min_price = min(prices)
-            max_price = max(prices)
-            
-            insights.append({
-                "type": "price_analysis",
-                "title": "Price Insights",
-                "message": f"Found {len(listings)} properties with prices ranging from AED {min_price:,.0f} to AED {max_price:,.0f}",
-                "data": {
-                    "average_price": avg_price,
-                    "price_range": {"min": min_price, "max": max_price},
-                    "property_count": len(listings)
-                }
-            })
+        insights.extend(_price_insights(listings, filters))
         
         # Location analysis
         locations = [item.get("location_name", "") for item in listings if item.get("location_name")]
@@ -64,6 +61,37 @@ def generate_agent_insights(listings, query, filters):
     
     return insights
 
+
+def _price_insights(listings, filters):
+    """Price range of the results and how their average compares with the whole market (columnar snapshot)."""
+    stats = market_snapshot.listing_summary(listings)
+    if not stats:
+        return []
+    insights = [{
+        "type": "price_analysis",
+        "title": "Price Insights",
+        "message": f"Found {len(listings)} properties with prices ranging from AED {stats['min_price']:,.0f} to "
+                   f"AED {stats['max_price']:,.0f}",
+        "data": {
+            "average_price": stats["average_price"],
+            "price_range": {"min": stats["min_price"], "max": stats["max_price"]},
+            "property_count": len(listings)
+        }
+    }]
+    # The results come from a Property Finder search, which fills in its defaults (sale) for missing filters
+    market = market_snapshot.market_summary(filters, defaults=canonical_filters.DEFAULTS)
+    if market:
+        insights.append({
+            "type": "market_comparison",
+            "title": "Market Comparison",
+            "message": f"These results average {(stats['average_price'] / market['average_price'] - 1) * 100:+.0f}% "
+                       f"against the AED {market['average_price']:,.0f} average of {market['count']:,} comparable "
+                       f"listings on the market",
+            "data": market
+        })
+    return insights
+
+
 def generate_proactive_suggestions(listings, query, filters):
     """Generate proactive suggestions based on search results"""
     suggestions = []
@@ -105,169 +133,60 @@ app.config['DATABASE'] = 'bayut_properties.db'
 app.config['DEBUG'] = True
 
 database.init_app(app)
+gazetteer.init_app(app)
+ingestion.init_app(app)
+market_snapshot.init_app(app)
+synthetic_data.init_app(app)
 
 
 # --- API Constants ---
-# CRITICAL FIX: Using the correct, modern Algolia endpoint and index name
-ALGOLIA_API_URL = "https://ll8iz711cs-dsn.algolia.net/1/indexes/*/queries?x-algolia-agent=Algolia%20for%20JavaScript%20(4.25.2)%3B%20Browser%20(lite)&x-algolia-api-key=15cb8b0a2d2d435c6613111d860ecfc5&x-algolia-application-id=LL8IZ711CS"
-ALGOLIA_API_HEADERS = {
-    "Accept": "*/*",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Connection": "keep-alive",
-    "Host": "ll8iz711cs-dsn.algolia.net",
-    "Origin": "https://www.bayut.com",
-    "Referer": "https://www.bayut.com/",
-    "Sec-Fetch-Dest": "empty",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Site": "cross-site",
-    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
-    "sec-ch-ua": '"Not)A;Brand";v="8", "Chromium";v="138", "Google Chrome";v="138"',
-    "sec-ch-ua-mobile": "?0",
-    "sec-ch-ua-platform": '"macOS"'
-}
-ALGOLIA_INDEX_NAME = "bayut-production-ads-en"
-IMAGE_URL_PATTERN = "https://images.bayut.com/thumbnails/{image_id}-400x300.webp"
+# Upstream page size used for cached segments; any page/limit is served from these
+ALGOLIA_SEGMENT_SIZE = 50
 
 # --- Database Initialization (inside app context) ---
 with app.app_context():
     database.init_db()
+    # New replicas start warm from a snapshot exported by `flask export-cache-snapshot`
+    snapshot_path = os.environ.get('CACHE_SNAPSHOT')
+    if snapshot_path and os.path.exists(snapshot_path):
+        query_count, listing_count = database.import_cache_snapshot(snapshot_path)
+        print(f"Loaded {query_count} cached queries ({listing_count} listings) from {snapshot_path}.")
 
 
 # --- Helper Functions ---
-def _construct_algolia_payload(filters, page, hits_per_page):
-    """
-    Constructs the dynamic Algolia API payload based on user filters.
-    """
-    # CRITICAL FIX: The query parameter must be handled separately.
-    query_value = filters.get('location_query', '')
-    params_string_parts = [
-        f"page={page}",
-        f"hitsPerPage={hits_per_page}",
-        f"query={requests.utils.quote(query_value)}"  # Correctly uses location_query for the API 'query'
-    ]
-
-    filter_clauses = []
-    if 'purpose' in filters:
-        filter_clauses.append(f'purpose:"{filters["purpose"]}"')
-    if 'rooms' in filters:
-        filter_clauses.append(f'rooms:{filters["rooms"]}')
-    if 'baths' in filters:
-        filter_clauses.append(f'baths:{filters["baths"]}')
-    if 'min_price' in filters:
-        filter_clauses.append(f'price>={filters["min_price"]}')
-    if 'max_price' in filters:
-        filter_clauses.append(f'price<={filters["max_price"]}')
-
-    # CRITICAL FIX: Handle property_types
-    if 'property_types' in filters and filters['property_types']:
-        types_str = " OR ".join([f'category.slug:"{pt}"' for pt in filters['property_types']])
-        filter_clauses.append(f'({types_str})')
-
-    if filter_clauses:
-        full_filters = " AND ".join(filter_clauses)
-        params_string_parts.append(f"filters={requests.utils.quote(full_filters)}")
-
-    # NOTE: The attributesToRetrieve list is very long and has to be included.
-    attrs_to_retrieve = "attributesToRetrieve=%5B%22type%22%2C%22agency%22%2C%22area%22%2C%22baths%22%2C%22category%22%2C%22additionalCategories%22%2C%22contactName%22%2C%22externalID%22%2C%22sourceID%22%2C%22id%22%2C%22location%22%2C%22objectID%22%2C%22phoneNumber%22%2C%22coverPhoto%22%2C%22photoCount%22%2C%22price%22%2C%22product%22%2C%22productLabel%22%2C%22purpose%22%2C%22geography%22%2C%22permitNumber%22%2C%22referenceNumber%22%2C%22rentFrequency%22%2C%22rooms%22%2C%22slug%22%2C%22slug_l1%22%2C%22slug_l2%22%2C%22slug_l3%22%2C%22title%22%2C%22title_l1%22%2C%22title_l2%22%2C%22title_l3%22%2C%22createdAt%22%2C%22updatedAt%22%2C%22ownerID%22%2C%22isVerified%22%2C%22propertyTour%22%2C%22verification%22%2C%22completionDetails%22%2C%22completionStatus%22%2C%22furnishingStatus%22%2C%22-agency.tier%22%2C%22coverVideo%22%2C%22videoCount%22%2C%22description%22%2C%22description_l1%22%2C%22description_l2%22%2C%22description_l3%22%2C%22descriptionTranslated%22%2C%22descriptionTranslated_l1%22%2C%22descriptionTranslated_l2%22%2C%22descriptionTranslated_l3%22%2C%22floorPlanID%22%2C%22panoramaCount%22%2C%22hasMatchingFloorPlans%22%2C%22state%22%2C%22photoIDs%22%2C%22reactivatedAt%22%2C%22hidePrice%22%2C%22extraFields%22%2C%22projectNumber%22%2C%22locationPurposeTier%22%2C%22hasRedirectionLink%22%2C%22ownerAgent%22%2C%22hasEmail%22%2C%22plotArea%22%2C%22offplanDetails%22%2C%22paymentPlans%22%2C%22paymentPlanSummaries%22%2C%22project%22%2C%22availabilityStatus%22%2C%22userExternalID%22%2C%22units%22%2C%22unitCategories%22%2C%22downPayment%22%2C%22clips%22%2C%22contactMethodAvailability%22%2C%22agentAdStoriesCount%22%2C%22isProjectOwned%22%2C%22documents%22%5D"
-    params_string_parts.append(attrs_to_retrieve)
-
-    # We also need to add the other parameters that come after the filters
-    params_string_parts.extend(
-        ["facets=%5B%5D", "maxValuesPerFacet=10", "attributesToHighlight=%5B%5D", "numericFilters="])
-
-    params_string = "&".join(params_string_parts)
-    return {"requests": [{"indexName": ALGOLIA_INDEX_NAME, "params": params_string}]}
-
-
 def _fetch_from_algolia_live(filters, page, limit):
     """
     Fetches data directly from Algolia with filters.
     """
-    payload = _construct_algolia_payload(filters, page - 1, limit)
-
     try:
-        # CRITICAL FIX: Use the correct, global API constants
-        response = requests.post(ALGOLIA_API_URL, headers=ALGOLIA_API_HEADERS, json=payload, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        results = data['results'][0]
-        hits = results['hits']
-
-        extracted_data = []
-        for property_item in hits:
-            property_id = property_item.get('id')
-            title = property_item.get('title')
-            if property_id is None or title is None:
-                continue
-
-            photo_ids = property_item.get('photoIDs', [])
-            all_image_urls = [IMAGE_URL_PATTERN.format(image_id=image_id) for image_id in photo_ids]
-            extracted_data.append({
-                'id': property_id,
-                'title': title,
-                'price': property_item.get('price'),
-                'area': property_item.get('area'),
-                'rooms': property_item.get('rooms'),
-                'baths': property_item.get('baths'),
-                'purpose': property_item.get('purpose'),
-                'completion_status': property_item.get('completionStatus'),
-                'latitude': property_item.get('geography', {}).get('lat'),
-                'longitude': property_item.get('geography', {}).get('lng'),
-                'location_name': property_item.get('location')[-1].get('name') if property_item.get('location') and len(
-                    property_item['location']) > 0 else None,
-                'cover_photo_url': property_item.get('coverPhoto', {}).get('url'),
-                'all_image_urls': all_image_urls,
-                'agency_name': property_item.get('agency', {}).get('name'),
-                'contact_name': property_item.get('contactName'),
-                'mobile_number': property_item.get('phoneNumber', {}).get('mobile'),
-                'whatsapp_number': property_item.get('phoneNumber', {}).get('whatsapp'),
-                'down_payment_percentage': property_item.get('paymentPlanSummaries', [{}])[0].get('breakdown', {}).get(
-                    'downPaymentPercentage') if property_item.get('paymentPlanSummaries') else None
-            })
-
-        return extracted_data, results.get('nbHits', 0)
+        return bayut.fetch_algolia_page(filters, page - 1, limit)
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data from Algolia: {e}")
-        return [], 0
+        return [], 0, 0
     except Exception as e:
         print(f"An unexpected error occurred during Algolia fetch: {e}")
-        return [], 0
+        return [], 0, 0
 
 
 # --- Core Search Logic ---
-def _execute_search(filters, page, limit):
+def _execute_search(filters, page, limit, include_images=True, intent=query_planner.LISTINGS):
     """
     Executes the main search logic, checking cache or fetching live.
     """
-    sorted_filters = sorted(filters.items())
-    query_string = urlencode(sorted_filters)
-
-    query_id = database.find_cached_query(query_string)
-
-    if query_id:
-        properties_data = database.get_properties_for_query(query_id)
-        total_properties = len(properties_data)
-        total_pages = math.ceil(total_properties / limit) if total_properties > 0 else 1
+    # Algolia takes the location as free text, so it is not resolved to a Property Finder ID
+    canonical = canonical_filters.canonicalize(filters, resolve_locations=False,
+                                               defaults=canonical_filters.ALGOLIA_DEFAULTS)
+    upstream_filters = bayut.algolia_filters(canonical)
 
-        start = (page - 1) * limit
-        end = start + limit
-        paginated_properties = properties_data[start:end]
+    def fetch_segment(segment):
+        return _fetch_from_algolia_live(upstream_filters, segment + 1, ALGOLIA_SEGMENT_SIZE)
 
-        return jsonify(
-            {'properties': paginated_properties, 'page': page, 'limit': limit, 'total_properties': total_properties,
-             'total_pages': total_pages})
-    else:
-        print(f"Cache miss for query: {query_string}. Fetching live from Algolia...")
-        properties, total_properties = _fetch_from_algolia_live(filters, page, limit)
-
-        if properties:
-            database.save_query_and_properties(query_string, properties)
-
-        total_pages = math.ceil(total_properties / limit) if total_properties > 0 else 1
+    properties, total_properties = search_cache.read_through(
+        'algolia', canonical, page, limit, ALGOLIA_SEGMENT_SIZE, fetch_segment, include_images, intent)
+    total_pages = math.ceil(total_properties / limit) if total_properties > 0 else 1
 
-        return jsonify({'properties': properties, 'page': page, 'limit': limit, 'total_properties': total_properties,
-                        'total_pages': total_pages})
+    return jsonify({'properties': properties, 'page': page, 'limit': limit, 'total_properties': total_properties,
+                    'total_pages': total_pages})
 
 
 # --- Flask Routes ---
@@ -290,60 +209,141 @@ def api_search():
     }
 
     filters = {k: v for k, v in filters.items() if v is not None}
-    return _execute_search(filters, page, limit)
+    # List views only need the cover photo; images=0 skips the full image lists
+    include_images = request.args.get('images', '1') != '0'
+    # How old the results may be: 'recent', 'listings' (default) or 'analytics'
+    intent = request.args.get('intent', query_planner.LISTINGS, type=str)
+    return _execute_search(filters, page, limit, include_images, intent)
 
 
-def search_properties(filters, page=1, limit=50):
+@app.route('/api/keyword_search', methods=['GET'])
+def api_keyword_search():
     """
-    Fetches property listings using the Property Finder API and caches them.
+    Ranks the listings we already hold against free-text keywords (BM25 over
+    title, location, agency and description). Never goes upstream.
     """
-    print(f"search filters in app.py {filters}")
-    # 1. Prepare filters for the cache key.
-    #    Remove empty or invalid filters before creating the cache key string.
-    cleaned_filters = {k: v for k, v in filters.items() if v and v != ['']}
-
-    # 2. Add 'page' and 'limit' to the cache key to ensure unique cache entries for different paginations.
-    cleaned_filters['page'] = page
-    cleaned_filters['limit'] = limit
-
-    # 3. Create a unique query string for caching.
-    #    'doseq=True' is crucial for handling lists like beds=['3', '4'].
-    sorted_filters = sorted(cleaned_filters.items())
-    query_string = urlencode(sorted_filters, doseq=True)
-
-    # 4. Check the cache.
-    query_id = database.find_cached_query(query_string)
-
-    if query_id:
-        print(f"Cache hit for query: {query_string}")
-        # Retrieve paginated properties from the cache
-        properties_data = database.get_properties_for_query(query_id)
-
-        # Calculate pagination details
-        total_properties = len(properties_data)
-        start = (page - 1) * limit
-        end = start + limit
-        paginated_properties = properties_data[start:end]
-
-        return paginated_properties
+    keywords = request.args.get('q', '', type=str).strip()
+    if not keywords:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    include_images = request.args.get('images', '1') != '0'
+
+    properties, total_properties = database.search_listing_text(keywords, limit, (page - 1) * limit, include_images)
+    total_pages = math.ceil(total_properties / limit) if total_properties > 0 else 1
+    return jsonify({'properties': properties, 'page': page, 'limit': limit, 'total_properties': total_properties,
+                    'total_pages': total_pages})
+
+
+MAP_DATA_MAX_LIMIT = 2000
+
+
+def _bbox_args():
+    """Reads north/south/east/west from the query string or a JSON body. Returns floats or None."""
+    source = request.get_json(silent=True) or request.args
+    try:
+        return tuple(float(source[key]) for key in ('south', 'west', 'north', 'east'))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@app.route('/api/map_data', methods=['GET', 'POST'])
+def api_map_data():
+    """
+    Returns cached listings inside a bounding box (north, south, east, west),
+    projected to map_tiles.MAP_FIELDS and capped at `limit` (default 500).
+    """
+    bbox = _bbox_args()
+    if bbox is None:
+        return jsonify({"error": "Missing geographical bounds (north, east, south, west)"}), 400
+    south, west, north, east = bbox
+    limit = min(max(request.args.get('limit', 500, type=int), 1), MAP_DATA_MAX_LIMIT)
+
+    listings, total = database.get_listings_in_bbox(south, west, north, east, limit)
+    properties = [{field: listing.get(field) for field in map_tiles.MAP_FIELDS} for listing in listings]
+    return jsonify({'properties': properties, 'total_in_bounds': total, 'truncated': total > len(properties)})
+
+
+@app.route('/api/map_clusters', methods=['GET', 'POST'])
+def api_map_clusters():
+    """
+    Returns pre-aggregated marker clusters (count, centroid, min/median price)
+    for a bounding box at a map zoom level. Payload size is bounded at every zoom.
+    """
+    bbox = _bbox_args()
+    zoom = request.args.get('zoom', type=int)
+    if zoom is None:
+        zoom = (request.get_json(silent=True) or {}).get('zoom')
+    if bbox is None or zoom is None:
+        return jsonify({"error": "Bounds (north, east, south, west) and zoom are required"}), 400
+    south, west, north, east = bbox
+
+    tiles, cell_zoom, clusters = map_tiles.get_map_clusters(south, west, north, east, int(zoom))
+    return jsonify({'zoom': int(zoom), 'cell_zoom': cell_zoom, 'tiles': tiles, 'clusters': clusters})
+
+
+@app.route('/api/map_tiles', methods=['GET', 'POST'])
+def api_map_tiles():
+    """
+    Delta map updates. Returns only the viewport tiles (clusters, or listings
+    from map_tiles.LISTING_ZOOM up) the client does not already hold. The
+    client passes its tiles as `have` ("tile_id:etag,...") or echoes back the
+    `state` token of its previous response.
+    """
+    body = request.get_json(silent=True) or {}
+    bbox = _bbox_args()
+    zoom = request.args.get('zoom', body.get('zoom'), type=int)
+    if bbox is None or zoom is None:
+        return jsonify({"error": "Bounds (north, east, south, west) and zoom are required"}), 400
+    south, west, north, east = bbox
+
+    state = request.args.get('state', body.get('state'))
+    held = map_tiles.decode_state(state) if state else map_tiles.parse_have(request.args.get('have', body.get('have')))
+    delta = map_tiles.viewport_delta(south, west, north, east, zoom, held)
+    return jsonify(dict(delta, zoom=zoom))
+
+
+@app.route('/api/map_tiles/<tile_id>', methods=['GET'])
+def api_map_tile(tile_id):
+    """A single tile by its stable ID, cacheable by browsers and CDNs (ETag + max-age)."""
+    try:
+        payload = map_tiles.tile_payload(tile_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.if_none_match.contains(payload['etag']):
+        response = app.response_class(status=304)
     else:
-        print(f"Cache miss for query: {query_string}. Fetching live from Property Finder...")
-
-        # 5. Fetch live data from Property Finder.
-        #    Note: The Property Finder API itself does not have a 'limit' parameter,
-        #    so you can pass the 'page' and other filters directly.
-        # Wrap filters in the expected structure for property_finder_search
-        # Convert 'query' to 'location_query' for Property Finder API
-        if 'query' in cleaned_filters:
-            cleaned_filters['location_query'] = cleaned_filters.pop('query')
-        
-        search_params = {"filters": cleaned_filters}
-        properties = property_finder.property_finder_search(search_params)
+        response = jsonify(payload)
+    response.set_etag(payload['etag'])
+    response.headers['Cache-Control'] = f"public, max-age={cache_policy.get('map_tile').ttl_seconds}"
+    return response
+
+
+@app.route('/api/query_plans', methods=['GET'])
+def api_query_plans():
+    """Recent query planner decisions and how often each source answered."""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    query_planner.flush_log()
+    return jsonify({'summary': database.query_plan_summary(), 'plans': database.get_query_plans(limit)})
 
-    if properties:
-            # 6. Save the live data to the database.
-        database.save_query_and_properties(query_string, properties)
 
+@app.route('/api/locations', methods=['GET'])
+def api_locations():
+    """Resolves a location name against the gazetteer: the location, its parents and its children."""
+    location = gazetteer.resolve(request.args.get('q', '', type=str), request.args.get('level', type=str))
+    if location is None:
+        return jsonify({'error': 'Unknown location'}), 404
+    return jsonify({'location': location, 'ancestors': gazetteer.ancestors(location['id'])[1:],
+                    'children': gazetteer.children(location['id']),
+                    'descendant_count': len(gazetteer.descendants(location['id']))})
+
+
+def search_properties(filters, page=1, limit=50, intent=query_planner.LISTINGS):
+    """
+    Fetches property listings using the Property Finder API and caches them.
+    """
+    print(f"search filters in app.py {filters}")
+    properties, _ = search_cache.search_property_finder(filters, page, limit, intent)
     return properties
 
 
@@ -770,7 +770,8 @@ def nl_search():
                     
                     if sub_type == "analytical_question":
                         # Get properties for analysis
-                        listings = search_properties(sub_filters)
+                        listings = search_properties(
+                            sub_filters, intent=query_planner.classify_intent(sub_query, analytical=True))
                         
                         # Generate analytical response
                         if "average" in sub_query.lower() and "price" in sub_query.lower():
@@ -813,7 +814,7 @@ def nl_search():
                         combined_response["combined_data"].extend(listings if listings else [])
                     else:
                         # Handle search request
-                        listings = search_properties(sub_filters)
+                        listings = search_properties(sub_filters, intent=query_planner.classify_intent(sub_query))
                         combined_response["answers"].append({
                             "query": sub_query,
                             "answer": {
@@ -851,7 +852,8 @@ def nl_search():
 
     # Handle analytical questions FIRST (before other question types)
     if q_type == "analytical_question":
-        return handle_analytical_question(query, filters, search_properties)
+        intent = query_planner.classify_intent(query, analytical=True)
+        return handle_analytical_question(query, filters, partial(search_properties, intent=intent))
 
     # ✅ If it's a QUESTION (Q&A mode)
     if filters.get("is_question"):
@@ -875,7 +877,8 @@ def nl_search():
 
         # Fetch listings once for analysis
         try:
-            listings = search_properties(inner_filters)
+            listings = search_properties(
+                inner_filters, intent=query_planner.classify_intent(query, analytical=True))
         except Exception as e:
             print(f"Error fetching properties for question: {e}")
             listings = []
@@ -1060,7 +1063,7 @@ def nl_search():
         }), 200
 
     # ✅ Default: Normal property search
-    listings = search_properties(filters.get('filters', {}))
+    listings = search_properties(filters.get('filters', {}), intent=query_planner.classify_intent(query))
     
     # Add agent capabilities to the response
     response = {
@@ -1078,22 +1081,7 @@ def nl_search():
     # Generate insights if we have results
     if listings:
         # Price analysis
-        prices = [item.get("price", 0) for item in listings if item.get("price")]
-        if prices:
-            avg_price = sum(prices) / len(prices)
-            min_price = min(prices)
-            max_price = max(prices)
-            
-            response["agent_insights"].append({
-                "type": "price_analysis",
-                "title": "Price Insights",
-                "message": f"Found {len(listings)} properties with prices ranging from AED {min_price:,.0f} to AED {max_price:,.0f}",
-                "data": {
-                    "average_price": avg_price,
-                    "price_range": {"min": min_price, "max": max_price},
-                    "property_count": len(listings)
-                }
-            })
+        response["agent_insights"].extend(_price_insights(listings, filters.get('filters', {})))
         
         # Location analysis
         locations = [item.get("location_name", "") for item in listings if item.get("location_name")]
@@ -1171,9 +1159,8 @@ def estimate_property_price(listings, filters):
     #         "data": [],
     #     }
 
-    # Extract prices and sizes
-    prices = [item.get("price") for item in listings if item.get("price")]
-    sizes = [item.get("area") for item in listings if item.get("area")]
+    # Price and size statistics of the listings at hand
+    stats = market_snapshot.listing_summary(listings)
     print(listings)
 
     # if not prices or not sizes:
@@ -1193,10 +1180,10 @@ def estimate_property_price(listings, filters):
     #         "data": listings,
     #     }
 
-    avg_price = sum(prices) / len(prices)
-    avg_size = sum(sizes) / len(sizes)
+    avg_price = stats["average_price"]
+    avg_size = stats["average_area"]
 
-    price_per_sqft = avg_price / avg_size if avg_size else None
+    price_per_sqft = stats["price_per_sqft"]
     print(f"Avarage prices is {avg_price} annd avarage size is {avg_size} and price/ size is {price_per_sqft}")
 
     estimated_price = None
@@ -1213,18 +1200,26 @@ def estimate_property_price(listings, filters):
         result_text += f" Estimated price for your property ({filters.get('max_area')} sqft) is around AED {estimated_price:,.0f}."
         result_text += f" you can review similar properties in the same location: "
 
+    # The whole market from the columnar snapshot, reported beside the sample the figures above describe.
+    # The sample comes from a Property Finder search, so its defaults (sale) apply to the market too.
+    market = market_snapshot.market_summary(filters, defaults=canonical_filters.DEFAULTS)
+    if market:
+        result_text += (f" Across all {market['count']:,} comparable listings on the market the average is "
+                        f"AED {market['average_price']:,.0f}.")
+
     return {
         "is_question": True,
         "question_type": "estimate_price",
         "filters": filters,
         "answer": {
             "avg_price": round(avg_price),
-            "min_price": min(prices),
-            "max_price": max(prices),
+            "min_price": stats["min_price"],
+            "max_price": stats["max_price"],
             "sample_size": len(listings),
             "price_per_sqft": round(price_per_sqft) if price_per_sqft else None,
             "estimated_price": estimated_price,
             "text": result_text,
+            "market": market,
         },
         "data": listings,
     }
@@ -1291,7 +1286,9 @@ def get_image():
         response = requests.get(image_url, headers={'Referer': 'https://www.propertyfinder.ae/'}, timeout=10)
         response.raise_for_status()
         content_type = response.headers.get('Content-Type', 'application/octet-stream')
-        return send_file(io.BytesIO(response.content), mimetype=content_type)
+        image_response = send_file(io.BytesIO(response.content), mimetype=content_type)
+        image_response.headers['Cache-Control'] = f"public, max-age={cache_policy.get('image').ttl_seconds}"
+        return image_response
     except requests.exceptions.Timeout:
         return "Image fetch timed out", 408
     except requests.exceptions.RequestException as e:
@@ -1304,20 +1301,10 @@ def property_detail(property_id):
     """
     Renders a detailed page for a single property.
     """
-    db = database.get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM cached_properties WHERE id = ?", (property_id,))
-    property_row = cursor.fetchone()
-
-    if property_row is None:
+    property_dict = database.get_cached_property(property_id) or warehouse.get_listing(property_id)
+    if property_dict is None:
         abort(404, description="Property not found.")
 
-    property_dict = dict(property_row)
-    if property_dict['all_image_urls']:
-        property_dict['all_image_urls'] = property_dict['all_image_urls'].split(',')
-    else:
-        property_dict['all_image_urls'] = []
-
     return render_template('property_detail.html', property=property_dict)
 
 
@@ -1327,20 +1314,10 @@ def api_property_detail(property_id):
     Returns a single property's details as a JSON object,
     first from cache, then from a live API fallback.
     """
-    db = database.get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM cached_properties WHERE id = ?", (property_id,))
-    property_row = cursor.fetchone()
-
-    if property_row is None:
+    property_dict = database.get_cached_property(property_id) or warehouse.get_listing(property_id)
+    if property_dict is None:
         abort(404, description="Property not found in cache.")
 
-    property_dict = dict(property_row)
-    if property_dict['all_image_urls']:
-        property_dict['all_image_urls'] = property_dict['all_image_urls'].split(',')
-    else:
-        property_dict['all_image_urls'] = []
-
     return jsonify(property_dict)
 
 
@@ -0,0 +1,186 @@
+"""
+Bayut listings through the public Algolia search index behind bayut.com.
+"""
+import json
+
+import requests
+
+# CRITICAL FIX: Using the correct, modern Algolia endpoint and index name
+ALGOLIA_API_URL = "https://ll8iz711cs-dsn.algolia.net/1/indexes/*/queries?x-algolia-agent=Algolia%20for%20JavaScript%20(4.25.2)%3B%20Browser%20(lite)&x-algolia-api-key=15cb8b0a2d2d435c6613111d860ecfc5&x-algolia-application-id=LL8IZ711CS"
+ALGOLIA_API_HEADERS = {
+    "Accept": "*/*",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+    "Host": "ll8iz711cs-dsn.algolia.net",
+    "Origin": "https://www.bayut.com",
+    "Referer": "https://www.bayut.com/",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "cross-site",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
+    "sec-ch-ua": '"Not)A;Brand";v="8", "Chromium";v="138", "Google Chrome";v="138"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"macOS"'
+}
+ALGOLIA_INDEX_NAME = "bayut-production-ads-en"
+IMAGE_URL_PATTERN = "https://images.bayut.com/thumbnails/{image_id}-400x300.webp"
+
+# Listing purposes and category slugs of the index, used to partition bulk crawls
+PURPOSES = ("for-sale", "for-rent")
+CATEGORY_SLUGS = (
+    "apartments", "villas", "townhouses", "penthouses", "hotel-apartments", "villa-compound",
+    "residential-plots", "residential-floors", "residential-building", "offices", "shops", "warehouses",
+    "labour-camps", "commercial-villas", "bulk-units", "commercial-plots", "commercial-floors",
+    "commercial-buildings", "factories", "industrial-land", "mixed-use-land", "showrooms", "other-commercial",
+)
+
+
+def construct_algolia_payload(filters, page, hits_per_page, attributes=None):
+    """
+    Constructs the dynamic Algolia API payload based on user filters.
+    `attributes` narrows the retrieved attributes (e.g. to IDs only).
+    """
+    # CRITICAL FIX: The query parameter must be handled separately.
+    query_value = filters.get('location_query', '')
+    params_string_parts = [
+        f"page={page}",
+        f"hitsPerPage={hits_per_page}",
+        f"query={requests.utils.quote(query_value)}"  # Correctly uses location_query for the API 'query'
+    ]
+
+    filter_clauses = []
+    if 'purpose' in filters:
+        filter_clauses.append(f'purpose:"{filters["purpose"]}"')
+    for key in ('rooms', 'baths'):
+        if key in filters:
+            values = filters[key] if isinstance(filters[key], list) else [filters[key]]
+            filter_clauses.append("(" + " OR ".join(f'{key}:{value}' for value in values) + ")")
+    if 'min_price' in filters:
+        filter_clauses.append(f'price>={filters["min_price"]}')
+    if 'max_price' in filters:
+        filter_clauses.append(f'price<={filters["max_price"]}')
+    if 'price_below' in filters:
+        # Exclusive upper bound, so adjacent price ranges never share a listing
+        filter_clauses.append(f'price<{filters["price_below"]}')
+    if 'updated_since' in filters:
+        # Edited or reactivated since (epoch seconds), for incremental syncs
+        since = int(filters["updated_since"])
+        filter_clauses.append(f'(updatedAt>{since} OR reactivatedAt>{since})')
+
+    # CRITICAL FIX: Handle property_types
+    if 'property_types' in filters and filters['property_types']:
+        types_str = " OR ".join([f'category.slug:"{pt}"' for pt in filters['property_types']])
+        filter_clauses.append(f'({types_str})')
+
+    if filter_clauses:
+        full_filters = " AND ".join(filter_clauses)
+        params_string_parts.append(f"filters={requests.utils.quote(full_filters)}")
+
+    # NOTE: The attributesToRetrieve list is very long and has to be included.
+    attrs_to_retrieve = "attributesToRetrieve=%5B%22type%22%2C%22agency%22%2C%22area%22%2C%22baths%22%2C%22category%22%2C%22additionalCategories%22%2C%22contactName%22%2C%22externalID%22%2C%22sourceID%22%2C%22id%22%2C%22location%22%2C%22objectID%22%2C%22phoneNumber%22%2C%22coverPhoto%22%2C%22photoCount%22%2C%22price%22%2C%22product%22%2C%22productLabel%22%2C%22purpose%22%2C%22geography%22%2C%22permitNumber%22%2C%22referenceNumber%22%2C%22rentFrequency%22%2C%22rooms%22%2C%22slug%22%2C%22slug_l1%22%2C%22slug_l2%22%2C%22slug_l3%22%2C%22title%22%2C%22title_l1%22%2C%22title_l2%22%2C%22title_l3%22%2C%22createdAt%22%2C%22updatedAt%22%2C%22ownerID%22%2C%22isVerified%22%2C%22propertyTour%22%2C%22verification%22%2C%22completionDetails%22%2C%22completionStatus%22%2C%22furnishingStatus%22%2C%22-agency.tier%22%2C%22coverVideo%22%2C%22videoCount%22%2C%22description%22%2C%22description_l1%22%2C%22description_l2%22%2C%22description_l3%22%2C%22descriptionTranslated%22%2C%22descriptionTranslated_l1%22%2C%22descriptionTranslated_l2%22%2C%22descriptionTranslated_l3%22%2C%22floorPlanID%22%2C%22panoramaCount%22%2C%22hasMatchingFloorPlans%22%2C%22state%22%2C%22photoIDs%22%2C%22reactivatedAt%22%2C%22hidePrice%22%2C%22extraFields%22%2C%22projectNumber%22%2C%22locationPurposeTier%22%2C%22hasRedirectionLink%22%2C%22ownerAgent%22%2C%22hasEmail%22%2C%22plotArea%22%2C%22offplanDetails%22%2C%22paymentPlans%22%2C%22paymentPlanSummaries%22%2C%22project%22%2C%22availabilityStatus%22%2C%22userExternalID%22%2C%22units%22%2C%22unitCategories%22%2C%22downPayment%22%2C%22clips%22%2C%22contactMethodAvailability%22%2C%22agentAdStoriesCount%22%2C%22isProjectOwned%22%2C%22documents%22%5D"
+    if attributes is not None:
+        attrs_to_retrieve = f"attributesToRetrieve={requests.utils.quote(json.dumps(list(attributes)))}"
+    params_string_parts.append(attrs_to_retrieve)
+
+    # We also need to add the other parameters that come after the filters
+    params_string_parts.extend(
+        ["facets=%5B%5D", "maxValuesPerFacet=10", "attributesToHighlight=%5B%5D", "numericFilters="])
+
+    params_string = "&".join(params_string_parts)
+    return {"requests": [{"indexName": ALGOLIA_INDEX_NAME, "params": params_string}]}
+
+
+def algolia_filters(canonical):
+    """
+    The Algolia filters of a canonical filter dict (see canonical_filters),
+    so the upstream request is built from exactly what the cache key hashes.
+    """
+    filters = {}
+    if 'query' in canonical:
+        filters['location_query'] = canonical['query']
+    if 'purpose' in canonical:
+        purpose = f"for-{canonical['purpose']}"
+        filters['purpose'] = purpose if purpose in PURPOSES else canonical['purpose']
+    if 'beds' in canonical:
+        filters['rooms'] = canonical['beds']
+    for key in ('baths', 'min_price', 'max_price'):
+        if key in canonical:
+            filters[key] = canonical[key]
+    if 'property_type' in canonical:
+        # Several types become an OR of their category slugs
+        property_types = canonical['property_type']
+        if not isinstance(property_types, list):
+            property_types = [property_types]
+        slugs = [property_type.replace(' ', '-') for property_type in property_types]
+        filters['property_types'] = [slug + 's' if slug + 's' in CATEGORY_SLUGS else slug for slug in slugs]
+    return filters
+
+
+def map_algolia_hit(property_item):
+    """
+    Maps a single Algolia hit to the database schema format.
+    Returns None for hits without an ID or title.
+    """
+    property_id = property_item.get('id')
+    title = property_item.get('title')
+    if property_id is None or title is None:
+        return None
+
+    photo_ids = property_item.get('photoIDs', [])
+    all_image_urls = [IMAGE_URL_PATTERN.format(image_id=image_id) for image_id in photo_ids]
+    return {
+        'id': property_id,
+        'title': title,
+        'price': property_item.get('price'),
+        'area': property_item.get('area'),
+        'rooms': property_item.get('rooms'),
+        'baths': property_item.get('baths'),
+        'purpose': property_item.get('purpose'),
+        'completion_status': property_item.get('completionStatus'),
+        'latitude': property_item.get('geography', {}).get('lat'),
+        'longitude': property_item.get('geography', {}).get('lng'),
+        'location_name': property_item.get('location')[-1].get('name') if property_item.get('location') and len(
+            property_item['location']) > 0 else None,
+        'cover_photo_url': property_item.get('coverPhoto', {}).get('url'),
+        'all_image_urls': all_image_urls,
+        'agency_name': property_item.get('agency', {}).get('name'),
+        'contact_name': property_item.get('contactName'),
+        'mobile_number': property_item.get('phoneNumber', {}).get('mobile'),
+        'whatsapp_number': property_item.get('phoneNumber', {}).get('whatsapp'),
+        'down_payment_percentage': property_item.get('paymentPlanSummaries', [{}])[0].get('breakdown', {}).get(
+            'downPaymentPercentage') if property_item.get('paymentPlanSummaries') else None
+    }
+
+
+def fetch_algolia_page(filters, page, hits_per_page, mapper=map_algolia_hit, attributes=None):
+    """
+    Fetches one zero-based page of hits and maps each with `mapper` (None
+    returns the raw hits). Returns (listings, total_hits, total_pages).
+    Request and HTTP errors are raised.
+    """
+    payload = construct_algolia_payload(filters, page, hits_per_page, attributes)
+    response = requests.post(ALGOLIA_API_URL, headers=ALGOLIA_API_HEADERS, json=payload, timeout=30)
+    response.raise_for_status()
+    results = response.json()['results'][0]
+    if mapper is None:
+        return results['hits'], results.get('nbHits', 0), results.get('nbPages', 0)
+    listings = [listing for listing in (mapper(hit) for hit in results['hits']) if listing]
+    return listings, results.get('nbHits', 0), results.get('nbPages', 0)
+
+
+def map_algolia_hit_details(property_item):
+    """
+    Like map_algolia_hit, plus the fields the listing warehouse keeps:
+    property type, description, the full location path and the listing date.
+    """
+    listing = map_algolia_hit(property_item)
+    if listing is None:
+        return None
+    categories = property_item.get('category') or []
+    listing['property_type'] = categories[-1].get('slug') if categories else None
+    listing['description'] = property_item.get('description')
+    listing['location_path'] = ", ".join(
+        location.get('name') for location in reversed(property_item.get('location') or []) if location.get('name'))
+    listing['listed_at'] = property_item.get('createdAt')
+    return listing
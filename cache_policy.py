@@ -0,0 +1,94 @@
+"""
+Cache policy registry.
+
+Every cached artifact type has one declarative policy: how long it may be
+served (ttl_seconds), after how long it should be refreshed when possible
+(soft_ttl_seconds, stale values remain a fallback until the hard TTL), how
+much memory its in-process cache may use (max_bytes) and how that cache
+evicts ('lru', or 'tinylfu' to also gate admission on request frequency).
+
+Defaults live in DEFAULT_POLICIES and can be overridden per artifact from
+app.config['CACHE_POLICIES'] or a CACHE_POLICIES JSON environment variable:
+
+    CACHE_POLICIES='{"location_id": {"ttl_seconds": 1209600}}'
+"""
+import json
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+EVICTION_POLICIES = ("lru", "tinylfu")
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    ttl_seconds: int
+    soft_ttl_seconds: Optional[int] = None
+    max_bytes: Optional[int] = None
+    eviction: str = "lru"
+
+
+DEFAULT_POLICIES = {
+    # Listing pages and their upstream totals (SQLite tables + L1)
+    "search_results": CachePolicy(ttl_seconds=30 * MINUTE, max_bytes=64 * 1024 * 1024, eviction="tinylfu"),
+    # Complete pages published to a remote backend; expire with their search_results entry
+    "search_page": CachePolicy(ttl_seconds=30 * MINUTE),
+    # Location name -> location ID; almost never changes
+    "location_id": CachePolicy(ttl_seconds=7 * DAY, soft_ttl_seconds=1 * DAY, max_bytes=1024 * 1024),
+    # Property Finder Next.js build ID; changes whenever they deploy
+    "build_id": CachePolicy(ttl_seconds=6 * HOUR, soft_ttl_seconds=30 * MINUTE),
+    # Natural-language parses from LLaMA (ollam) and the agent's LLM
+    "llm_parse": CachePolicy(ttl_seconds=7 * DAY, soft_ttl_seconds=1 * DAY),
+    "agent_parse": CachePolicy(ttl_seconds=7 * DAY, soft_ttl_seconds=1 * DAY),
+    # Map tile payloads (clusters or listings per tile); also their HTTP max-age
+    "map_tile": CachePolicy(ttl_seconds=1 * MINUTE, max_bytes=16 * 1024 * 1024),
+    # Crawled listings in the local warehouse: served while a covering crawl
+    # finished within ttl_seconds; listings unseen for that long are dropped
+    "warehouse": CachePolicy(ttl_seconds=2 * DAY, soft_ttl_seconds=1 * DAY),
+    # Proxied listing images (HTTP caching by browsers and CDNs)
+    "image": CachePolicy(ttl_seconds=7 * DAY),
+}
+
+_policies = {}
+
+
+def get(name):
+    """Returns the policy for an artifact type."""
+    try:
+        return _policies[name]
+    except KeyError:
+        raise KeyError(f"No cache policy registered for '{name}'") from None
+
+
+def register(name, policy):
+    _policies[name] = policy
+
+
+def configure(overrides=None):
+    """
+    Resets the registry to the defaults, then applies overrides from the
+    CACHE_POLICIES environment variable and `overrides` (in that order).
+    Each override is a dict of CachePolicy fields for one artifact type.
+    """
+    _policies.clear()
+    _policies.update(DEFAULT_POLICIES)
+
+    env_overrides = os.environ.get("CACHE_POLICIES")
+    for source in (json.loads(env_overrides) if env_overrides else None, overrides):
+        for name, fields in (source or {}).items():
+            base = _policies.get(name, CachePolicy(ttl_seconds=30 * MINUTE))
+            policy = replace(base, **fields)
+            if policy.eviction not in EVICTION_POLICIES:
+                raise ValueError(f"Unknown eviction policy for '{name}': {policy.eviction}")
+            _policies[name] = policy
+
+
+def all_policies():
+    return dict(_policies)
+
+
+configure()
@@ -0,0 +1,335 @@
+"""
+Canonical filter model used to build search cache keys.
+
+Filters arrive from several parsers (regex, LLaMA, query-string APIs) with
+different key names, casing, types and synonyms. They are normalized into one
+vocabulary (the Property Finder filter names) before hashing, so equivalent
+searches share a cache entry.
+"""
+import hashlib
+import json
+import re
+import time
+
+import requests
+
+import cache_policy
+import database
+import gazetteer
+import memory_cache
+import property_finder
+
+# Alternative key names produced by the different parsers
+KEY_SYNONYMS = {
+    "location_query": "query",
+    "location": "query",
+    "rooms": "beds",
+    "bedrooms": "beds",
+    "bathrooms": "baths",
+    "property_types": "property_type",
+}
+
+PURPOSE_SYNONYMS = {
+    "sale": "sale", "for-sale": "sale", "for sale": "sale", "buy": "sale",
+    "rent": "rent", "for-rent": "rent", "for rent": "rent", "rental": "rent",
+}
+
+PROPERTY_TYPE_SYNONYMS = {
+    "flat": "apartment",
+    "house": "villa",
+    "studio": "apartment",
+    "hotel apartment": "hotel & hotel apartment",
+    "building": "whole building",
+}
+
+# Short names people type for well-known communities
+LOCATION_ALIASES = {
+    "marina": "dubai marina",
+    "downtown": "downtown dubai",
+    "jvc": "jumeirah village circle",
+    "jvt": "jumeirah village triangle",
+    "jlt": "jumeirah lake towers",
+    "jbr": "jumeirah beach residence",
+    "the palm": "palm jumeirah",
+    "palm": "palm jumeirah",
+    "difc": "dubai international financial centre",
+    "mbr city": "mohammed bin rashid city",
+}
+
+# Values the upstream search applies when a filter is missing
+DEFAULTS = {
+    "purpose": "sale",
+    "sort": "mr",
+}
+# Algolia applies no defaults: a missing purpose searches every purpose
+ALGOLIA_DEFAULTS = {}
+
+INT_KEYS = {"beds", "baths", "min_price", "max_price", "min_area", "max_area", "listed_within"}
+
+# Radius search around a gazetteer landmark (see landmarks.py), answered from the local geo index
+GEO_KEYS = {"near", "radius_km"}
+
+# Request parameters that never affect which listings match
+NON_FILTER_KEYS = {"page", "limit"}
+
+
+def normalize_text(value):
+    return re.sub(r"\s+", " ", str(value)).strip().casefold()
+
+
+def normalize_location(value):
+    location = normalize_text(value)
+    location = LOCATION_ALIASES.get(location, location)
+    # Gazetteer aliases ("the X", "X, Community" forms) collapse onto the location's own name
+    known = gazetteer.resolve(location)
+    return normalize_text(known['name']) if known else location
+
+
+def _to_int(value):
+    if isinstance(value, str):
+        value = value.strip().replace(",", "")
+        if value.casefold() == "studio":
+            return 0
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalize_property_type(value):
+    property_type = normalize_text(value)
+    property_type = PROPERTY_TYPE_SYNONYMS.get(property_type, property_type)
+    if property_type not in property_finder.PROPERTY_TYPE_MAP and property_type.endswith("s"):
+        property_type = property_type[:-1]
+    return property_type
+
+
+def _normalize_value(key, value):
+    if key in INT_KEYS:
+        if isinstance(value, (list, tuple)):
+            numbers = sorted({n for n in (_to_int(v) for v in value) if n is not None})
+            if not numbers:
+                return None
+            return numbers[0] if len(numbers) == 1 else numbers
+        return _to_int(value)
+    if key == "radius_km":
+        try:
+            return round(float(value), 3)
+        except (TypeError, ValueError):
+            return None
+    if key == "purpose":
+        purpose = normalize_text(value)
+        return PURPOSE_SYNONYMS.get(purpose, purpose)
+    if key == "property_type":
+        if isinstance(value, (list, tuple)):
+            # Several types match any of them; the key keeps them all, sorted
+            types = sorted({_normalize_property_type(v) for v in value if v})
+            if not types:
+                return None
+            return types[0] if len(types) == 1 else types
+        return _normalize_property_type(value)
+    if key == "query":
+        return normalize_location(value)
+    if isinstance(value, (list, tuple)):
+        return sorted(normalize_text(v) for v in value)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value
+    return normalize_text(value)
+
+
+def resolve_location_id(location):
+    """
+    Resolves a normalized location name to a Property Finder location ID,
+    using the gazetteer and the in-process and cached alias tables before
+    asking the locations API.
+    """
+    known = gazetteer.resolve(location)
+    if known:
+        return known['id']
+
+    location_id = memory_cache.location_id_cache.get(location)
+    if location_id:
+        return location_id
+
+    location_id = database.find_cached_location_id(location)
+    if location_id:
+        _remember_location_id(location, location_id)
+        return location_id
+
+    try:
+        locations = property_finder.search_location(location)
+    except requests.exceptions.RequestException as e:
+        print(f"Error resolving location '{location}': {e}")
+        # Past the soft TTL an old ID is still better than none
+        return database.find_cached_location_id(location, allow_stale=True)
+
+    attributes = locations.get("data", {}).get("attributes", [])
+    if not attributes:
+        return None
+
+    location_id = str(attributes[0]["id"])
+    database.save_location_id(location, location_id)
+    _remember_location_id(location, location_id)
+    return location_id
+
+
+def _remember_location_id(location, location_id):
+    # The in-process copy never outlives the backend entry's freshness
+    policy = cache_policy.get("location_id")
+    memory_cache.location_id_cache.put(location, location_id,
+                                       time.time() + (policy.soft_ttl_seconds or policy.ttl_seconds))
+
+
+def canonicalize(filters, resolve_locations=True, defaults=DEFAULTS):
+    """
+    Returns the canonical form of a filter dict: synonym keys renamed, values
+    typed and normalized, empty values dropped, the upstream's `defaults`
+    filled in and the location resolved to a location ID where possible.
+    """
+    canonical = {}
+    for key, value in filters.items():
+        key = KEY_SYNONYMS.get(key, key)
+        if key in NON_FILTER_KEYS or value is None or value == "" or value == [] or value == [""]:
+            continue
+        value = _normalize_value(key, value)
+        if value is None or value == "" or value == []:
+            continue
+        canonical[key] = value
+
+    # "studio" means zero bedrooms, unless other types are asked for too
+    property_types = filters.get("property_type")
+    if not isinstance(property_types, (list, tuple)):
+        property_types = [property_types]
+    if property_types and all(value and normalize_text(value) == "studio" for value in property_types):
+        canonical.setdefault("beds", 0)
+
+    for key, default in defaults.items():
+        canonical.setdefault(key, default)
+
+    if resolve_locations and "query" in canonical and "location_id" not in canonical:
+        location_id = resolve_location_id(canonical["query"])
+        if location_id:
+            canonical["location_id"] = location_id
+
+    return canonical
+
+
+def cache_key(canonical, namespace):
+    """
+    Hashes canonical filters into a compact cache key. Once a location is
+    resolved its ID identifies it, so the free-text spelling is left out.
+    """
+    keyed = dict(canonical)
+    if "location_id" in keyed:
+        keyed.pop("query", None)
+    encoded = json.dumps(keyed, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{namespace}:{hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:20]}"
+
+
+# Filters that can be re-evaluated locally against cached rows: key -> (column, operator)
+RESIDUAL_FILTERS = {
+    "beds": ("rooms", "IN"),
+    "baths": ("baths", "IN"),
+    "min_price": ("price", ">="),
+    "max_price": ("price", "<="),
+    "min_area": ("area", ">="),
+    "max_area": ("area", "<="),
+    "keywords": ("text", "MATCH"),  # full-text match over the listing_search index
+}
+
+
+def _as_set(value):
+    return set(value) if isinstance(value, list) else {value}
+
+
+def keyword_terms(value):
+    if isinstance(value, list):
+        value = " ".join(value)
+    return set(re.findall(r"\w+", normalize_text(value)))
+
+
+def _residual_is_narrower(key, broad_value, narrow_value):
+    operator = RESIDUAL_FILTERS[key][1]
+    if operator == "MATCH":
+        # Every word must match, so more words select a subset
+        return keyword_terms(narrow_value) >= keyword_terms(broad_value)
+    if operator == "IN":
+        return _as_set(narrow_value) <= _as_set(broad_value)
+    if operator == ">=":
+        return narrow_value >= broad_value
+    return narrow_value <= broad_value
+
+
+def subsumes(broad, narrow):
+    """
+    True if every listing matching the canonical filters `narrow` also
+    matches `broad`, and the difference can be evaluated locally.
+    """
+    location_key = "location_id" if "location_id" in broad and "location_id" in narrow else "query"
+    ignored = {"location_id", "query"}
+    for key in (set(broad) | set(narrow)) - ignored - set(RESIDUAL_FILTERS):
+        if broad.get(key) != narrow.get(key):
+            return False
+    if broad.get(location_key) != narrow.get(location_key):
+        return False
+
+    for key in RESIDUAL_FILTERS:
+        if key not in broad:
+            continue
+        if key not in narrow or not _residual_is_narrower(key, broad[key], narrow[key]):
+            return False
+    return True
+
+
+def residual_predicates(broad, narrow):
+    """
+    Returns the (column, operator, value) predicates that select `narrow`
+    out of the rows cached for `broad`.
+    """
+    predicates = []
+    for key, (column, operator) in RESIDUAL_FILTERS.items():
+        if key in narrow and narrow[key] != broad.get(key):
+            if operator == "IN":
+                value = sorted(_as_set(narrow[key]))
+            elif operator == "MATCH":
+                value = " ".join(sorted(keyword_terms(narrow[key])))
+            else:
+                value = narrow[key]
+            predicates.append((column, operator, value))
+    return predicates
+
+
+def matches(listing, canonical, ignored_terms=()):
+    """
+    Evaluates the residual filters of `canonical` against one listing dict.
+    Keyword terms in `ignored_terms` are not required to appear in its text.
+    """
+    for key, (column, operator) in RESIDUAL_FILTERS.items():
+        if key not in canonical:
+            continue
+        if operator == "MATCH":
+            terms = keyword_terms(canonical[key]) - set(ignored_terms)
+            text = " ".join(str(listing.get(field) or "") for field in
+                            ("title", "location_name", "agency_name", "description"))
+            if not terms <= keyword_terms(text):
+                return False
+            continue
+        value = listing.get(column)
+        if value is None:
+            return False
+        if operator == "IN":
+            if _to_int(value) not in _as_set(canonical[key]):
+                return False
+        elif operator == ">=" and value < canonical[key]:
+            return False
+        elif operator == "<=" and value > canonical[key]:
+            return False
+
+    purpose = canonical.get("purpose")
+    if purpose and listing.get("purpose"):
+        listing_purpose = normalize_text(listing["purpose"])
+        if PURPOSE_SYNONYMS.get(listing_purpose, listing_purpose) != purpose and purpose not in listing_purpose:
+            return False
+    return True
@@ -1,17 +1,54 @@
+import bisect
+import gzip
+import json
+import os
+import re
 import sqlite3
+import time
 from datetime import datetime, timedelta
 
 import click
-from flask import current_app, g
+from flask import current_app, g, has_app_context
+
+import cache_backends
+import cache_policy
+import geo_grid
+import listing_codec
+import memory_cache
 
 DATABASE = 'bayut_properties.db'
-CACHE_LIFETIME_MINUTES = 30  # How long to cache search results
+
+# How cached listings are stored: 'rows' (one cached_properties row per listing)
+# or 'blob' (compressed segment blobs plus a thin cached_listing_index)
+STORAGE_FORMATS = ('rows', 'blob')
+_storage_format = os.environ.get('CACHE_STORAGE', 'rows')
+
+
+class _Median:
+    """SQL aggregate median(x), ignoring NULLs."""
+
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        self.values.sort()
+        middle = len(self.values) // 2
+        if len(self.values) % 2:
+            return self.values[middle]
+        return (self.values[middle - 1] + self.values[middle]) / 2
 
 
 def get_db():
     if 'db' not in g:
         g.db = sqlite3.connect(current_app.config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES)
         g.db.row_factory = sqlite3.Row
+        g.db.create_aggregate('median', 1, _Median)
     return g.db
 
 
@@ -26,6 +63,14 @@ def init_db():
     with current_app.open_resource('schema.sql', mode='r') as f:
         db.cursor().executescript(f.read())
     db.commit()
+    # cache_entries survives restarts, so startup is when its expired rows go
+    if isinstance(_cache_backend, cache_backends.SQLiteBackend):
+        _cache_backend.purge_expired()
+    memory_cache.result_cache.clear()
+    memory_cache.location_id_cache.clear()
+    memory_cache.map_tile_cache.clear()
+    _image_templates.clear()
+    _image_template_ids.clear()
     print("Database initialized for search caching.")
 
 
@@ -41,72 +86,926 @@ def find_cached_query(query_string):
     return query_row['query_id'] if query_row else None
 
 
+def get_query_totals(query_id):
+    """Returns the upstream totals (total_hits, total_pages) stored for a query."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT total_hits, total_pages FROM search_queries WHERE query_id = ?", (query_id,))
+    row = cursor.fetchone()
+    return (row['total_hits'], row['total_pages']) if row else (None, None)
+
+
+def get_query_expiry(query_id):
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT expires_at FROM search_queries WHERE query_id = ?", (query_id,))
+    row = cursor.fetchone()
+    return row['expires_at'] if row else None
+
+
+def get_query_age(query_id):
+    """Seconds since a cached query was (re)fetched, from its expiry and the search_results TTL."""
+    expires_at = get_query_expiry(query_id)
+    if expires_at is None:
+        return None
+    remaining = (expires_at - datetime.now()).total_seconds()
+    return max(0.0, cache_policy.get('search_results').ttl_seconds - remaining)
+
+
+def get_cached_segments(query_id):
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT segment FROM cached_segments WHERE query_id = ?", (query_id,))
+    return {row['segment'] for row in cursor.fetchall()}
+
+
+# cached_properties columns for list views that skip images
+_LIST_COLUMNS = """id, query_id, position, title, price, area, rooms, baths, purpose, completion_status,
+    latitude, longitude, location_name, cover_photo_url, agency_name, contact_name, mobile_number,
+    whatsapp_number, down_payment_percentage"""
+
+_image_templates = {}  # template_id -> (prefix, suffix), mirrors cached_image_templates
+_image_template_ids = {}  # (prefix, suffix) -> template_id
+
+# Shortest shared prefix worth storing as a template
+MIN_IMAGE_PREFIX_LENGTH = 12
+_IMAGE_URL_DELIMITERS = "/-_.?=&"
+
+
+def _split_image_urls(urls):
+    """Returns the (prefix, suffix) every URL shares, or None if there is none worth storing."""
+    if len(urls) == 1:
+        for prefix, suffix in _image_template_ids:
+            url = urls[0]
+            if url.startswith(prefix) and url.endswith(suffix) and len(url) > len(prefix) + len(suffix):
+                return prefix, suffix
+        return None
+    # Cut at path/name delimiters so IDs that happen to share leading or
+    # trailing characters don't end up in a per-listing template
+    prefix = os.path.commonprefix(urls)
+    prefix = prefix[:max(prefix.rfind(char) for char in _IMAGE_URL_DELIMITERS) + 1]
+    if len(prefix) < MIN_IMAGE_PREFIX_LENGTH:
+        return None
+    suffix = os.path.commonprefix([url[len(prefix):][::-1] for url in urls])[::-1]
+    cuts = [suffix.find(char) for char in _IMAGE_URL_DELIMITERS if char in suffix]
+    suffix = suffix[min(cuts):] if cuts else ""
+    if any(len(url) == len(prefix) + len(suffix) for url in urls):
+        suffix = ""
+    return prefix, suffix
+
+
+def _image_template_id(cursor, prefix, suffix):
+    template_id = _image_template_ids.get((prefix, suffix))
+    if template_id is None:
+        cursor.execute("INSERT OR IGNORE INTO cached_image_templates (prefix, suffix) VALUES (?, ?)", (prefix, suffix))
+        cursor.execute("SELECT template_id FROM cached_image_templates WHERE prefix = ? AND suffix = ?",
+                       (prefix, suffix))
+        template_id = cursor.fetchone()[0]
+        _image_templates[template_id] = (prefix, suffix)
+        _image_template_ids[(prefix, suffix)] = template_id
+    return template_id
+
+
+def _encode_image_urls(cursor, urls):
+    """Returns (image_template_id, image_ids) for a listing's image URLs."""
+    urls = [url for url in urls or [] if url]
+    if not urls:
+        return None, None
+    template = _split_image_urls(urls)
+    if template is None:
+        return None, json.dumps(urls, separators=(',', ':'))
+    prefix, suffix = template
+    image_ids = [url[len(prefix):len(url) - len(suffix)] for url in urls]
+    return _image_template_id(cursor, prefix, suffix), json.dumps(image_ids, separators=(',', ':'))
+
+
+def _decode_image_urls(template_id, image_ids):
+    if not image_ids:
+        return []
+    image_ids = json.loads(image_ids)
+    if template_id is None:
+        return image_ids
+    if template_id not in _image_templates:
+        row = get_db().execute("SELECT prefix, suffix FROM cached_image_templates WHERE template_id = ?",
+                               (template_id,)).fetchone()
+        _image_templates[template_id] = (row['prefix'], row['suffix'])
+        _image_template_ids[(row['prefix'], row['suffix'])] = template_id
+    prefix, suffix = _image_templates[template_id]
+    return [prefix + image_id + suffix for image_id in image_ids]
+
+
+def _row_to_property(prop_row):
+    prop_dict = dict(prop_row)
+    if 'image_ids' in prop_dict:
+        prop_dict['all_image_urls'] = _decode_image_urls(prop_dict.pop('image_template_id'),
+                                                         prop_dict.pop('image_ids'))
+    return prop_dict
+
+
+def configure_storage_format(storage_format):
+    global _storage_format
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown cache storage format: {storage_format}")
+    _storage_format = storage_format
+
+
+_dictionaries = {0: listing_codec.DEFAULT_DICTIONARY}
+
+
+def _get_dictionary(dictionary_id):
+    if dictionary_id not in _dictionaries:
+        row = get_db().execute("SELECT data FROM cache_dictionaries WHERE dictionary_id = ?",
+                               (dictionary_id,)).fetchone()
+        if row is None:
+            raise LookupError(f"Compression dictionary {dictionary_id} is missing")
+        _dictionaries[dictionary_id] = row['data']
+    return _dictionaries[dictionary_id]
+
+
+def _latest_dictionary_id():
+    row = get_db().execute("SELECT MAX(dictionary_id) FROM cache_dictionaries").fetchone()
+    return row[0] or 0
+
+
+def _decode_blobs(query_id, blob_rows, wanted, include_images=True):
+    """Decodes blob rows into {position: listing} for the positions `wanted(position)` accepts."""
+    listings = {}
+    for blob_row in blob_rows:
+        decoded = listing_codec.decode(blob_row['payload'], _get_dictionary(blob_row['dictionary_id']))
+        for offset, listing in enumerate(decoded):
+            position = blob_row['start_position'] + offset
+            if listing is not None and wanted(position):
+                listings[position] = dict(listing, query_id=query_id, position=position)
+                if not include_images:
+                    del listings[position]['all_image_urls']
+    return listings
+
+
+def _read_blob_listings(query_id, start, end, include_images=True):
+    """Decodes the blobs overlapping positions [start, end) into {position: listing}."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT start_position, dictionary_id, payload FROM cached_blobs
+        WHERE query_id = ? AND start_position < ? AND start_position + row_count > ?
+        ORDER BY start_position
+    """, (query_id, end, start))
+    return _decode_blobs(query_id, cursor.fetchall(), lambda position: start <= position < end, include_images)
+
+
+def _listings_at_positions(query_id, positions, include_images=True):
+    """Decodes only the blobs that hold one of `positions`."""
+    if not positions:
+        return []
+    wanted = sorted(set(positions))
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT segment, start_position, row_count FROM cached_blobs WHERE query_id = ?", (query_id,))
+    segments = []
+    for blob_row in cursor.fetchall():
+        first = bisect.bisect_left(wanted, blob_row['start_position'])
+        if first < len(wanted) and wanted[first] < blob_row['start_position'] + blob_row['row_count']:
+            segments.append(blob_row['segment'])
+    if not segments:
+        return []
+    cursor.execute(f"""
+        SELECT start_position, dictionary_id, payload FROM cached_blobs
+        WHERE query_id = ? AND segment IN ({', '.join('?' for _ in segments)})
+    """, [query_id] + segments)
+    listings = _decode_blobs(query_id, cursor.fetchall(), set(wanted).__contains__, include_images)
+    return [listings[position] for position in positions if position in listings]
+
+
 def get_properties_for_query(query_id):
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM cached_properties WHERE query_id = ?", (query_id,))
-    properties_raw = cursor.fetchall()
+    if _storage_format == 'blob':
+        listings = _read_blob_listings(query_id, 0, 2 ** 62)
+        return [listings[position] for position in sorted(listings)]
+    cursor.execute("SELECT * FROM cached_properties WHERE query_id = ? ORDER BY position", (query_id,))
+    return [_row_to_property(prop_row) for prop_row in cursor.fetchall()]
+
+
+def get_cached_property(property_id):
+    """Returns any cached copy of a listing by its ID, or None."""
+    db = get_db()
+    cursor = db.cursor()
+    if _storage_format == 'blob':
+        cursor.execute("SELECT query_id, position FROM cached_listing_index WHERE id = ? LIMIT 1",
+                       (str(property_id),))
+        index_row = cursor.fetchone()
+        if index_row is None:
+            return None
+        listings = _listings_at_positions(index_row['query_id'], [index_row['position']])
+        return listings[0] if listings else None
+    cursor.execute("SELECT * FROM cached_properties WHERE id = ? LIMIT 1", (str(property_id),))
+    prop_row = cursor.fetchone()
+    return _row_to_property(prop_row) if prop_row else None
+
+
+def get_cached_page(query_id, offset, limit, include_images=True):
+    """
+    Reads one page of a cached query straight from SQLite. Uses keyset
+    pagination on `position` so only `limit` rows are read; the range is
+    bounded at both ends, as positions skipped for duplicate listings leave
+    gaps. List views can pass include_images=False to leave the image columns
+    unread.
+    """
+    if _storage_format == 'blob':
+        listings = _read_blob_listings(query_id, offset, offset + limit, include_images)
+        return [listings[position] for position in sorted(listings)]
+    db = get_db()
+    cursor = db.cursor()
+    columns = '*' if include_images else _LIST_COLUMNS
+    cursor.execute(f"""
+        SELECT {columns} FROM cached_properties
+        WHERE query_id = ? AND position >= ? AND position < ?
+        ORDER BY position
+    """, (query_id, offset, offset + limit))
+    return [_row_to_property(prop_row) for prop_row in cursor.fetchall()]
+
+
+def save_query(query_string, total_hits=None, total_pages=None, filters=None, refresh=False):
+    """
+    Creates the cache entry for a query, or refreshes it if it has expired
+    (or refresh is set), and records the upstream totals. Returns the query ID.
+    """
+    filters_json = json.dumps(filters, sort_keys=True) if filters is not None else None
+    db = get_db()
+    cursor = db.cursor()
+
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=cache_policy.get('search_results').ttl_seconds)
+
+    cursor.execute("SELECT query_id, expires_at FROM search_queries WHERE query_string = ?", (query_string,))
+    query_row = cursor.fetchone()
+    if query_row is None:
+        try:
+            cursor.execute("""
+                INSERT INTO search_queries (query_string, filters_json, total_hits, total_pages, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (query_string, filters_json, total_hits, total_pages, expires_at))
+            db.commit()
+            return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            # If a concurrent request already inserted the query, fetch its ID
+            cursor.execute("SELECT query_id, expires_at FROM search_queries WHERE query_string = ?", (query_string,))
+            query_row = cursor.fetchone()
+            print(f"Query {query_string} already exists, fetching ID.")
+
+    query_id = query_row['query_id']
+    if refresh or query_row['expires_at'] <= now:
+        # Expired (or too old for the caller) entry: drop its segments so they are refetched, not served stale
+        cursor.execute("DELETE FROM cached_properties WHERE query_id = ?", (query_id,))
+        cursor.execute("DELETE FROM cached_segments WHERE query_id = ?", (query_id,))
+        cursor.execute("DELETE FROM cached_blobs WHERE query_id = ?", (query_id,))
+        cursor.execute("DELETE FROM cached_listing_index WHERE query_id = ?", (query_id,))
+        cursor.execute("DELETE FROM listing_search WHERE query_id = ?", (query_id,))
+        cursor.execute("DELETE FROM listing_geo WHERE query_id = ?", (query_id,))
+        cursor.execute("DELETE FROM listing_tiles WHERE query_id = ?", (query_id,))
+        cursor.execute("UPDATE search_queries SET created_at = ?, expires_at = ? WHERE query_id = ?",
+                       (now, expires_at, query_id))
+        memory_cache.result_cache.invalidate(lambda key: key[0] == query_string)
+    if total_hits is not None:
+        cursor.execute("UPDATE search_queries SET total_hits = ?, total_pages = ? WHERE query_id = ?",
+                       (total_hits, total_pages, query_id))
+    if filters_json is not None:
+        cursor.execute("UPDATE search_queries SET filters_json = ? WHERE query_id = ?", (filters_json, query_id))
+    db.commit()
+    return query_id
+
+
+def find_complete_queries(namespace):
+    """
+    Returns (query_id, filters) for live cached queries in a namespace whose
+    full result set is cached, smallest result sets first.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT q.query_id, q.filters_json FROM search_queries q
+        WHERE q.query_string LIKE ? AND q.expires_at > ?
+          AND q.filters_json IS NOT NULL AND q.total_hits IS NOT NULL
+          AND q.total_hits <= (SELECT COALESCE(SUM(s.row_count), 0) FROM cached_segments s
+                               WHERE s.query_id = q.query_id)
+        ORDER BY q.total_hits
+    """, (f"{namespace}:%", datetime.now()))
+    return [(row['query_id'], json.loads(row['filters_json'])) for row in cursor.fetchall()]
+
+
+# Query planner decisions kept in query_plans
+QUERY_PLAN_LOG_ROWS = 10000
+
+
+def record_query_plans(plans):
+    """
+    Logs a batch of query planner decisions, as (planned_at, namespace,
+    query_string, intent, max_age_seconds, chosen, data_age_seconds,
+    candidates, elapsed_ms) tuples, keeping the newest QUERY_PLAN_LOG_ROWS.
+    """
+    db = get_db()
+    db.executemany("""
+        INSERT INTO query_plans (planned_at, namespace, query_string, intent, max_age_seconds, chosen,
+                                 data_age_seconds, candidates_json, elapsed_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(*plan[:7], json.dumps(plan[7]), plan[8]) for plan in plans])
+    db.execute("DELETE FROM query_plans WHERE plan_id <= (SELECT MAX(plan_id) FROM query_plans) - ?",
+               (QUERY_PLAN_LOG_ROWS,))
+    db.commit()
+
+
+def get_query_plans(limit=50):
+    """The most recent query planner decisions, newest first."""
+    db = get_db()
+    rows = db.execute("SELECT * FROM query_plans ORDER BY plan_id DESC LIMIT ?", (limit,)).fetchall()
+    plans = []
+    for row in rows:
+        plan = dict(row)
+        plan['candidates'] = json.loads(plan.pop('candidates_json'))
+        plans.append(plan)
+    return plans
+
+
+def query_plan_summary():
+    """Per intent and chosen source: decision count and average latency over the logged decisions."""
+    db = get_db()
+    rows = db.execute("""
+        SELECT intent, chosen, COUNT(*) AS plans, AVG(elapsed_ms) AS avg_elapsed_ms
+        FROM query_plans GROUP BY intent, chosen ORDER BY intent, plans DESC
+    """).fetchall()
+    return [dict(row) for row in rows]
+
+
+# Columns and operators residual predicates may use
+_PREDICATE_COLUMNS = {'rooms', 'baths', 'price', 'area', 'text'}
+_PREDICATE_OPERATORS = {'IN', '>=', '<=', 'MATCH'}
+
 
-    properties_processed = []
-    for prop_row in properties_raw:
-        prop_dict = dict(prop_row)
-        if prop_dict['all_image_urls']:
-            prop_dict['all_image_urls'] = prop_dict['all_image_urls'].split(',')
+def get_filtered_page(query_id, predicates, offset, limit, include_images=True):
+    """
+    Evaluates (column, operator, value) predicates over a cached result set
+    and returns (page_of_properties, total_matching).
+    """
+    clauses = ["query_id = ?"]
+    params = [query_id]
+    for column, operator, value in predicates:
+        if column not in _PREDICATE_COLUMNS or operator not in _PREDICATE_OPERATORS:
+            raise ValueError(f"Unsupported predicate: {column} {operator}")
+        if operator == 'MATCH':
+            clauses.append("position IN (SELECT position FROM listing_search WHERE listing_search MATCH ? AND query_id = ?)")
+            params.extend([fts_query(value), query_id])
+        elif operator == 'IN':
+            clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+            params.extend(value)
         else:
-            prop_dict['all_image_urls'] = []
-        properties_processed.append(prop_dict)
-    return properties_processed
+            clauses.append(f"{column} {operator} ?")
+            params.append(value)
+    where = " AND ".join(clauses)
 
+    db = get_db()
+    cursor = db.cursor()
+    table = 'cached_listing_index' if _storage_format == 'blob' else 'cached_properties'
+    cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params)
+    total = cursor.fetchone()[0]
+    if _storage_format == 'blob':
+        cursor.execute(f"SELECT position FROM {table} WHERE {where} ORDER BY position LIMIT ? OFFSET ?",
+                       params + [limit, offset])
+        positions = [row['position'] for row in cursor.fetchall()]
+        return _listings_at_positions(query_id, positions, include_images), total
+    columns = '*' if include_images else _LIST_COLUMNS
+    cursor.execute(f"SELECT {columns} FROM cached_properties WHERE {where} ORDER BY position LIMIT ? OFFSET ?",
+                   params + [limit, offset])
+    return [_row_to_property(prop_row) for prop_row in cursor.fetchall()], total
 
-def save_query_and_properties(query_string, properties_data):
+
+def save_segment(query_id, segment, segment_size, properties_data):
+    """
+    Stores one upstream page of results. Rows are numbered from
+    segment * segment_size so pages can be read back by position.
+    """
     db = get_db()
     cursor = db.cursor()
 
-    # Calculate expiration time
-    expires_at = datetime.now() + timedelta(minutes=CACHE_LIFETIME_MINUTES)
+    start_position = segment * segment_size
+    if _storage_format == 'blob':
+        _save_segment_blob(cursor, query_id, segment, start_position, properties_data)
+    else:
+        for offset, prop in enumerate(properties_data):
+            image_template_id, image_ids = _encode_image_urls(cursor, prop.get('all_image_urls'))
+            try:
+                cursor.execute("""
+                    INSERT INTO cached_properties (
+                        id, query_id, position, title, price, area, rooms, baths, purpose, completion_status,
+                        latitude, longitude, location_name, cover_photo_url, image_template_id, image_ids,
+                        agency_name, contact_name, mobile_number, whatsapp_number, down_payment_percentage
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (prop.get('id'), query_id, start_position + offset, prop.get('title'), prop.get('price'),
+                      prop.get('area'), prop.get('rooms'), prop.get('baths'), prop.get('purpose'),
+                      prop.get('completion_status'), prop.get('latitude'), prop.get('longitude'),
+                      prop.get('location_name'), prop.get('cover_photo_url'), image_template_id, image_ids,
+                      prop.get('agency_name'), prop.get('contact_name'), prop.get('mobile_number'),
+                      prop.get('whatsapp_number'), prop.get('down_payment_percentage')))
+            except sqlite3.IntegrityError:
+                # Skip if property already exists for this query
+                continue
+            _index_listing(cursor, query_id, start_position + offset, prop)
 
-    # Insert new query
-    try:
-        cursor.execute("""
-            INSERT INTO search_queries (query_string, expires_at) VALUES (?, ?)
-        """, (query_string, expires_at))
-        query_id = cursor.lastrowid
-    except sqlite3.IntegrityError:
-        # If a concurrent request already inserted the query, fetch its ID
-        cursor.execute("SELECT query_id FROM search_queries WHERE query_string = ?", (query_string,))
-        query_id = cursor.fetchone()['query_id']
-        print(f"Query {query_string} already exists, fetching ID.")
-
-    # Insert all properties
-    for prop in properties_data:
-        image_urls_str = ','.join(prop.get('all_image_urls', []))
+    cursor.execute("""
+        INSERT OR REPLACE INTO cached_segments (query_id, segment, row_count) VALUES (?, ?, ?)
+    """, (query_id, segment, len(properties_data)))
+    cursor.execute("UPDATE search_queries SET segment_size = ? WHERE query_id = ?", (segment_size, query_id))
+    db.commit()
+    print(f"Saved {len(properties_data)} properties for query ID {query_id}, segment {segment}.")
+
+
+def _save_segment_blob(cursor, query_id, segment, start_position, properties_data):
+    # The blob replaces any earlier copy of the segment, so its index rows go too
+    end_position = start_position + len(properties_data)
+    cursor.execute("DELETE FROM cached_listing_index WHERE query_id = ? AND position >= ? AND position < ?",
+                   (query_id, start_position, end_position))
+    cursor.execute("SELECT 1 FROM cached_blobs WHERE query_id = ? AND segment = ?", (query_id, segment))
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM listing_search WHERE query_id = ? AND position >= ? AND position < ?",
+                       (query_id, start_position, end_position))
+        cursor.execute("DELETE FROM listing_geo WHERE query_id = ? AND position >= ? AND position < ?",
+                       (query_id, start_position, end_position))
+        cursor.execute("DELETE FROM listing_tiles WHERE query_id = ? AND position >= ? AND position < ?",
+                       (query_id, start_position, end_position))
+    listings = []
+    for offset, prop in enumerate(properties_data):
         try:
             cursor.execute("""
-                INSERT INTO cached_properties (
-                    id, query_id, title, price, area, rooms, baths, purpose, completion_status,
-                    latitude, longitude, location_name, cover_photo_url, all_image_urls,
-                    agency_name, contact_name, mobile_number, whatsapp_number, down_payment_percentage
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (prop.get('id'), query_id, prop.get('title'), prop.get('price'), prop.get('area'), prop.get('rooms'),
-                  prop.get('baths'), prop.get('purpose'), prop.get('completion_status'), prop.get('latitude'),
-                  prop.get('longitude'), prop.get('location_name'), prop.get('cover_photo_url'), image_urls_str,
-                  prop.get('agency_name'), prop.get('contact_name'), prop.get('mobile_number'),
-                  prop.get('whatsapp_number'), prop.get('down_payment_percentage')))
+                INSERT INTO cached_listing_index (id, query_id, position, price, area, rooms, baths)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (prop.get('id'), query_id, start_position + offset, prop.get('price'), prop.get('area'),
+                  prop.get('rooms'), prop.get('baths')))
         except sqlite3.IntegrityError:
-            # Skip if property already exists for this query
+            # Duplicate listing within the query: keep the slot so positions stay aligned
+            listings.append(None)
             continue
+        listing = {field: prop.get(field) for field in listing_codec.LISTING_FIELDS}
+        listing['all_image_urls'] = list(prop.get('all_image_urls') or [])
+        listings.append(listing)
+        _index_listing(cursor, query_id, start_position + offset, prop)
+
+    dictionary_id = _latest_dictionary_id()
+    cursor.execute("""
+        INSERT OR REPLACE INTO cached_blobs (query_id, segment, start_position, row_count, dictionary_id, payload)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (query_id, segment, start_position, len(listings), dictionary_id,
+          listing_codec.encode(listings, _get_dictionary(dictionary_id))))
+
+
+def get_listings_near(latitude, longitude, radius_km, offset=0, limit=50, keep=None, include_images=True):
+    """
+    Returns (listings, total) for live cached listings within `radius_km` of a
+    point, nearest first, each with a `distance_km`. Candidates come from the
+    listing_geo R*Tree; `keep(listing)` can filter them further. limit=None
+    returns every listing from `offset` on.
+    """
+    south, west, north, east = geo_grid.radius_bounds(latitude, longitude, radius_km)
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        WITH h AS MATERIALIZED (
+            SELECT listing_id, query_id, position, min_lat, min_lng FROM listing_geo
+            WHERE min_lat <= ? AND max_lat >= ? AND min_lng <= ? AND max_lng >= ?
+        )
+        SELECT h.listing_id, MIN(h.query_id) AS query_id, h.position, h.min_lat, h.min_lng
+        FROM h JOIN search_queries q ON q.query_id = h.query_id
+        WHERE q.expires_at > ?
+        GROUP BY h.listing_id
+    """, (north, south, east, west, datetime.now()))
+    candidates = cursor.fetchall()
+    indexes, distances = geo_grid.nearest_within(latitude, longitude, [row['min_lat'] for row in candidates],
+                                                 [row['min_lng'] for row in candidates], radius_km)
+    hits = [(distance, candidates[index]) for index, distance in zip(indexes, distances)]
+    end = offset + limit if limit is not None else None
+
+    if keep is None:
+        total = len(hits)
+        hits = hits[offset:end]
+    distance_by_id = {row['listing_id']: distance for distance, row in hits}
+    listings = _properties_for_hits([row for _, row in hits], include_images)
+    for listing in listings:
+        listing['distance_km'] = round(distance_by_id[listing['id']], 3)
+    if keep is not None:
+        listings = [listing for listing in listings if keep(listing)]
+        total = len(listings)
+        listings = listings[offset:end]
+    return listings, total
+
+
+def get_tile_clusters(tile, cell_zoom):
+    """
+    Aggregates the live cached listings inside one tile (a quadkey) into
+    grid cells at `cell_zoom`: count, centroid, min and median price.
+    Single-listing cells also carry the listing's ID.
+    """
+    low, high = geo_grid.key_range(tile)
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        WITH t AS (
+            SELECT lt.listing_id, MIN(lt.quadkey) AS quadkey, lt.latitude, lt.longitude, lt.price
+            FROM listing_tiles lt JOIN search_queries q ON q.query_id = lt.query_id
+            WHERE lt.quadkey >= ? AND lt.quadkey < ? AND q.expires_at > ?
+            GROUP BY lt.listing_id
+        )
+        SELECT substr(quadkey, 1, ?) AS cell, COUNT(*) AS count, AVG(latitude) AS latitude,
+               AVG(longitude) AS longitude, MIN(price) AS min_price, median(price) AS median_price,
+               MIN(listing_id) AS listing_id
+        FROM t GROUP BY cell ORDER BY cell
+    """, (low, high, datetime.now(), cell_zoom))
+    clusters = []
+    for row in cursor.fetchall():
+        cluster = {'cell': row['cell'], 'count': row['count'], 'latitude': row['latitude'],
+                   'longitude': row['longitude'], 'min_price': row['min_price'], 'median_price': row['median_price']}
+        if row['count'] == 1:
+            cluster['id'] = row['listing_id']
+        clusters.append(cluster)
+    return clusters
+
 
+def get_tile_listings(tile, limit):
+    """Returns (hits, total) for the live cached listings inside one tile, each listing once."""
+    low, high = geo_grid.key_range(tile)
+    db = get_db()
+    cursor = db.cursor()
+    hits = """
+        SELECT lt.listing_id, MIN(lt.query_id) AS query_id, lt.position
+        FROM listing_tiles lt JOIN search_queries q ON q.query_id = lt.query_id
+        WHERE lt.quadkey >= ? AND lt.quadkey < ? AND q.expires_at > ?
+        GROUP BY lt.listing_id
+    """
+    params = (low, high, datetime.now())
+    cursor.execute(f"SELECT COUNT(*) FROM ({hits})", params)
+    total = cursor.fetchone()[0]
+    cursor.execute(f"{hits} ORDER BY lt.listing_id LIMIT ?", params + (limit,))
+    return _properties_for_hits(cursor.fetchall(), include_images=False), total
+
+
+def _index_listing(cursor, query_id, position, prop):
+    """Adds a stored listing to the full-text and spatial indexes."""
+    cursor.execute("""
+        INSERT INTO listing_search (title, location_name, agency_name, description, listing_id, query_id, position)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (prop.get('title'), prop.get('location_name'), prop.get('agency_name'), prop.get('description'),
+          prop.get('id'), query_id, position))
+    latitude, longitude = prop.get('latitude'), prop.get('longitude')
+    if latitude is not None and longitude is not None:
+        cursor.execute("""
+            INSERT INTO listing_geo (min_lat, max_lat, min_lng, max_lng, listing_id, query_id, position)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (latitude, latitude, longitude, longitude, prop.get('id'), query_id, position))
+        cursor.execute("""
+            INSERT INTO listing_tiles (listing_id, query_id, position, quadkey, latitude, longitude, price)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (prop.get('id'), query_id, position, geo_grid.quadkey(latitude, longitude), latitude, longitude,
+              prop.get('price')))
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 query matching listings that contain every word."""
+    words = re.findall(r"\w+", str(text).casefold())
+    return " ".join(f'"{word}"' for word in words)
+
+
+def _properties_at_positions(query_id, positions, include_images=True):
+    """Reads the listings at `positions` of a cached query, in that order."""
+    if _storage_format == 'blob':
+        return _listings_at_positions(query_id, positions, include_images)
+    if not positions:
+        return []
+    columns = '*' if include_images else _LIST_COLUMNS
+    cursor = get_db().cursor()
+    cursor.execute(f"SELECT {columns} FROM cached_properties WHERE query_id = ? AND position IN ({', '.join('?' for _ in positions)})",
+                   [query_id] + list(positions))
+    by_position = {prop_row['position']: _row_to_property(prop_row) for prop_row in cursor.fetchall()}
+    return [by_position[position] for position in positions if position in by_position]
+
+
+def search_listing_text(text, limit=20, offset=0, include_images=True):
+    """
+    Local keyword search over every live cached listing, best BM25 match
+    first (title weighs most, then location, agency and description).
+    Returns (properties, total_matching).
+    """
+    match = fts_query(text)
+    if not match:
+        return [], 0
+    db = get_db()
+    cursor = db.cursor()
+    # Materialized so bm25() runs directly against the FTS table
+    matches = """
+        WITH m AS MATERIALIZED (
+            SELECT listing_id, query_id, position, bm25(listing_search, 8.0, 4.0, 2.0, 1.0) AS score
+            FROM listing_search WHERE listing_search MATCH ?
+        )
+        SELECT m.* FROM m JOIN search_queries q ON q.query_id = m.query_id WHERE q.expires_at > ?
+    """
+    now = datetime.now()
+    cursor.execute(f"SELECT COUNT(DISTINCT listing_id) FROM ({matches})", (match, now))
+    total = cursor.fetchone()[0]
+    # A listing cached under several queries is returned once, at its best score
+    cursor.execute(f"""
+        SELECT listing_id, query_id, position, MIN(score) AS score FROM ({matches})
+        GROUP BY listing_id ORDER BY score, listing_id LIMIT ? OFFSET ?
+    """, (match, now, limit, offset))
+    return _properties_for_hits(cursor.fetchall(), include_images), total
+
+
+def _properties_for_hits(hits, include_images=True):
+    """Loads the listings for index hits (rows with query_id and position), keeping their order."""
+    positions_by_query = {}
+    for hit in hits:
+        positions_by_query.setdefault(hit['query_id'], []).append(hit['position'])
+    found = {}
+    for query_id, positions in positions_by_query.items():
+        for prop in _properties_at_positions(query_id, positions, include_images):
+            found[(query_id, prop['position'])] = prop
+    return [found[(hit['query_id'], hit['position'])] for hit in hits
+            if (hit['query_id'], hit['position']) in found]
+
+
+def get_listings_in_bbox(south, west, north, east, limit=500, include_images=False):
+    """
+    Returns (listings, total_in_bbox) for live cached listings inside the
+    bounding box, looked up through the listing_geo R*Tree. At most `limit`
+    listings are loaded; each listing is returned once.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    # Materialized so the R*Tree drives the lookup before the join
+    hits = """
+        WITH h AS MATERIALIZED (
+            SELECT listing_id, query_id, position FROM listing_geo
+            WHERE min_lat <= ? AND max_lat >= ? AND min_lng <= ? AND max_lng >= ?
+        )
+        SELECT h.* FROM h JOIN search_queries q ON q.query_id = h.query_id WHERE q.expires_at > ?
+    """
+    params = (north, south, east, west, datetime.now())
+    cursor.execute(f"SELECT COUNT(DISTINCT listing_id) FROM ({hits})", params)
+    total = cursor.fetchone()[0]
+    cursor.execute(f"SELECT listing_id, MIN(query_id) AS query_id, position FROM ({hits}) GROUP BY listing_id LIMIT ?",
+                   params + (limit,))
+    return _properties_for_hits(cursor.fetchall(), include_images), total
+
+
+def train_cache_dictionary(sample_limit=2000):
+    """Trains a compression dictionary on the listings currently cached and makes it current."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM cached_properties LIMIT ?", (sample_limit,))
+    samples = [_row_to_property(prop_row) for prop_row in cursor.fetchall()]
+    cursor.execute("SELECT DISTINCT query_id FROM cached_blobs")
+    for blob_row in cursor.fetchall():
+        if len(samples) >= sample_limit:
+            break
+        samples.extend(_read_blob_listings(blob_row['query_id'], 0, 2 ** 62).values())
+    samples = [{field: sample.get(field) for field in listing_codec.LISTING_FIELDS}
+               for sample in samples[:sample_limit]]
+    if not samples:
+        return None, 0
+
+    dictionary = listing_codec.train_dictionary(samples)
+    cursor.execute("INSERT INTO cache_dictionaries (data) VALUES (?)", (dictionary,))
+    db.commit()
+    return cursor.lastrowid, len(samples)
+
+
+# ----------------------------------
+# Cache snapshots (warm starts for new replicas)
+# ----------------------------------
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_QUERIES = 200
+# Key-value namespaces carried in a snapshot besides the location IDs of its queries
+_SNAPSHOT_KV_KEYS = [('build_id', 'propertyfinder')]
+
+
+def _snapshot_kv_entry(namespace, key):
+    """Returns a key-value snapshot record keeping the entry's original store time, or None."""
+    entry = _cache_backend.get(f"{namespace}:{key}")
+    if entry is None:
+        return None
+    value, stored_at = entry
+    return {'kv': namespace, 'key': key, 'value': value, 'stored_at': stored_at}
+
+
+def export_cache_snapshot(path, max_queries=DEFAULT_SNAPSHOT_QUERIES):
+    """
+    Writes the hottest live cached queries (most recently fetched first), with
+    their listings, location IDs and the build ID, to a gzipped JSON-lines
+    file. Everything is read in one transaction, so the snapshot is consistent;
+    the file is renamed into place only once complete. Returns (queries, listings).
+    """
+    db = get_db()
+    cursor = db.cursor()
+    query_count = listing_count = 0
+    temporary_path = f"{path}.tmp"
+    if not db.in_transaction:
+        cursor.execute("BEGIN")
+    try:
+        cursor.execute("""
+            SELECT q.query_id, q.query_string, q.filters_json, q.total_hits, q.total_pages, q.segment_size,
+                   q.expires_at
+            FROM search_queries q JOIN cached_segments s ON s.query_id = q.query_id
+            WHERE q.expires_at > ? AND q.segment_size IS NOT NULL
+            GROUP BY q.query_id
+            ORDER BY MAX(s.fetched_at) DESC
+            LIMIT ?
+        """, (datetime.now(), max_queries))
+        queries = cursor.fetchall()
+
+        with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+            def write(record):
+                f.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+
+            write({'snapshot': SNAPSHOT_VERSION, 'created_at': time.time(), 'storage_format': _storage_format})
+            kv_keys = list(_SNAPSHOT_KV_KEYS)
+            for query_row in queries:
+                filters = json.loads(query_row['filters_json']) if query_row['filters_json'] else None
+                if filters and filters.get('query') and filters.get('location_id'):
+                    kv_keys.append(('location_id', filters['query']))
+                write({'query': query_row['query_string'], 'filters': filters,
+                       'total_hits': query_row['total_hits'], 'total_pages': query_row['total_pages'],
+                       'segment_size': query_row['segment_size'],
+                       'expires_at': query_row['expires_at'].timestamp()})
+
+                segment_size = query_row['segment_size']
+                for segment_row in db.execute("SELECT segment, row_count FROM cached_segments WHERE query_id = ? "
+                                              "ORDER BY segment", (query_row['query_id'],)).fetchall():
+                    start = segment_row['segment'] * segment_size
+                    listings = [{key: value for key, value in listing.items() if key not in ('query_id', 'position')}
+                                for listing in get_cached_page(query_row['query_id'], start, segment_size)]
+                    write({'segment': segment_row['segment'], 'row_count': segment_row['row_count'],
+                           'listings': listings})
+                    listing_count += len(listings)
+                query_count += 1
+
+            for namespace, key in dict.fromkeys(kv_keys):
+                record = _snapshot_kv_entry(namespace, key)
+                if record is not None:
+                    write(record)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    finally:
+        db.rollback()
+    os.replace(temporary_path, path)
+    return query_count, listing_count
+
+
+def import_cache_snapshot(path):
+    """
+    Loads a snapshot written by export_cache_snapshot. Entries keep their
+    original expiry and store time, so nothing is served fresher than it was
+    on the exporting replica; entries that have expired since, or are already
+    cached here, are skipped. Returns (queries, listings).
+    """
+    db = get_db()
+    query_count = listing_count = 0
+    query_id = segment_size = None
+    now = time.time()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('snapshot') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported cache snapshot: {path}")
+        for line in f:
+            record = json.loads(line)
+            if 'query' in record:
+                query_id = segment_size = None
+                # A live entry of this replica's own is at least as fresh as the snapshot's
+                if record['expires_at'] <= now or find_cached_query(record['query']):
+                    continue
+                query_id = save_query(record['query'], record['total_hits'], record['total_pages'],
+                                      record['filters'])
+                segment_size = record['segment_size']
+                db.execute("UPDATE search_queries SET expires_at = ? WHERE query_id = ?",
+                           (datetime.fromtimestamp(record['expires_at']), query_id))
+                query_count += 1
+            elif 'segment' in record:
+                if query_id is None:
+                    continue
+                save_segment(query_id, record['segment'], segment_size, record['listings'])
+                # Duplicates dropped on the exporting side still count towards completeness
+                db.execute("UPDATE cached_segments SET row_count = ? WHERE query_id = ? AND segment = ?",
+                           (record['row_count'], query_id, record['segment']))
+                listing_count += len(record['listings'])
+            elif 'kv' in record:
+                ttl_seconds = record['stored_at'] + cache_policy.get(record['kv']).ttl_seconds - now
+                if ttl_seconds > 0:
+                    _cache_backend.set(f"{record['kv']}:{record['key']}", [record['value'], record['stored_at']],
+                                       ttl_seconds)
     db.commit()
-    print(f"Saved {len(properties_data)} properties for query ID {query_id}.")
+    return query_count, listing_count
+
+
+def save_query_and_properties(query_string, properties_data):
+    query_id = save_query(query_string, len(properties_data), 1)
+    save_segment(query_id, 0, max(len(properties_data), 1), properties_data)
     return query_id
 
 
+def _cache_connection():
+    return get_db() if has_app_context() else None
+
+
+_cache_backend = cache_backends.create_backend(os.environ.get('CACHE_BACKEND', 'sqlite'), _cache_connection)
+
+
+def get_cache_backend():
+    return _cache_backend
+
+
+def configure_cache_backend(url):
+    """Selects the key-value cache backend: 'sqlite', 'memory' or 'redis://host:port/db'."""
+    global _cache_backend
+    _cache_backend = cache_backends.create_backend(url, _cache_connection)
+    return _cache_backend
+
+
+def cache_get(namespace, key, allow_stale=False):
+    """
+    Returns a cached value, or None. Past the namespace's soft TTL the value
+    counts as a miss unless `allow_stale` is set (e.g. when a refresh failed).
+    """
+    entry = _cache_backend.get(f"{namespace}:{key}")
+    if entry is None:
+        return None
+    value, stored_at = entry
+    soft_ttl_seconds = cache_policy.get(namespace).soft_ttl_seconds
+    if not allow_stale and soft_ttl_seconds is not None and time.time() - stored_at > soft_ttl_seconds:
+        return None
+    return value
+
+
+def cache_set(namespace, key, value, ttl_seconds=None):
+    """Stores a value for the namespace's policy TTL, or `ttl_seconds` if given."""
+    if ttl_seconds is None:
+        ttl_seconds = cache_policy.get(namespace).ttl_seconds
+    _cache_backend.set(f"{namespace}:{key}", [value, time.time()], ttl_seconds)
+
+
+def cache_delete(namespace, key):
+    _cache_backend.delete(f"{namespace}:{key}")
+
+
+def find_cached_location_id(alias, allow_stale=False):
+    return cache_get('location_id', alias, allow_stale)
+
+
+def save_location_id(alias, location_id):
+    cache_set('location_id', alias, location_id)
+
+
 @click.command('init-db')
 def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
 
+@click.command('train-cache-dict')
+@click.option('--samples', default=2000, show_default=True, help='Maximum listings to learn from.')
+def train_cache_dict_command(samples):
+    """Train a compression dictionary for blob-stored cache segments."""
+    dictionary_id, sample_count = train_cache_dictionary(samples)
+    if dictionary_id is None:
+        click.echo('No cached listings to train on; run some searches first.')
+        return
+    click.echo(f'Trained dictionary {dictionary_id} from {sample_count} listings.')
+
+
+@click.command('export-cache-snapshot')
+@click.argument('path')
+@click.option('--queries', default=DEFAULT_SNAPSHOT_QUERIES, show_default=True,
+              help='Maximum number of cached queries to include.')
+def export_cache_snapshot_command(path, queries):
+    """Export the hot search cache to a compressed snapshot file."""
+    query_count, listing_count = export_cache_snapshot(path, queries)
+    click.echo(f'Exported {query_count} queries ({listing_count} listings) to {path}.')
+
+
+@click.command('import-cache-snapshot')
+@click.argument('path')
+def import_cache_snapshot_command(path):
+    """Load a cache snapshot written by export-cache-snapshot."""
+    query_count, listing_count = import_cache_snapshot(path)
+    click.echo(f'Imported {query_count} queries ({listing_count} listings) from {path}.')
+
+
 def init_app(app):
+    cache_policy.configure(app.config.get('CACHE_POLICIES'))
+    memory_cache.result_cache.apply_policy('search_results')
+    memory_cache.location_id_cache.apply_policy('location_id')
+    memory_cache.map_tile_cache.apply_policy('map_tile')
+    if 'CACHE_STORAGE' in app.config:
+        configure_storage_format(app.config['CACHE_STORAGE'])
+    if 'CACHE_BACKEND' in app.config:
+        configure_cache_backend(app.config['CACHE_BACKEND'])
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(train_cache_dict_command)
+    app.cli.add_command(export_cache_snapshot_command)
+    app.cli.add_command(import_cache_snapshot_command)
@@ -551,20 +551,10 @@ def property_detail(property_id):
     """
     Renders a detailed page for a single property.
     """
-    db = database.get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM cached_properties WHERE id = ?", (property_id,))
-    property_row = cursor.fetchone()
-
-    if property_row is None:
+    property_dict = database.get_cached_property(property_id)
+    if property_dict is None:
         abort(404, description="Property not found.")
 
-    property_dict = dict(property_row)
-    if property_dict['all_image_urls']:
-        property_dict['all_image_urls'] = property_dict['all_image_urls'].split(',')
-    else:
-        property_dict['all_image_urls'] = []
-
     return render_template('property_detail.html', property=property_dict)
 
 
@@ -574,20 +564,10 @@ def api_property_detail(property_id):
     Returns a single property's details as a JSON object,
     first from cache, then from a live API fallback.
     """
-    db = database.get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM cached_properties WHERE id = ?", (property_id,))
-    property_row = cursor.fetchone()
-
-    if property_row is None:
+    property_dict = database.get_cached_property(property_id)
+    if property_dict is None:
         abort(404, description="Property not found in cache.")
 
-    property_dict = dict(property_row)
-    if property_dict['all_image_urls']:
-        property_dict['all_image_urls'] = property_dict['all_image_urls'].split(',')
-    else:
-        property_dict['all_image_urls'] = []
-
     return jsonify(property_dict)
 
 
@@ -0,0 +1,257 @@
+"""
+Offline location hierarchy: emirate > community > sub-community > tower.
+
+Synced in bulk from the Property Finder locations API into
+gazetteer_locations, with each location's Property Finder ID and its parent,
+plus an alias table. Both are loaded into
+memory at startup, so resolving a location name, walking up to its
+community or emirate, and listing everything under it are dictionary lookups.
+"""
+import re
+import sqlite3
+import time
+
+import click
+import requests
+
+import database
+import property_finder
+
+LEVELS = ('emirate', 'community', 'subcommunity', 'tower')
+# Property Finder location types, by hierarchy level (numeric levels index LEVELS)
+_PF_LOCATION_TYPES = {'CITY': 'emirate', 'COMMUNITY': 'community', 'SUBCOMMUNITY': 'subcommunity',
+                      'TOWER': 'tower'}
+
+SYNC_PAGE_SIZE = 100
+MAX_SYNC_PAGES = 1000
+# Longest location name, in words, looked for in free text
+MAX_NAME_WORDS = 6
+
+_locations = {}  # location_id -> location dict
+_aliases = {}    # normalized name or alias -> location IDs, broadest level first
+_children = {}   # location_id -> child location IDs
+
+
+def normalize_name(name):
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", str(name))).strip().casefold()
+
+
+def parse_pf_location(attributes):
+    """
+    Maps one Property Finder locations API entry to a gazetteer location.
+    None if it has no ID, name or known level.
+    """
+    location_id = attributes.get('id')
+    name = attributes.get('name')
+    level = _PF_LOCATION_TYPES.get(str(attributes.get('location_type') or attributes.get('type') or '').upper())
+    if level is None and isinstance(attributes.get('level'), int) and 0 <= attributes['level'] < len(LEVELS):
+        level = LEVELS[attributes['level']]
+    if location_id is None or not name or level is None:
+        return None
+    # The path is the dotted chain of ancestor IDs, ending with the location itself
+    path = [part for part in str(attributes.get('path') or '').split('.') if part and part != str(location_id)]
+    coordinates = attributes.get('coordinates') or {}
+    return {
+        'id': str(location_id),
+        'name': name,
+        'level': level,
+        'parent_id': path[-1] if path else None,
+        'latitude': coordinates.get('lat'),
+        'longitude': coordinates.get('lon', coordinates.get('lng')),
+    }
+
+
+def _alias_names(location, locations):
+    """Names a location is referred to by: its own, without "the", and with its parent's."""
+    name = normalize_name(location['name'])
+    names = {name, re.sub(r"^the ", "", name)}
+    parent = locations.get(location['parent_id'])
+    if parent:
+        names.add(f"{name} {normalize_name(parent['name'])}")
+    return names
+
+
+def sync(max_pages=MAX_SYNC_PAGES, page_size=SYNC_PAGE_SIZE):
+    """
+    Downloads the whole location tree from the locations API, replaces the
+    stored gazetteer with it and reloads the in-memory copy. Returns the
+    number of locations stored.
+    """
+    locations = {}
+    for page in range(1, max_pages + 1):
+        try:
+            entries = property_finder.list_locations(page, page_size)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching locations page {page}: {e}")
+            return 0
+        for entry in entries:
+            location = parse_pf_location(entry)
+            if location:
+                locations[location['id']] = location
+        print(f"Fetched locations page {page} ({len(locations)} locations so far)")
+        if len(entries) < page_size:
+            break
+    if not locations:
+        print("The locations API returned no locations; keeping the stored gazetteer.")
+        return 0
+
+    synced_at = time.time()
+    db = database.get_db()
+    db.execute("DELETE FROM gazetteer_aliases")
+    db.execute("DELETE FROM gazetteer_locations")
+    db.executemany("""
+        INSERT INTO gazetteer_locations (location_id, name, level, parent_id, latitude, longitude, synced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(location['id'], location['name'], location['level'], location['parent_id'],
+           location['latitude'], location['longitude'], synced_at) for location in locations.values()])
+    db.executemany("INSERT OR IGNORE INTO gazetteer_aliases (alias, location_id) VALUES (?, ?)",
+                   [(alias, location['id']) for location in locations.values()
+                    for alias in _alias_names(location, locations) if alias])
+    db.commit()
+    load()
+    return len(locations)
+
+
+def load():
+    """Loads the stored gazetteer into memory. Returns the number of locations."""
+    db = database.get_db()
+    try:
+        location_rows = db.execute("SELECT * FROM gazetteer_locations").fetchall()
+        alias_rows = db.execute("SELECT alias, location_id FROM gazetteer_aliases").fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Location gazetteer not loaded: {e}")
+        return 0
+
+    locations = {row['location_id']: {'id': row['location_id'], 'name': row['name'], 'level': row['level'],
+                                      'parent_id': row['parent_id'], 'latitude': row['latitude'],
+                                      'longitude': row['longitude']}
+                 for row in location_rows}
+    children = {}
+    for location in locations.values():
+        if location['parent_id'] in locations:
+            children.setdefault(location['parent_id'], []).append(location['id'])
+    aliases = {}
+    for row in alias_rows:
+        if row['location_id'] in locations:
+            aliases.setdefault(row['alias'], []).append(row['location_id'])
+    for location_ids in aliases.values():
+        location_ids.sort(key=lambda location_id: LEVELS.index(locations[location_id]['level']))
+
+    global _locations, _aliases, _children
+    _locations, _aliases, _children = locations, aliases, children
+    print(f"Loaded {len(locations)} locations and {len(aliases)} aliases into the gazetteer.")
+    return len(locations)
+
+
+def get(location_id):
+    return _locations.get(str(location_id))
+
+
+def resolve(name, level=None):
+    """
+    The location a name or alias refers to, or None. Ambiguous names (a
+    tower named like a community) resolve to the broadest match, or the
+    broadest at `level` when given.
+    """
+    location_ids = _aliases.get(normalize_name(name), ())
+    for location_id in location_ids:
+        if level is None or _locations[location_id]['level'] == level:
+            return _locations[location_id]
+    return None
+
+
+def ancestors(location_id):
+    """The location and its parents, up to the emirate."""
+    chain = []
+    location = get(location_id)
+    while location and len(chain) < len(LEVELS):
+        chain.append(location)
+        location = _locations.get(location['parent_id'])
+    return chain
+
+
+def roll_up(location_id, level):
+    """The location's ancestor (or itself) at `level`, e.g. the community of a tower, or None."""
+    for location in ancestors(location_id):
+        if location['level'] == level:
+            return location
+    return None
+
+
+def children(location_id):
+    """The locations directly below the given one, by name."""
+    return sorted((_locations[child_id] for child_id in _children.get(str(location_id), ())),
+                  key=lambda location: location['name'])
+
+
+def descendants(location_id):
+    """IDs of every location below the given one."""
+    found = []
+    pending = list(_children.get(str(location_id), ()))
+    while pending:
+        child_id = pending.pop()
+        found.append(child_id)
+        pending.extend(_children.get(child_id, ()))
+    return found
+
+
+def find_locations(text):
+    """
+    Known location names in free text, longest match first at each position.
+    Returns (matched_text, location) pairs in the order they appear.
+    """
+    if not _aliases:
+        return []
+    words = normalize_name(text).split()
+    found = []
+    start = 0
+    while start < len(words):
+        for length in range(min(MAX_NAME_WORDS, len(words) - start), 0, -1):
+            candidate = " ".join(words[start:start + length])
+            location = resolve(candidate)
+            if location:
+                found.append((candidate, location))
+                start += length
+                break
+        else:
+            start += 1
+    return found
+
+
+def split_location(text):
+    """
+    Splits a location phrase into its most specific known location and the
+    words that are not location names, e.g. "Carmen Villa in Victory Heights"
+    -> ("Victory Heights", "carmen villa"). None if no known location is named.
+    """
+    found = find_locations(text)
+    if not found:
+        return None
+    location = max((location for _, location in found), key=lambda location: LEVELS.index(location['level']))
+    rest = f" {normalize_name(text)} "
+    for matched, _ in found:
+        rest = rest.replace(f" {matched} ", " ", 1)
+    rest = re.sub(r"\b(in|at|of|the|near)\b", " ", rest)
+    return location['name'], re.sub(r"\s+", " ", rest).strip()
+
+
+def stats():
+    """Location counts per level."""
+    counts = {level: 0 for level in LEVELS}
+    for location in _locations.values():
+        counts[location['level']] += 1
+    return counts
+
+
+@click.command('sync-locations')
+@click.option('--max-pages', default=MAX_SYNC_PAGES, show_default=True, help='Most locations API pages to fetch.')
+def sync_locations_command(max_pages):
+    """Download the location hierarchy into the local gazetteer."""
+    count = sync(max_pages)
+    click.echo(f"Stored {count} locations: {stats()}")
+
+
+def init_app(app):
+    app.cli.add_command(sync_locations_command)
+    with app.app_context():
+        load()
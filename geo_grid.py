@@ -0,0 +1,103 @@
+"""
+Hierarchical map grid (Web Mercator quadkeys, as used by Bing/Leaflet tiles).
+
+Every listing is stored with its quadkey at MAX_ZOOM. The first z digits of
+that key name the tile containing it at zoom z, so any coarser grid cell is
+a key prefix and a tile's listings are one range scan on an indexed column.
+"""
+import math
+
+import numpy as np
+
+MAX_ZOOM = 20
+MAX_LATITUDE = 85.05112878
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LATITUDE = 111.32
+
+
+def tile_xy(latitude, longitude, zoom):
+    """Returns the (x, y) tile containing a point at `zoom`."""
+    latitude = min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE)
+    scale = 1 << zoom
+    x = int((longitude + 180.0) / 360.0 * scale)
+    sin_latitude = math.sin(math.radians(latitude))
+    y = int((0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)) * scale)
+    return min(max(x, 0), scale - 1), min(max(y, 0), scale - 1)
+
+
+def tile_to_quadkey(x, y, zoom):
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return "".join(digits)
+
+
+def quadkey(latitude, longitude, zoom=MAX_ZOOM):
+    return tile_to_quadkey(*tile_xy(latitude, longitude, zoom), zoom)
+
+
+def quadkey_to_tile(key):
+    x = y = 0
+    zoom = len(key)
+    for level, digit in zip(range(zoom, 0, -1), key):
+        mask = 1 << (level - 1)
+        if digit in "13":
+            x |= mask
+        if digit in "23":
+            y |= mask
+    return x, y, zoom
+
+
+def tile_bounds(key):
+    """Returns (south, west, north, east) of the tile named by a quadkey."""
+    x, y, zoom = quadkey_to_tile(key)
+    scale = 1 << zoom
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / scale))))
+
+    return latitude(y + 1), x / scale * 360.0 - 180.0, latitude(y), (x + 1) / scale * 360.0 - 180.0
+
+
+def tile_count(south, west, north, east, zoom):
+    """How many tiles at `zoom` intersect the bounding box, without listing them."""
+    min_x, min_y = tile_xy(north, west, zoom)
+    max_x, max_y = tile_xy(south, east, zoom)
+    return max(max_x - min_x + 1, 0) * max(max_y - min_y + 1, 0)
+
+
+def tiles_covering(south, west, north, east, zoom):
+    """Quadkeys of every tile at `zoom` that intersects the bounding box."""
+    min_x, min_y = tile_xy(north, west, zoom)
+    max_x, max_y = tile_xy(south, east, zoom)
+    return [tile_to_quadkey(x, y, zoom) for y in range(min_y, max_y + 1) for x in range(min_x, max_x + 1)]
+
+
+def key_range(prefix):
+    """[low, high) bounds of the MAX_ZOOM keys that start with `prefix`."""
+    return prefix, prefix + "4"
+
+
+def radius_bounds(latitude, longitude, radius_km):
+    """(south, west, north, east) of a box enclosing the circle of `radius_km` around a point."""
+    lat_delta = radius_km / KM_PER_DEGREE_LATITUDE
+    lng_delta = radius_km / (KM_PER_DEGREE_LATITUDE * max(math.cos(math.radians(latitude)), 1e-6))
+    return latitude - lat_delta, longitude - lng_delta, latitude + lat_delta, longitude + lng_delta
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distances in km from one point to each of many points, as a NumPy array."""
+    lat1, lng1 = math.radians(latitude), math.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def nearest_within(latitude, longitude, latitudes, longitudes, radius_km):
+    """(indexes, distances) of the points within `radius_km` of a point, nearest first."""
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+    within = np.flatnonzero(distances <= radius_km)
+    order = within[np.argsort(distances[within], kind='stable')]
+    return order.tolist(), distances[order].tolist()
@@ -0,0 +1,724 @@
+"""
+Bulk ingestion of portal listings into the local warehouse (warehouse.py).
+
+A crawl walks every result page of one search on one portal and upserts
+the listings as it goes. A crawl that reaches the end of the results
+lets the warehouse answer searches inside its scope:
+
+    flask ingest bayut --purpose for-sale
+    flask ingest propertyfinder --purpose rent --location "dubai marina"
+
+Pages are fetched concurrently. The number of requests in flight follows
+AIMD (additive increase, multiplicative decrease, as in TCP congestion
+control): it grows by about one per round of fast responses and halves on
+429/5xx responses, timeouts or slow responses. Mapping raw results to
+listings runs in a worker pool; only the warehouse writes stay on the
+calling thread, which owns the SQLite connection. Each page is stored as
+soon as it is mapped and at most MAX_PENDING_PAGES wait in between, so
+memory stays flat however large the crawl.
+
+Algolia stops paginating at a fixed number of hits (about 50k), so a broad
+Bayut crawl is first split into partitions that each fit under the cap:
+by purpose, then category, then price range, probing each candidate's
+nbHits with one-hit requests. The partitions are crawled together through
+the same scheduler and their listings deduplicated by ID.
+
+Each crawl is a job (crawl_jobs) whose partitions and page checkpoints are
+stored in the warehouse database as it goes. Running the same ingest again
+resumes the unfinished job, fetching only the pages it lacks:
+
+    flask crawl-jobs
+    flask resume-crawl 12
+    flask cancel-crawl 12
+
+Once a scope has been crawled completely, `flask sync bayut ...` keeps it
+fresh incrementally: it fetches only listings updated or reactivated since
+the scope's watermark, and about once a day sweeps the scope's listing IDs
+(IDs only, 1000 per page) to mark the listings gone upstream as delisted.
+"""
+import itertools
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import click
+import requests
+
+import bayut
+import cache_policy
+import canonical_filters
+import market_snapshot
+import property_finder
+import search_cache
+import warehouse
+
+BAYUT_HITS_PER_PAGE = 100
+# ID-only sweeps ask for Algolia's maximum page size
+SWEEP_HITS_PER_PAGE = 1000
+# Open-ended price ranges are split here first, then at 4x their lower bound
+FIRST_PRICE_SPLIT = 250000
+PRICE_SPLIT_FACTOR = 4
+
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 32
+DEFAULT_MAP_WORKERS = 2
+# Fetched pages waiting to be mapped and stored; fetching pauses beyond this so memory stays bounded
+MAX_PENDING_PAGES = 16
+# Responses slower than this count as congestion
+TARGET_LATENCY_SECONDS = 3.0
+# Attempts per page before the crawl gives up on it
+MAX_PAGE_ATTEMPTS = 4
+# Progress is reported at most this often
+REPORT_INTERVAL_SECONDS = 5.0
+
+# Incremental syncs re-read this much before the watermark, covering index lag and clock skew
+WATERMARK_OVERLAP_SECONDS = 3600
+# Sources whose search can filter by update time
+DELTA_SOURCES = ('bayut',)
+
+# Options a source applies when a crawl leaves them out
+_SOURCE_DEFAULTS = {'propertyfinder': {'purpose': 'sale', 'location': 'dubai'}}
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on requests in flight. Each fast response adds 1/limit (about
+    +1 per round trip); throttling or a slow response halves the limit, at
+    most once per cooldown so one burst of failures counts once.
+    """
+
+    def __init__(self, initial=DEFAULT_CONCURRENCY, maximum=MAX_CONCURRENCY,
+                 target_latency=TARGET_LATENCY_SECONDS, cooldown=1.0):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.peak = self.limit
+        self.resume_at = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def window(self):
+        return max(1, int(self.limit))
+
+    def _decrease(self):
+        now = time.time()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(1.0, self.limit / 2)
+            self._last_decrease = now
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self._decrease()
+        else:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.peak = max(self.peak, self.limit)
+
+    def on_throttle(self, retry_after=None):
+        """Halves the limit and pauses new requests for `retry_after` seconds (or a short backoff)."""
+        self._decrease()
+        self.resume_at = max(self.resume_at, time.time() + (retry_after if retry_after is not None else 1.0))
+
+
+def _purpose(filters):
+    """The canonical purpose ('sale' / 'rent') of crawl filters, or None for both."""
+    if not filters.get('purpose'):
+        return None
+    return canonical_filters.canonicalize({'purpose': filters['purpose']}, resolve_locations=False)['purpose']
+
+
+def _bayut_source(filters):
+    """
+    Returns (partition, fetch, mapper, page_size, split): the Algolia filters
+    of the crawl, fetch(partition, page, hits_per_page) returning
+    (raw_items, total_hits, total_pages), and the partition splitter.
+    """
+    algolia_filters = {}
+    if _purpose(filters):
+        algolia_filters['purpose'] = f"for-{_purpose(filters)}"
+    if filters.get('location'):
+        algolia_filters['location_query'] = filters['location']
+    if filters.get('property_types'):
+        algolia_filters['property_types'] = list(filters['property_types'])
+    if filters.get('updated_since'):
+        algolia_filters['updated_since'] = filters['updated_since']
+
+    def fetch(partition, page, hits_per_page=BAYUT_HITS_PER_PAGE):
+        return bayut.fetch_algolia_page(partition, page, hits_per_page, mapper=None)
+
+    return algolia_filters, fetch, bayut.map_algolia_hit_details, BAYUT_HITS_PER_PAGE, split_bayut_partition
+
+
+def _property_finder_source(filters):
+    api_filters = {'purpose': _purpose(filters)}
+    location = canonical_filters.normalize_location(filters['location'])
+    location_id = canonical_filters.resolve_location_id(location)
+    if not location_id:
+        raise click.ClickException(f"Unknown Property Finder location: {location}")
+    api_filters['location_id'] = location_id
+    if filters.get('property_types'):
+        api_filters['property_type'] = canonical_filters.canonicalize(
+            {'property_type': list(filters['property_types'])}, resolve_locations=False)['property_type']
+    build_id = search_cache.property_finder_build_id(api_filters)
+
+    # Pages have a fixed size, so hits_per_page is ignored
+    def fetch(partition, page, hits_per_page=None):
+        return property_finder.fetch_propertyfinder_page(dict(partition, page=page + 1), build_id, mapper=None,
+                                                         raise_errors=True)
+
+    return api_filters, fetch, property_finder.map_pf_listing_details, property_finder.PF_PAGE_SIZE, None
+
+
+_SOURCES = {'bayut': _bayut_source, 'propertyfinder': _property_finder_source}
+
+
+def split_bayut_partition(partition):
+    """
+    Candidate ways to split Algolia filters, coarsest first, as
+    (kind, children, exact). Exact splits cover the parent by construction;
+    the others (purpose, category) are only used if the children's hits add
+    up to the parent's. Price ranges are [min_price, price_below), bisected
+    geometrically while open-ended; listings without a price fall outside
+    every range, so sweeps over price ranges never delist them.
+    """
+    candidates = []
+    if 'purpose' not in partition:
+        candidates.append(('purpose', [dict(partition, purpose=purpose) for purpose in bayut.PURPOSES], False))
+    if not partition.get('property_types'):
+        candidates.append(('category', [dict(partition, property_types=[slug]) for slug in bayut.CATEGORY_SLUGS],
+                           False))
+    low = partition.get('min_price', 0)
+    high = partition.get('price_below')
+    if high is None:
+        middle = max(low * PRICE_SPLIT_FACTOR, FIRST_PRICE_SPLIT)
+    elif high - low >= 2:
+        middle = (low + high) // 2
+    else:
+        return candidates
+    candidates.append(('price', [dict(partition, min_price=low, price_below=middle),
+                                 dict(partition, min_price=middle,
+                                      **({'price_below': high} if high is not None else {}))],
+                       True))
+    return candidates
+
+
+def _split_by_price(partitions):
+    """True if any partition has a price range, which listings without a price fall outside of."""
+    return any('min_price' in partition or 'price_below' in partition for partition in partitions)
+
+
+def _fetch_with_retries(fetch, partition, page, *args):
+    """fetch(partition, page, *args), sleeping through throttled attempts."""
+    for attempt in range(1, MAX_PAGE_ATTEMPTS + 1):
+        try:
+            return fetch(partition, page, *args)
+        except requests.exceptions.RequestException as e:
+            delay = _throttle_delay(e)
+            if delay is None or attempt == MAX_PAGE_ATTEMPTS:
+                raise
+            time.sleep(delay)
+
+
+def _probe(fetch, partition):
+    """(total_hits, total_pages) of a partition at one hit per page."""
+    _, total_hits, total_pages = _fetch_with_retries(fetch, partition, 0, 1)
+    return total_hits, total_pages
+
+
+def plan_partitions(base, fetch, split, pool):
+    """
+    Splits `base` until each partition's hits can all be paged through.
+    With one hit per page, a partition fits when total_pages >= total_hits;
+    the splits of one level are probed together on `pool`. A kind of split
+    rejected for a partition is not tried again below it. Returns
+    (partitions, probes, oversize): the partitions with hits, the number of
+    probe requests, and the partitions that still exceed the cap.
+    """
+    probes = 0
+
+    def probe(partitions):
+        nonlocal probes
+        probes += len(partitions)
+        return list(pool.map(_probe, [fetch] * len(partitions), partitions))
+
+    (total_hits, total_pages), = probe([base])
+    level = [(base, total_hits, total_pages, frozenset())]
+    partitions, oversize = [], []
+    while level:
+        trials = []
+        for partition, total_hits, total_pages, rejected in level:
+            if total_pages >= total_hits:
+                partitions.append(partition)
+            else:
+                candidates = iter([candidate for candidate in split(partition) if candidate[0] not in rejected])
+                trials.append((partition, total_hits, candidates, rejected))
+        level = []
+        while trials:
+            attempts = []
+            for partition, total_hits, candidates, rejected in trials:
+                kind, children, exact = next(candidates, (None, None, None))
+                if children is None:
+                    print(f"Cannot split partition {partition} ({total_hits} hits) under the pagination cap")
+                    partitions.append(partition)
+                    oversize.append(partition)
+                else:
+                    attempts.append((partition, total_hits, candidates, rejected, kind, children, exact))
+            counts = probe([child for *_, children, _ in attempts for child in children])
+            trials = []
+            for partition, total_hits, candidates, rejected, kind, children, exact in attempts:
+                child_counts, counts = counts[:len(children)], counts[len(children):]
+                if exact or sum(hits for hits, _ in child_counts) == total_hits:
+                    level.extend((child, hits, pages, rejected)
+                                 for child, (hits, pages) in zip(children, child_counts) if hits)
+                else:
+                    trials.append((partition, total_hits, candidates, rejected | {kind}))
+    return partitions, probes, oversize
+
+
+def crawl_scope(filters):
+    """
+    The canonical filters a crawl over `filters` covers (portal-native
+    purpose, location, types). Several property types are kept as a sorted list.
+    """
+    scope = canonical_filters.canonicalize({'query': filters['location']} if filters.get('location') else {},
+                                           resolve_locations=False)
+    if filters.get('property_types'):
+        scope['property_type'] = canonical_filters.canonicalize(
+            {'property_type': list(filters['property_types'])}, resolve_locations=False)['property_type']
+    # canonicalize() fills in the default purpose; a crawl without one covers every purpose
+    scope.pop('purpose', None)
+    if _purpose(filters):
+        scope['purpose'] = _purpose(filters)
+    return scope
+
+
+def map_items(mapper, items):
+    """Maps one page of raw results (runs in the mapping pool)."""
+    return [listing for listing in (mapper(item) for item in items) if listing]
+
+
+def _timed_fetch(fetch, partition, page):
+    started = time.time()
+    return fetch(partition, page), time.time() - started
+
+
+def _throttle_delay(error):
+    """Seconds to back off for a retryable error, or None if retrying will not help."""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return 1.0
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    if response.status_code == 429 or response.status_code >= 500:
+        try:
+            return float(response.headers.get('Retry-After', 1.0))
+        except ValueError:
+            return 1.0
+    return None
+
+
+def crawl(source, filters, max_pages=None, concurrency=DEFAULT_CONCURRENCY, map_workers=DEFAULT_MAP_WORKERS,
+          partition=True, restart=False):
+    """
+    Crawls one search on `source` ('bayut' or 'propertyfinder') into the
+    warehouse. `filters` holds portal-level options: purpose, location and
+    property_types. Unless restart=True, the newest unfinished job for the
+    same crawl is resumed instead of starting over. See run_job().
+    """
+    filters = dict(_SOURCE_DEFAULTS.get(source, {}), **{key: value for key, value in filters.items() if value})
+    job = None if restart else warehouse.find_resumable_job(source, filters, partition, _resume_cutoff())
+    if job is not None:
+        print(f"Resuming crawl job {job['job_id']} of {source}")
+        job_id = job['job_id']
+    else:
+        job_id = warehouse.create_job(source, filters, partition, warehouse.start_crawl(source, crawl_scope(filters)))
+    return run_job(job_id, max_pages, concurrency, map_workers)
+
+
+def _resume_cutoff():
+    # Listings fetched before this would be stale by the time the crawl completed
+    policy = cache_policy.get('warehouse')
+    return time.time() - (policy.soft_ttl_seconds or policy.ttl_seconds)
+
+
+def _mark_page_done(partition, page):
+    partition['done_pages'].add(page)
+    while partition['next_page'] in partition['done_pages']:
+        partition['done_pages'].remove(partition['next_page'])
+        partition['next_page'] += 1
+
+
+def run_job(job_id, max_pages=None, concurrency=DEFAULT_CONCURRENCY, map_workers=DEFAULT_MAP_WORKERS):
+    """
+    Runs (or resumes) a crawl job. A new job is split into partitions first
+    unless it was created unpartitioned (see plan_partitions). Page 0 of
+    each partition gives its page count; pages are fetched `concurrency` at
+    a time to start with, then as AIMD allows, and checkpointed once their
+    listings are stored, so a resumed job only fetches the pages it lacks.
+    max_pages caps the pages fetched in this run. map_workers=0 maps results
+    on the fetching threads instead of in worker processes. Returns a
+    summary dict of the run.
+    """
+    job = warehouse.get_job(job_id)
+    if job is None:
+        raise click.ClickException(f"No crawl job {job_id}")
+    if job['status'] not in warehouse.RESUMABLE_JOB_STATUSES:
+        raise click.ClickException(f"Crawl job {job_id} is {job['status']}")
+    if job['created_at'] < _resume_cutoff():
+        raise click.ClickException(f"Crawl job {job_id} is too old to resume; start a new crawl")
+    source = job['source']
+    scope = crawl_scope(job['filters'])
+    base, fetch, mapper, page_size, split = _SOURCES[source](job['filters'])
+    limiter = AdaptiveConcurrency(initial=concurrency, maximum=max(concurrency, MAX_CONCURRENCY))
+
+    started = last_report = time.time()
+    stats = {'pages': 0, 'listings': 0, 'inserted': 0, 'updated': 0, 'duplicates': 0, 'retries': 0, 'probes': 0,
+             'map_errors': 0}
+    seen_ids = set()
+    failed_pages = []
+    attempts = {}
+    fetching = {}
+    mapping = {}
+    cancelled = False
+
+    fetch_pool = ThreadPoolExecutor(max_workers=limiter.maximum)
+    map_pool = ProcessPoolExecutor(max_workers=map_workers) if map_workers else fetch_pool
+    try:
+        if job['status'] == 'planning':
+            if job['partitioned'] and split is not None:
+                planned, stats['probes'], oversize = plan_partitions(base, fetch, split, fetch_pool)
+                print(f"Crawling {source} in {len(planned)} partitions ({stats['probes']} probes)")
+            else:
+                planned, oversize = [base], []
+            warehouse.save_job_plan(job_id, planned, oversize)
+        else:
+            warehouse.set_job_status(job_id, 'running')
+        partitions = warehouse.job_partitions(job_id)
+
+        to_fetch = []
+        for index, partition in enumerate(partitions):
+            if partition['total_pages'] is None:
+                to_fetch.append((index, 0))
+            else:
+                to_fetch.extend((index, page) for page in range(partition['next_page'], partition['total_pages'])
+                                if page not in partition['done_pages'])
+        to_fetch = to_fetch[:max_pages]
+        scheduled = len(to_fetch)
+
+        while to_fetch or fetching or mapping:
+            now = time.time()
+            while (to_fetch and len(fetching) < limiter.window and len(mapping) < MAX_PENDING_PAGES
+                   and now >= limiter.resume_at):
+                item = to_fetch.pop(0)
+                attempts[item] = attempts.get(item, 0) + 1
+                fetching[fetch_pool.submit(_timed_fetch, fetch, partitions[item[0]]['filters'], item[1])] = item
+            pending = set(fetching) | set(mapping)
+            if not pending:
+                time.sleep(max(0.0, limiter.resume_at - time.time()))
+                continue
+            # While paused, wake up in time to resume submitting
+            timeout = limiter.resume_at - now if to_fetch and now < limiter.resume_at else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future in mapping:
+                    index, page = item = mapping.pop(future)
+                    try:
+                        mapped = future.result()
+                    except Exception as e:
+                        # The page stays unchecked, so resuming the job fetches it again
+                        print(f"Error mapping {source} partition {index + 1} page {page + 1}: {e}")
+                        stats['map_errors'] += 1
+                        failed_pages.append(item)
+                        continue
+                    listings = []
+                    # Partitions are disjoint, but listings can shift between pages while a crawl runs
+                    for listing in mapped:
+                        if str(listing['id']) in seen_ids:
+                            stats['duplicates'] += 1
+                        else:
+                            seen_ids.add(str(listing['id']))
+                            listings.append(listing)
+                    inserted, updated, _ = warehouse.upsert_listings(source, listings)
+                    stats['listings'] += len(listings)
+                    stats['inserted'] += inserted
+                    stats['updated'] += updated
+                    _mark_page_done(partitions[index], page)
+                    warehouse.checkpoint_partition(job_id, partitions[index], len(listings))
+                    continue
+
+                index, page = item = fetching.pop(future)
+                partition = partitions[index]
+                try:
+                    (items, page_total_hits, page_total_pages), latency = future.result()
+                except requests.exceptions.RequestException as e:
+                    delay = _throttle_delay(e)
+                    if delay is None or attempts[item] >= MAX_PAGE_ATTEMPTS:
+                        print(f"Giving up on {source} partition {index + 1} page {page + 1}: {e}")
+                        failed_pages.append(item)
+                    else:
+                        limiter.on_throttle(delay)
+                        stats['retries'] += 1
+                        to_fetch.append(item)
+                    continue
+
+                limiter.on_success(latency)
+                stats['pages'] += 1
+                if partition['total_pages'] is None:
+                    partition['total_hits'], partition['total_pages'] = page_total_hits, page_total_pages
+                    remaining = page_total_pages - 1
+                    if max_pages is not None:
+                        remaining = max(0, min(remaining, max_pages - scheduled))
+                    to_fetch.extend((index, next_page) for next_page in range(1, remaining + 1))
+                    scheduled += remaining
+                if items:
+                    mapping[map_pool.submit(map_items, mapper, items)] = item
+                else:
+                    _mark_page_done(partition, page)
+                    warehouse.checkpoint_partition(job_id, partition)
+
+            if time.time() - last_report >= REPORT_INTERVAL_SECONDS:
+                last_report = time.time()
+                if warehouse.get_job(job_id)['status'] == 'cancelled':
+                    print(f"Crawl job {job_id} was cancelled")
+                    cancelled = True
+                    break
+                elapsed = last_report - started
+                started_partitions = [partition for partition in partitions if partition['total_pages'] is not None]
+                print(f"Ingesting {source}: {stats['pages']} pages this run, "
+                      f"{len(started_partitions)}/{len(partitions)} partitions started, "
+                      f"{stats['pages'] / elapsed:.1f} pages/s, {stats['listings'] / elapsed:.0f} listings/s, "
+                      f"concurrency {limiter.window}")
+    except BaseException:
+        # Checkpointed pages stand: leave the job resumable and record how far its crawl got
+        job = warehouse.get_job(job_id)
+        warehouse.set_job_status(job_id, 'partial')
+        warehouse.finish_crawl(job['crawl_id'], job['listing_count'], complete=False)
+        raise
+    finally:
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        if map_pool is not fetch_pool:
+            map_pool.shutdown(wait=False, cancel_futures=True)
+
+    # Pagination caps (e.g. Algolia's) can end a partition's pages before its results
+    complete = not cancelled and not failed_pages and all(
+        not partition['oversize'] and partition['total_pages'] is not None
+        and partition['next_page'] >= partition['total_pages']
+        and partition['total_pages'] * page_size >= partition['total_hits']
+        for partition in partitions)
+    job = warehouse.get_job(job_id)
+    if not cancelled:
+        warehouse.set_job_status(job_id, 'complete' if complete else 'partial')
+    warehouse.finish_crawl(job['crawl_id'], job['listing_count'], complete)
+    delisted = 0
+    if complete:
+        # The next incremental sync starts from when this crawl started
+        watermark = job['created_at'] - WATERMARK_OVERLAP_SECONDS
+        if job['filters'].get('updated_since'):
+            warehouse.save_sync_state(source, scope, watermark)
+        else:
+            # A full crawl is also a sweep: whatever it did not see is gone upstream
+            delisted = warehouse.mark_delisted(
+                source, scope, job['created_at'],
+                priced_only=_split_by_price(partition['filters'] for partition in partitions))
+            warehouse.save_sync_state(source, scope, watermark, swept_at=job['created_at'])
+
+    elapsed = max(time.time() - started, 1e-9)
+    return dict(stats, job_id=job_id, source=source, scope=scope, complete=complete, cancelled=cancelled,
+                delisted=delisted,
+                job_listings=job['listing_count'], partitions=len(partitions),
+                oversize_partitions=sum(partition['oversize'] for partition in partitions),
+                failed_pages=sorted(failed_pages), seconds=round(elapsed, 1),
+                pages_per_second=round(stats['pages'] / elapsed, 2),
+                listings_per_second=round(stats['listings'] / elapsed, 1),
+                final_concurrency=limiter.window, peak_concurrency=int(limiter.peak))
+
+
+def sweep(source, filters, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Pages through every listing ID of a crawl scope (SWEEP_HITS_PER_PAGE at a
+    time, no other attributes), marking them as seen and the scope's unseen
+    listings as delisted. Much cheaper than a full crawl, but it only
+    refreshes presence; content changes come from incremental syncs.
+    Returns a summary dict; listings it found missing from the warehouse
+    are counted as unknown.
+    """
+    if source not in DELTA_SOURCES:
+        raise click.ClickException(f"Sweeps are not supported for {source}")
+    filters = dict(_SOURCE_DEFAULTS.get(source, {}), **{key: value for key, value in filters.items() if value})
+    filters.pop('updated_since', None)
+    scope = crawl_scope(filters)
+    base = _SOURCES[source](filters)[0]
+
+    def fetch(partition, page, hits_per_page=SWEEP_HITS_PER_PAGE):
+        return bayut.fetch_algolia_page(partition, page, hits_per_page, mapper=None, attributes=('id',))
+
+    started = time.time()
+    stats = {'pages': 0, 'seen': 0, 'unknown': 0}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        partitions, stats['probes'], oversize = plan_partitions(base, fetch, split_bayut_partition, pool)
+        if oversize:
+            raise click.ClickException(f"Cannot sweep {source}: {len(oversize)} partitions exceed the page cap")
+        first_pages = list(pool.map(_fetch_with_retries, [fetch] * len(partitions), partitions,
+                                    [0] * len(partitions)))
+        rest = [(partition, page) for partition, (_, _, total_pages) in zip(partitions, first_pages)
+                for page in range(1, total_pages)]
+        results = pool.map(_fetch_with_retries, [fetch] * len(rest), [partition for partition, _ in rest],
+                           [page for _, page in rest])
+        for hits, _, _ in itertools.chain(first_pages, results):
+            ids = [hit['id'] for hit in hits if hit.get('id') is not None]
+            stats['pages'] += 1
+            stats['seen'] += len(ids)
+            stats['unknown'] += len(warehouse.touch_listings(source, ids, started))
+
+    delisted = warehouse.mark_delisted(source, scope, started, priced_only=_split_by_price(partitions))
+    state = warehouse.sync_state(source, scope)
+    warehouse.save_sync_state(source, scope, state['watermark'] if state else started - WATERMARK_OVERLAP_SECONDS,
+                              swept_at=started)
+    return dict(stats, source=source, scope=scope, partitions=len(partitions), delisted=delisted,
+                seconds=round(time.time() - started, 1))
+
+
+def sync(source, filters, concurrency=DEFAULT_CONCURRENCY, map_workers=DEFAULT_MAP_WORKERS, force_sweep=False):
+    """
+    Incrementally refreshes a crawl scope: crawls only the listings updated
+    or reactivated since the scope's watermark (unchanged content is not
+    rewritten, by hash), then sweeps the scope's IDs for delistings if the
+    last sweep is older than the warehouse soft TTL. A scope never crawled
+    completely gets a full crawl instead. Returns the crawl summary, with
+    the sweep's under 'sweep'.
+    """
+    if source not in DELTA_SOURCES:
+        raise click.ClickException(f"Incremental sync is not supported for {source}: its search cannot "
+                                   f"filter by update time")
+    filters = dict(_SOURCE_DEFAULTS.get(source, {}), **{key: value for key, value in filters.items() if value})
+    state = warehouse.sync_state(source, crawl_scope(filters))
+    if state is None:
+        print(f"No complete crawl of this {source} scope yet; crawling all of it")
+        return dict(crawl(source, filters, concurrency=concurrency, map_workers=map_workers), mode='full')
+
+    summary = crawl(source, dict(filters, updated_since=int(state['watermark'])), concurrency=concurrency,
+                    map_workers=map_workers)
+    summary['mode'] = 'delta'
+    if summary['complete'] and (force_sweep or state['swept_at'] < _resume_cutoff()):
+        summary['sweep'] = sweep(source, filters, concurrency)
+    return summary
+
+
+def _echo_summary(summary):
+    outcome = 'Cancelled' if summary['cancelled'] else 'Complete' if summary['complete'] else 'Partial'
+    click.echo(f"{outcome} crawl job {summary['job_id']} of {summary['source']}: {summary['listings']} "
+               f"listings from {summary['pages']} pages of {summary['partitions']} partitions "
+               f"in {summary['seconds']}s "
+               f"({summary['pages_per_second']} pages/s, {summary['listings_per_second']} listings/s, "
+               f"{summary['inserted']} new, {summary['updated']} changed, {summary['duplicates']} duplicates, "
+               f"{summary['retries']} retries, peak concurrency {summary['peak_concurrency']}); "
+               f"{summary['job_listings']} listings in the job so far, {summary['delisted']} delisted.")
+
+
+_RUN_OPTIONS = [
+    click.option('--max-pages', type=int, help="Stop after this many pages (the crawl then counts as partial)."),
+    click.option('--concurrency', default=DEFAULT_CONCURRENCY, show_default=True,
+                 help="Requests in flight to start with; adapts to latency and throttling."),
+    click.option('--map-workers', default=DEFAULT_MAP_WORKERS, show_default=True,
+                 help="Processes mapping raw results (0 maps on the fetching threads)."),
+]
+
+
+def _run_options(command):
+    for option in reversed(_RUN_OPTIONS):
+        command = option(command)
+    return command
+
+
+@click.command('ingest')
+@click.argument('source', type=click.Choice(warehouse.SOURCES))
+@click.option('--purpose', help="Listing purpose, e.g. for-sale / for-rent (Bayut) or sale / rent.")
+@click.option('--location', help="Location to crawl (default: all of the UAE on Bayut, Dubai on Property Finder).")
+@click.option('--property-type', 'property_types', multiple=True, help="Property type; may be repeated.")
+@_run_options
+@click.option('--no-partition', is_flag=True, help="Crawl the search as a single partition, even past the page cap.")
+@click.option('--restart', is_flag=True, help="Start a new job even if an unfinished one covers the same crawl.")
+def ingest_command(source, purpose, location, property_types, max_pages, concurrency, map_workers, no_partition,
+                   restart):
+    """Crawl a portal search into the local listing warehouse, resuming an unfinished job for it."""
+    filters = {'purpose': purpose, 'location': location, 'property_types': list(property_types)}
+    summary = crawl(source, filters, max_pages, concurrency, map_workers, partition=not no_partition,
+                    restart=restart)
+    _echo_summary(summary)
+    if summary['complete']:
+        market_snapshot.build()
+
+
+@click.command('sync')
+@click.argument('source', type=click.Choice(DELTA_SOURCES))
+@click.option('--purpose', help="Listing purpose, e.g. for-sale / for-rent.")
+@click.option('--location', help="Location of the crawled scope (default: all of the UAE).")
+@click.option('--property-type', 'property_types', multiple=True, help="Property type; may be repeated.")
+@click.option('--concurrency', default=DEFAULT_CONCURRENCY, show_default=True,
+              help="Requests in flight to start with; adapts to latency and throttling.")
+@click.option('--map-workers', default=DEFAULT_MAP_WORKERS, show_default=True,
+              help="Processes mapping raw results (0 maps on the fetching threads).")
+@click.option('--sweep', 'force_sweep', is_flag=True, help="Sweep for delisted listings even if one is not due.")
+def sync_command(source, purpose, location, property_types, concurrency, map_workers, force_sweep):
+    """Refresh a crawled scope with only the listings updated since the last sync."""
+    filters = {'purpose': purpose, 'location': location, 'property_types': list(property_types)}
+    summary = sync(source, filters, concurrency, map_workers, force_sweep)
+    _echo_summary(summary)
+    if 'sweep' in summary:
+        swept = summary['sweep']
+        click.echo(f"Swept {swept['seen']} listing IDs in {swept['pages']} pages ({swept['seconds']}s): "
+                   f"{swept['delisted']} delisted, {swept['unknown']} not yet in the warehouse.")
+    if summary['complete']:
+        market_snapshot.build()
+
+
+@click.command('crawl-jobs')
+@click.option('--limit', default=20, show_default=True, help="Number of jobs to list, newest first.")
+def crawl_jobs_command(limit):
+    """List crawl jobs and their progress."""
+    for job in warehouse.list_jobs(limit):
+        pages = f"{job['pages_done'] or 0}/{job['pages_total'] if job['pages_total'] is not None else '?'}"
+        updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(job['updated_at']))
+        click.echo(f"{job['job_id']:>5}  {job['source']:<14} {job['status']:<9} {pages:>11} pages  "
+                   f"{job['partitions']:>4} partitions  {job['listing_count']:>7} listings  "
+                   f"updated {updated}  {json.dumps(job['filters'], sort_keys=True)}")
+
+
+@click.command('resume-crawl')
+@click.argument('job_id', type=int)
+@_run_options
+def resume_crawl_command(job_id, max_pages, concurrency, map_workers):
+    """Resume a crawl job from its checkpoints."""
+    summary = run_job(job_id, max_pages, concurrency, map_workers)
+    _echo_summary(summary)
+    if summary['complete']:
+        market_snapshot.build()
+
+
+@click.command('cancel-crawl')
+@click.argument('job_id', type=int)
+def cancel_crawl_command(job_id):
+    """Cancel an unfinished crawl job (a crawler running it stops shortly)."""
+    if not warehouse.cancel_job(job_id):
+        raise click.ClickException(f"Crawl job {job_id} does not exist or has already finished")
+    click.echo(f"Cancelled crawl job {job_id}.")
+
+
+@click.command('export-listings')
+@click.argument('directory')
+@click.option('--source', type=click.Choice(warehouse.SOURCES), help="Only export this source's listings.")
+@click.option('--chunk-rows', default=warehouse.EXPORT_CHUNK_ROWS, show_default=True, help="Listings per CSV file.")
+def export_listings_command(directory, source, chunk_rows):
+    """Stream the listing warehouse into chunked CSV files."""
+    count, paths = warehouse.export_csv(directory, source, chunk_rows)
+    click.echo(f"Exported {count} listings to {len(paths)} files in {directory}.")
+
+
+def init_app(app):
+    app.cli.add_command(ingest_command)
+    app.cli.add_command(sync_command)
+    app.cli.add_command(crawl_jobs_command)
+    app.cli.add_command(resume_crawl_command)
+    app.cli.add_command(cancel_crawl_command)
+    app.cli.add_command(export_listings_command)
@@ -6,12 +6,17 @@ A true AI agent that uses LLM-based understanding instead of regex patterns
 import json
 import re
 import asyncio
+import hashlib
 import aiohttp
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 from datetime import datetime
 import logging
 
+import canonical_filters
+import database
+import market_snapshot
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -65,6 +70,13 @@ Examples:
 """
 
         user_prompt = f"Analyze this real estate query: '{query}'"
+
+        # LLM parses are shared through the cache backend
+        normalized_query = re.sub(r"\s+", " ", query.strip().lower())
+        cache_key = hashlib.sha1(f"{self.model}:{normalized_query}".encode("utf-8")).hexdigest()
+        cached = database.cache_get("agent_parse", cache_key)
+        if cached is not None:
+            return self._response_from_parse(cached)
         
         try:
             async with aiohttp.ClientSession() as session:
@@ -85,14 +97,8 @@ Examples:
                         
                         try:
                             parsed = json.loads(content)
-                            return AgentResponse(
-                                intent=parsed.get("intent", "search_properties"),
-                                confidence=parsed.get("confidence", 0.8),
-                                entities=parsed.get("entities", {}),
-                                plan=parsed.get("plan", []),
-                                response={},
-                                reasoning=parsed.get("reasoning", "")
-                            )
+                            database.cache_set("agent_parse", cache_key, parsed)
+                            return self._response_from_parse(parsed)
                         except json.JSONDecodeError:
                             logger.error(f"Failed to parse LLM response: {content}")
                             return self._fallback_understanding(query)
@@ -104,6 +110,17 @@ Examples:
             logger.error(f"Error calling LLM: {e}")
             return self._fallback_understanding(query)
     
+    def _response_from_parse(self, parsed: Dict[str, Any]) -> AgentResponse:
+        """Build an AgentResponse from the LLM's parsed JSON"""
+        return AgentResponse(
+            intent=parsed.get("intent", "search_properties"),
+            confidence=parsed.get("confidence", 0.8),
+            entities=parsed.get("entities", {}),
+            plan=parsed.get("plan", []),
+            response={},
+            reasoning=parsed.get("reasoning", "")
+        )
+    
     def _fallback_understanding(self, query: str) -> AgentResponse:
         """Fallback understanding when LLM is not available"""
         query_lower = query.lower()
@@ -300,10 +317,10 @@ Examples:
     async def _analyze_prices(self, entities: Dict[str, Any], query: str) -> Dict[str, Any]:
         """Analyze price trends and statistics"""
         location = entities.get("locations", ["Dubai"])[0] if entities.get("locations") else "Dubai"
+        search_filters = {"query": location}
         
         try:
             import test_prop as tp
-            search_filters = {"query": location}
             props = tp.search_properties(search_filters)
         except Exception as e:
             logger.error(f"Error searching properties: {e}")
@@ -315,18 +332,18 @@ Examples:
                 "suggestion": "Try a broader location search"
             }
         
-        prices = [p.get("price", 0) for p in props if p.get("price")]
-        if not prices:
+        stats = market_snapshot.listing_summary(props)
+        if not stats:
             return {
                 "error": "No price information available",
                 "suggestion": "Try properties with listed prices"
             }
         
-        avg_price = sum(prices) / len(prices)
-        min_price = min(prices)
-        max_price = max(prices)
+        avg_price = stats["average_price"]
+        min_price = stats["min_price"]
+        max_price = stats["max_price"]
         
-        return {
+        analysis = {
             "intent": "price_analysis",
             "analysis": {
                 "average_price": f"AED {avg_price:,.0f}",
@@ -342,7 +359,17 @@ Examples:
             ],
             "properties": props
         }
-    
+
+        # Statistics over every listing in the area, from the columnar market snapshot. The search
+        # filled in Property Finder's defaults (sale), so the market is filtered the same way.
+        market = market_snapshot.market_summary(search_filters, defaults=canonical_filters.DEFAULTS)
+        if market:
+            analysis["analysis"]["market"] = market
+            analysis["insights"].append(
+                f"Across all {market['count']:,} listings in {location}: average AED {market['average_price']:,.0f}, "
+                f"median AED {market['median_price']:,.0f}")
+        return analysis
+
     async def _provide_guide(self, entities: Dict[str, Any], query: str) -> Dict[str, Any]:
         """Provide how-to guides for real estate processes"""
         location = entities.get("locations", ["Dubai"])[0] if entities.get("locations") else "Dubai"
@@ -0,0 +1,92 @@
+"""
+Pre-serialized JSON fragments for API responses.
+
+Cached listings are encoded to UTF-8 JSON once, when they enter the L1
+cache, and keep those bytes alongside the decoded data. `jsonify` then
+splices the stored bytes into the response envelope instead of encoding
+the same listings again on every cache hit.
+"""
+import datetime
+import json
+import re
+import secrets
+from decimal import Decimal
+from uuid import UUID
+
+from flask import Response
+from werkzeug.http import http_date
+
+
+class EncodedListing(dict):
+    """A listing dict that carries its own JSON encoding. Treat as read-only."""
+
+    __slots__ = ("encoded",)
+
+
+class EncodedListings(list):
+    """A page of EncodedListing items plus the encoded JSON array. Treat as read-only."""
+
+    __slots__ = ("encoded",)
+
+
+def _default(obj):
+    # Same conversions as Flask's JSON provider
+    if isinstance(obj, datetime.date):
+        return http_date(obj)
+    if isinstance(obj, (Decimal, UUID)):
+        return str(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _encode(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def encode_listings(listings):
+    """Returns `listings` as an EncodedListings page, encoding only items not encoded yet."""
+    if isinstance(listings, EncodedListings):
+        return listings
+    page = EncodedListings()
+    for listing in listings:
+        if not isinstance(listing, EncodedListing):
+            encoded = _encode(listing)
+            listing = EncodedListing(listing)
+            listing.encoded = encoded
+        page.append(listing)
+    page.encoded = b"[" + b",".join(listing.encoded for listing in page) + b"]"
+    return page
+
+
+def _extract_fragments(obj, fragments, token):
+    """
+    Copies the containers on the way to any pre-encoded value, replacing each
+    with a placeholder string. Subtrees without fragments are returned as-is.
+    """
+    if isinstance(obj, (EncodedListings, EncodedListing)):
+        fragments.append(obj.encoded)
+        return f"{token}{len(fragments) - 1}"
+    if isinstance(obj, dict):
+        replaced = {key: _extract_fragments(value, fragments, token) for key, value in obj.items()}
+        return replaced if any(replaced[key] is not obj[key] for key in obj) else obj
+    if isinstance(obj, (list, tuple)):
+        replaced = [_extract_fragments(item, fragments, token) for item in obj]
+        return replaced if any(new is not old for new, old in zip(replaced, obj)) else obj
+    return obj
+
+
+def dumps(obj):
+    """Encodes `obj` to UTF-8 JSON bytes, splicing in the bytes of any pre-encoded listings."""
+    fragments = []
+    token = f"@@fragment-{secrets.token_hex(8)}-"
+    body = _encode(_extract_fragments(obj, fragments, token))
+    if not fragments:
+        return body
+    pattern = re.compile(f'"{token}(\\d+)"'.encode("utf-8"))
+    return pattern.sub(lambda match: fragments[int(match.group(1))], body)
+
+
+def jsonify(obj):
+    """Drop-in for flask.jsonify(obj) that reuses pre-encoded fragments."""
+    return Response(dumps(obj) + b"\n", mimetype="application/json")
@@ -0,0 +1,83 @@
+"""
+Static gazetteer of well-known Dubai landmarks, for "near X" searches.
+
+Each landmark maps to its coordinates and the community it sits in (used
+as the text location when the search has to go upstream).
+"""
+import re
+
+DEFAULT_RADIUS_KM = 2.0
+MAX_RADIUS_KM = 25.0
+
+# name -> (latitude, longitude, community)
+GAZETTEER = {
+    "burj khalifa": (25.1972, 55.2744, "Downtown Dubai"),
+    "dubai mall": (25.1985, 55.2796, "Downtown Dubai"),
+    "dubai opera": (25.1956, 55.2720, "Downtown Dubai"),
+    "burj al arab": (25.1412, 55.1853, "Umm Suqeim"),
+    "mall of the emirates": (25.1181, 55.2006, "Al Barsha"),
+    "atlantis the palm": (25.1304, 55.1171, "Palm Jumeirah"),
+    "dubai marina mall": (25.0762, 55.1400, "Dubai Marina"),
+    "ain dubai": (25.0799, 55.1207, "Bluewaters Island"),
+    "the beach jbr": (25.0780, 55.1337, "Jumeirah Beach Residence"),
+    "ibn battuta mall": (25.0447, 55.1175, "Jebel Ali"),
+    "dubai frame": (25.2356, 55.3003, "Zabeel"),
+    "museum of the future": (25.2192, 55.2820, "Trade Centre"),
+    "difc gate": (25.2110, 55.2810, "DIFC"),
+    "city walk": (25.2070, 55.2620, "Al Wasl"),
+    "la mer": (25.2290, 55.2530, "Jumeirah"),
+    "kite beach": (25.1590, 55.2060, "Umm Suqeim"),
+    "dubai creek harbour": (25.2040, 55.3500, "Dubai Creek Harbour"),
+    "dubai hills mall": (25.1022, 55.2390, "Dubai Hills Estate"),
+    "dubai miracle garden": (25.0604, 55.2441, "Al Barsha South"),
+    "global village": (25.0700, 55.3053, "Dubailand"),
+    "expo city": (24.9631, 55.1496, "Expo City Dubai"),
+    "dubai international airport": (25.2532, 55.3657, "Al Garhoud"),
+    "al maktoum airport": (24.8967, 55.1614, "Dubai South"),
+}
+
+# Other ways people refer to the same places
+ALIASES = {
+    "burj califa": "burj khalifa",
+    "the dubai mall": "dubai mall",
+    "moe": "mall of the emirates",
+    "atlantis": "atlantis the palm",
+    "marina mall": "dubai marina mall",
+    "the beach": "the beach jbr",
+    "dubai eye": "ain dubai",
+    "expo 2020": "expo city",
+    "expo city dubai": "expo city",
+    "dxb": "dubai international airport",
+    "dubai airport": "dubai international airport",
+    "dwc": "al maktoum airport",
+}
+
+_NAMES = sorted(list(GAZETTEER) + list(ALIASES), key=len, reverse=True)
+_LANDMARK_PATTERN = re.compile(r"\b(" + "|".join(re.escape(name) for name in _NAMES) + r")\b")
+_RADIUS_PATTERN = re.compile(r"within\s+(\d+(?:\.\d+)?)\s*(km|kilomet(?:er|re)s?|m|met(?:er|re)s?)\b")
+
+
+def find_landmark(text):
+    """Returns the canonical name of the first landmark mentioned in `text`, or None."""
+    match = _LANDMARK_PATTERN.search(str(text).casefold())
+    if not match:
+        return None
+    name = match.group(1)
+    return ALIASES.get(name, name)
+
+
+def lookup(name):
+    """Returns (latitude, longitude, community) for a landmark name or alias, or None."""
+    name = str(name).casefold().strip()
+    return GAZETTEER.get(ALIASES.get(name, name))
+
+
+def parse_radius_km(text):
+    """Reads "within 3 km" / "within 500 m" from a query. Returns kilometres or None."""
+    match = _RADIUS_PATTERN.search(str(text).casefold())
+    if not match:
+        return None
+    radius = float(match.group(1))
+    if not match.group(2).startswith("k"):
+        radius /= 1000
+    return min(radius, MAX_RADIUS_KM)
@@ -0,0 +1,73 @@
+"""
+Compressed encoding for cached listing payloads.
+
+A segment of listings is stored as one zlib blob of its JSON, compressed
+against a preset dictionary. Listing JSON is dominated by repeated keys,
+image URL prefixes and agency/contact strings, so a dictionary trained on
+real payloads lets even a single small segment compress well.
+
+Dictionaries are identified by an integer ID stored next to each blob:
+ID 0 is the built-in dictionary below, higher IDs are trained ones kept in
+the cache_dictionaries table (see `flask train-cache-dict`).
+"""
+import json
+import re
+import zlib
+from collections import Counter
+
+MAX_DICTIONARY_BYTES = 32 * 1024  # zlib uses at most a 32 KB window
+
+LISTING_FIELDS = [
+    "id", "title", "price", "area", "rooms", "baths", "purpose", "completion_status",
+    "latitude", "longitude", "location_name", "cover_photo_url", "all_image_urls",
+    "agency_name", "contact_name", "mobile_number", "whatsapp_number", "down_payment_percentage",
+]
+
+# Strings seen in almost every listing, most useful last (zlib prefers near matches)
+_SEED_STRINGS = [
+    "https://images.bayut.com/thumbnails/", "-400x300.webp",
+    "https://static.shared.propertyfinder.ae/media/images/listing/", "/668x504.jpg",
+    "Dubai, ", "Apartment", "Villa", "Townhouse", "completed", "off_plan", "for-sale", "for-rent",
+    "Real Estate", "Properties", "+971", "+9715",
+] + [f'"{field}":' for field in LISTING_FIELDS]
+
+DEFAULT_DICTIONARY = "".join(_SEED_STRINGS).encode("utf-8")
+
+# Candidate substrings when training: JSON keys, URL prefixes and whole string values
+_TOKEN_PATTERN = re.compile(r'"[a-z_]+":|"https?://[^"]*/|"[^"]{4,80}"')
+
+
+def encode(listings, dictionary=DEFAULT_DICTIONARY, level=6):
+    """Serializes a list of listing dicts into a compressed blob."""
+    data = json.dumps(listings, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decode(blob, dictionary=DEFAULT_DICTIONARY):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=dictionary)
+    return json.loads(decompressor.decompress(blob) + decompressor.flush())
+
+
+def train_dictionary(samples, max_bytes=MAX_DICTIONARY_BYTES):
+    """
+    Builds a preset dictionary from sample listings: the substrings that
+    would save the most bytes (occurrences x length) across the samples.
+    """
+    counts = Counter()
+    for listing in samples:
+        text = json.dumps(listing, separators=(",", ":"), ensure_ascii=False)
+        counts.update(_TOKEN_PATTERN.findall(text))
+
+    chosen = []
+    size = 0
+    for token, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        encoded = token.encode("utf-8")
+        if size + len(encoded) > max_bytes:
+            continue
+        chosen.append(encoded)
+        size += len(encoded)
+    # Best candidates go last so they sit closest to the data being compressed
+    return b"".join(reversed(chosen)) or DEFAULT_DICTIONARY
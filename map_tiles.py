@@ -0,0 +1,148 @@
+"""
+Tile-based map payloads with delta updates.
+
+A viewport is split into grid tiles with stable IDs:
+
+    c<cell_zoom>:<quadkey>   clusters of the tile's listings at cell_zoom
+    l:<quadkey>              the tile's listings (from LISTING_ZOOM up)
+
+Each tile payload carries an etag derived from its content. Clients send
+the tiles they already hold (`have`, as "id:etag" pairs, or the opaque
+`state` token from the previous response) and only get back tiles that
+are new or changed, plus the IDs of tiles that left the viewport.
+"""
+import base64
+import hashlib
+import json
+import time
+import zlib
+
+import cache_policy
+import database
+import geo_grid
+import memory_cache
+
+# Fields a map marker/popup needs; anything else is fetched on click
+MAP_FIELDS = ('id', 'title', 'price', 'latitude', 'longitude', 'rooms', 'baths', 'area', 'location_name',
+              'cover_photo_url')
+
+# Clusters are grid cells this many levels below the viewport's tile zoom (8x8 per tile)
+CLUSTER_CELL_DEPTH = 3
+# Viewports spanning more tiles are clustered on a coarser tile grid
+MAX_COVERING_TILES = 16
+# From this map zoom up, tiles at this zoom carry listings instead of clusters
+LISTING_ZOOM = 16
+MAX_LISTINGS_PER_TILE = 200
+
+
+def covering_tiles(south, west, north, east, zoom):
+    """Returns (quadkeys, tile_zoom): at most MAX_COVERING_TILES tiles covering the box."""
+    tile_zoom = min(max(int(zoom), 0), geo_grid.MAX_ZOOM)
+    while geo_grid.tile_count(south, west, north, east, tile_zoom) > MAX_COVERING_TILES and tile_zoom > 0:
+        tile_zoom -= 1
+    return geo_grid.tiles_covering(south, west, north, east, tile_zoom), tile_zoom
+
+
+def get_map_clusters(south, west, north, east, zoom):
+    """
+    Returns (tiles, cell_zoom, clusters) for a viewport at a map zoom level.
+    The number of clusters is bounded by the tile count and CLUSTER_CELL_DEPTH,
+    however many listings the viewport holds.
+    """
+    tiles, tile_zoom = covering_tiles(south, west, north, east, zoom)
+    cell_zoom = min(tile_zoom + CLUSTER_CELL_DEPTH, geo_grid.MAX_ZOOM)
+    clusters = [cluster for tile in tiles for cluster in tile_payload(f"c{cell_zoom}:{tile}")['clusters']]
+    return tiles, cell_zoom, clusters
+
+
+def viewport_tile_ids(south, west, north, east, zoom):
+    """
+    Tile IDs of a viewport: listing tiles from LISTING_ZOOM up, unless that
+    takes more than MAX_COVERING_TILES, in which case the viewport is clustered.
+    """
+    if zoom >= LISTING_ZOOM:
+        if geo_grid.tile_count(south, west, north, east, LISTING_ZOOM) <= MAX_COVERING_TILES:
+            return [f"l:{tile}" for tile in geo_grid.tiles_covering(south, west, north, east, LISTING_ZOOM)]
+        zoom = LISTING_ZOOM
+    tiles, tile_zoom = covering_tiles(south, west, north, east, zoom)
+    cell_zoom = min(tile_zoom + CLUSTER_CELL_DEPTH, geo_grid.MAX_ZOOM)
+    return [f"c{cell_zoom}:{tile}" for tile in tiles]
+
+
+def parse_tile_id(tile_id):
+    """Returns (kind, cell_zoom, quadkey) for a tile ID, or raises ValueError."""
+    kind, _, tile = tile_id.partition(":")
+    if not tile or tile.strip("0123") or len(tile) > geo_grid.MAX_ZOOM:
+        raise ValueError(f"Invalid tile ID: {tile_id}")
+    if kind == "l":
+        return "listings", None, tile
+    if kind.startswith("c") and kind[1:].isdigit():
+        cell_zoom = int(kind[1:])
+        if len(tile) <= cell_zoom <= geo_grid.MAX_ZOOM:
+            return "clusters", cell_zoom, tile
+    raise ValueError(f"Invalid tile ID: {tile_id}")
+
+
+def tile_payload(tile_id):
+    """Builds (or reads from the L1 tile cache) the payload of one tile."""
+    payload = memory_cache.map_tile_cache.get(tile_id)
+    if payload is not None:
+        return payload
+
+    kind, cell_zoom, tile = parse_tile_id(tile_id)
+    payload = {'id': tile_id, 'bounds': geo_grid.tile_bounds(tile)}
+    if kind == "clusters":
+        payload['clusters'] = database.get_tile_clusters(tile, cell_zoom)
+    else:
+        listings, total = database.get_tile_listings(tile, MAX_LISTINGS_PER_TILE)
+        payload['listings'] = [{field: listing.get(field) for field in MAP_FIELDS} for listing in listings]
+        payload['truncated'] = total > len(listings)
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    payload['etag'] = hashlib.sha1(encoded).hexdigest()[:16]
+
+    memory_cache.map_tile_cache.put(tile_id, payload, time.time() + cache_policy.get("map_tile").ttl_seconds)
+    return payload
+
+
+def encode_state(etags):
+    """Packs {tile_id: etag} into an opaque, URL-safe viewport-state token."""
+    data = json.dumps(etags, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(zlib.compress(data)).decode("ascii")
+
+
+def decode_state(token):
+    try:
+        etags = json.loads(zlib.decompress(base64.urlsafe_b64decode(token.encode("ascii"))))
+    except (ValueError, zlib.error):
+        return {}
+    return etags if isinstance(etags, dict) else {}
+
+
+def parse_have(have):
+    """Parses "id:etag,id:etag" (tile IDs contain one colon themselves) into {tile_id: etag}."""
+    etags = {}
+    for item in filter(None, (have or "").split(",")):
+        tile_id, _, etag = item.strip().rpartition(":")
+        if tile_id:
+            etags[tile_id] = etag
+    return etags
+
+
+def viewport_delta(south, west, north, east, zoom, held):
+    """
+    Diffs the viewport's tiles against `held` ({tile_id: etag} the client has).
+    Returns the new or changed tile payloads, the tile IDs still valid, the
+    held tile IDs no longer in view, and the state token for the next request.
+    """
+    tiles = []
+    unchanged = []
+    etags = {}
+    for tile_id in viewport_tile_ids(south, west, north, east, zoom):
+        payload = tile_payload(tile_id)
+        etags[tile_id] = payload['etag']
+        if held.get(tile_id) == payload['etag']:
+            unchanged.append(tile_id)
+        else:
+            tiles.append(payload)
+    removed = [tile_id for tile_id in held if tile_id not in etags]
+    return {'tiles': tiles, 'unchanged': unchanged, 'removed': removed, 'state': encode_state(etags)}
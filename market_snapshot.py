@@ -0,0 +1,254 @@
+"""
+Columnar, memory-mapped snapshot of the listing warehouse for market analytics.
+
+build() writes one NumPy array per column (price, area, rooms, baths,
+latitude, longitude, listed_at, and dictionary-encoded source, purpose,
+property type and location) into a new build directory, then points
+CURRENT at it. Every worker maps the current build read-only, so the arrays
+are shared through the page cache however many workers read them, and a
+rebuild never disturbs readers of the previous build.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import click
+import numpy as np
+from flask import current_app, has_app_context
+
+import canonical_filters
+import warehouse
+
+SNAPSHOT_DIR = 'market_snapshot'
+# Previous builds kept on disk: workers may still map them until their next check
+KEEP_BUILDS = 1
+# How often a worker looks for a newer build
+RELOAD_CHECK_SECONDS = 30
+BUILD_BATCH_ROWS = 5000
+
+# Numeric columns; missing values are NaN in float columns and -1 in integer ones
+NUMERIC_COLUMNS = {
+    'price': np.float64, 'area': np.float64, 'rooms': np.int16, 'baths': np.int16,
+    'latitude': np.float64, 'longitude': np.float64, 'listed_at': np.float64,
+}
+# Dictionary-encoded columns: int32 codes into the column's list of values
+CATEGORY_COLUMNS = ('source', 'purpose', 'property_type', 'location')
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+
+def _directory():
+    if has_app_context():
+        return current_app.config.get('MARKET_SNAPSHOT_DIR', SNAPSHOT_DIR)
+    return SNAPSHOT_DIR
+
+
+def _canonical(column, value):
+    """The canonical form of a purpose or property type, as search filters spell it."""
+    if value is None or value == '':
+        return None
+    return canonical_filters.canonicalize({column: value}, resolve_locations=False).get(column)
+
+
+def _category_value(column, row):
+    if column == 'location':
+        return row['location_path'] or row['location_name']
+    return row[column]
+
+
+def build(directory=None):
+    """
+    Writes a snapshot of every listed warehouse listing and publishes it as
+    the current build. Returns the number of listings, or 0 (publishing
+    nothing) when the warehouse is empty.
+    """
+    directory = directory or _directory()
+    numeric = {column: [] for column in NUMERIC_COLUMNS}
+    codes = {column: [] for column in CATEGORY_COLUMNS}
+    raw_dictionaries = {column: {} for column in CATEGORY_COLUMNS}
+    for rows in warehouse.iter_listings(batch_size=BUILD_BATCH_ROWS, listed_only=True):
+        for row in rows:
+            for column, dtype in NUMERIC_COLUMNS.items():
+                value = row[column]
+                if dtype is np.int16:
+                    value = -1 if value is None else int(value)
+                numeric[column].append(value)
+            for column in CATEGORY_COLUMNS:
+                values = raw_dictionaries[column]
+                codes[column].append(values.setdefault(_category_value(column, row), len(values)))
+    row_count = len(numeric['price'])
+    if not row_count:
+        print("The listing warehouse is empty; no market snapshot built.")
+        return 0
+
+    # Raw values are normalized once per distinct value, not once per listing
+    dictionaries = {}
+    for column, raw_values in raw_dictionaries.items():
+        normalized = {}
+        remap = np.empty(len(raw_values), dtype=np.int32)
+        for raw_value, code in raw_values.items():
+            value = _canonical(column, raw_value) if column in ('purpose', 'property_type') else raw_value
+            remap[code] = normalized.setdefault(value, len(normalized))
+        codes[column] = remap[np.asarray(codes[column], dtype=np.int32)]
+        dictionaries[column] = list(normalized)
+
+    name = f"build-{time.time_ns()}"
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    for column, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(path, f"{column}.npy"), np.asarray(numeric[column], dtype=dtype))
+    for column in CATEGORY_COLUMNS:
+        np.save(os.path.join(path, f"{column}.npy"), codes[column])
+    with open(os.path.join(path, 'dictionaries.json'), 'w', encoding='utf-8') as f:
+        json.dump(dictionaries, f)
+    with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'built_at': time.time(), 'rows': row_count,
+                   'columns': list(NUMERIC_COLUMNS) + list(CATEGORY_COLUMNS)}, f)
+
+    # Readers switch builds by reading CURRENT, which is replaced atomically
+    pointer = os.path.join(directory, 'CURRENT')
+    with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+    _remove_old_builds(directory, name)
+
+    global _checked_at
+    _checked_at = 0.0
+    print(f"Built market snapshot {name} of {row_count} listings.")
+    return row_count
+
+
+def _remove_old_builds(directory, current_name):
+    builds = sorted(entry for entry in os.listdir(directory) if entry.startswith('build-') and entry != current_name)
+    for entry in builds[:max(len(builds) - KEEP_BUILDS, 0)]:
+        # Workers still mapping a removed build keep reading it until they remap
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+class Snapshot:
+    """One published build: read-only memory-mapped columns and their dictionaries."""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, 'dictionaries.json'), encoding='utf-8') as f:
+            self.dictionaries = json.load(f)
+        self.columns = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+                        for column in self.manifest['columns']}
+        self.rows = self.manifest['rows']
+        # Each location path as its set of normalized names, so a community also selects its towers
+        self.location_names = [frozenset(canonical_filters.normalize_location(part) for part in value.split(','))
+                               if value else frozenset() for value in self.dictionaries['location']]
+
+    def _codes(self, column, keep):
+        return np.array([code for code, value in enumerate(self.dictionaries[column]) if value is not None
+                         and keep(value)], dtype=np.int32)
+
+    def mask(self, canonical, source=None):
+        """Boolean mask of the listings matching the location, purpose, type and bedroom filters (and source)."""
+        selected = np.ones(self.rows, dtype=bool)
+        if source:
+            selected &= np.isin(self.columns['source'], self._codes('source', lambda value: value == source))
+        location = canonical.get('query')
+        if location:
+            codes = [code for code, names in enumerate(self.location_names) if location in names]
+            selected &= np.isin(self.columns['location'], np.array(codes, dtype=np.int32))
+        for column in ('purpose', 'property_type'):
+            wanted = canonical.get(column)
+            if wanted:
+                wanted = wanted if isinstance(wanted, list) else [wanted]
+                selected &= np.isin(self.columns[column], self._codes(column, lambda value: value in wanted))
+        if canonical.get('beds') is not None:
+            beds = canonical['beds'] if isinstance(canonical['beds'], list) else [canonical['beds']]
+            selected &= np.isin(self.columns['rooms'], beds)
+        return selected
+
+    def price_summary(self, canonical, source=None):
+        """
+        Price and size statistics of the matching listings, or None if none
+        has a price. Portals list many of the same properties, so only one
+        source is counted: `source`, or the one with the most matches.
+        """
+        if source is None:
+            matches = {name: int(self.mask(canonical, name).sum()) for name in self.dictionaries['source'] if name}
+            source = max(matches, key=matches.get, default=None)
+        selected = self.mask(canonical, source)
+        summary = _price_statistics(self.columns['price'][selected], self.columns['area'][selected])
+        if summary is not None:
+            summary.update(source=source, built_at=self.manifest['built_at'])
+        return summary
+
+
+def _price_statistics(prices, areas):
+    """Statistics of parallel price and area arrays (NaN where missing), or None if nothing has a price."""
+    priced = prices > 0  # NaN compares False
+    if not priced.any():
+        return None
+    sized = priced & (areas > 0)
+    return {
+        'count': int(prices.size),
+        'average_price': float(prices[priced].mean()),
+        'median_price': float(np.median(prices[priced])),
+        'min_price': float(prices[priced].min()),
+        'max_price': float(prices[priced].max()),
+        'average_area': float(areas[sized].mean()) if sized.any() else None,
+        'price_per_sqft': float(prices[sized].sum() / areas[sized].sum()) if sized.any() else None,
+    }
+
+
+def listing_summary(listings):
+    """The price_summary() statistics of listing dicts at hand (a page of search results), or None."""
+    prices = np.array([listing.get('price') for listing in listings], dtype=np.float64)
+    areas = np.array([listing.get('area') for listing in listings], dtype=np.float64)
+    return _price_statistics(prices, areas)
+
+
+def current():
+    """This process's mapping of the current build (remapped once a newer one is published), or None."""
+    global _snapshot, _checked_at
+    if time.monotonic() - _checked_at < RELOAD_CHECK_SECONDS:
+        return _snapshot
+    with _lock:
+        _checked_at = time.monotonic()
+        directory = _directory()
+        try:
+            with open(os.path.join(directory, 'CURRENT'), encoding='utf-8') as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            _snapshot = None
+            return None
+        if _snapshot is None or _snapshot.name != name:
+            try:
+                _snapshot = Snapshot(os.path.join(directory, name))
+            except (OSError, ValueError) as e:
+                print(f"Error opening market snapshot {name}: {e}")
+    return _snapshot
+
+
+def market_summary(filters, source=None, defaults=None):
+    """
+    price_summary() over the whole market for search filters (location,
+    purpose, property type, bedrooms); None without a snapshot or matches.
+    A filter left out matches every value unless `defaults` fills it in, as
+    canonicalize() does for the upstream the compared results came from.
+    """
+    snapshot = current()
+    if snapshot is None:
+        return None
+    canonical = canonical_filters.canonicalize(filters, resolve_locations=False, defaults=defaults or {})
+    return snapshot.price_summary(canonical, source)
+
+
+@click.command('build-market-snapshot')
+def build_market_snapshot_command():
+    """Rebuild the memory-mapped market snapshot from the listing warehouse."""
+    click.echo(f"Market snapshot holds {build()} listings.")
+
+
+def init_app(app):
+    app.cli.add_command(build_market_snapshot_command)
@@ -0,0 +1,168 @@
+"""
+In-process L1 cache for decoded search results.
+
+Entries are kept in LRU order under a hard memory budget measured with an
+estimate of each value's object size. New entries are admitted over the LRU
+victim only when a TinyLFU frequency sketch says they are requested at least
+as often, so one-off queries cannot flush the hot set.
+"""
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import cache_policy
+
+
+def estimate_size(obj, _seen=None):
+    """Approximate deep size in bytes of JSON-like data (dicts, lists, scalars)."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    for slot in getattr(type(obj), '__slots__', ()):
+        size += estimate_size(getattr(obj, slot, None), _seen)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    return size
+
+
+class FrequencySketch:
+    """
+    Count-min sketch of recent key frequencies. Counters saturate at 15 and
+    are halved every `sample_size` increments so popularity ages out.
+    """
+
+    def __init__(self, width=4096, depth=4, sample_size=40960):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size
+        self.table = [[0] * width for _ in range(depth)]
+        self.additions = 0
+
+    def _indexes(self, key):
+        encoded = repr(key).encode('utf-8')
+        for row in range(self.depth):
+            yield row, zlib.crc32(encoded, row * 0x9E3779B1) % self.width
+
+    def increment(self, key):
+        for row, index in self._indexes(key):
+            if self.table[row][index] < 15:
+                self.table[row][index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table = [[count >> 1 for count in row] for row in self.table]
+            self.additions //= 2
+
+    def frequency(self, key):
+        return min(self.table[row][index] for row, index in self._indexes(key))
+
+
+class ResultCache:
+    """
+    Thread-safe LRU map of key -> value with per-entry expiry and a byte budget.
+    Values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, eviction="tinylfu"):
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.current_bytes = 0
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.sketch = FrequencySketch()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_policy(cls, name):
+        policy = cache_policy.get(name)
+        return cls(max_bytes=policy.max_bytes, eviction=policy.eviction)
+
+    def apply_policy(self, name):
+        """Re-reads the size budget and eviction policy from the registry, trimming if needed."""
+        policy = cache_policy.get(name)
+        with self.lock:
+            self.max_bytes = policy.max_bytes
+            self.eviction = policy.eviction
+            while self.entries and self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def get(self, key):
+        with self.lock:
+            self.sketch.increment(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, expires_at):
+        """Stores `value` until the UNIX timestamp `expires_at`. Returns True if admitted."""
+        size = estimate_size(value)
+        with self.lock:
+            if size > self.max_bytes or expires_at <= time.time():
+                return False
+            if key in self.entries:
+                self._remove(key)
+
+            # TinyLFU admission: only evict colder entries to make room (plain LRU evicts any)
+            candidate_frequency = self.sketch.frequency(key) if self.eviction == "tinylfu" else None
+            victims = []
+            freed = 0
+            for victim_key, (_, victim_size, _) in self.entries.items():
+                if self.current_bytes - freed + size <= self.max_bytes:
+                    break
+                if candidate_frequency is not None and self.sketch.frequency(victim_key) > candidate_frequency:
+                    return False
+                victims.append(victim_key)
+                freed += victim_size
+            for victim_key in victims:
+                self._remove(victim_key)
+
+            self.entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            return True
+
+    def invalidate(self, predicate):
+        """Drops every entry whose key satisfies `predicate`."""
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.current_bytes -= size
+
+
+# Shared L1 for search results, keyed by (canonical query key, page, limit)
+result_cache = ResultCache.for_policy("search_results")
+# Normalized location name -> location ID, in front of the cache backend
+location_id_cache = ResultCache.for_policy("location_id")
+# Tile ID -> map tile payload (see map_tiles)
+map_tile_cache = ResultCache.for_policy("map_tile")
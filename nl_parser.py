@@ -1,6 +1,8 @@
 # nl_parser.py
 import re
 
+import gazetteer
+
 def normalize_price(value_str):
     value_str = value_str.lower().strip().replace(",", "")
     match = re.match(r"(\d+(?:\.\d+)?)(\s*(m|million|k))?", value_str)
@@ -79,12 +81,16 @@ def parse_natural_query(query):
             filters["property_type"] = t
             break
 
-    # Location (naively extract last word if it matches UAE cities)
-    locations = ["dubai", "abu dhabi", "sharjah", "ajman", "ras al khaimah", "fujairah", "umm al quwain"]
-    for loc in locations:
-        if loc in query:
-            filters["location"] = loc.title()
-            break
+    # Location: the first place the gazetteer knows, else one of the UAE cities
+    known = gazetteer.find_locations(query)
+    if known:
+        filters["location"] = known[0][1]["name"]
+    else:
+        locations = ["dubai", "abu dhabi", "sharjah", "ajman", "ras al khaimah", "fujairah", "umm al quwain"]
+        for loc in locations:
+            if loc in query:
+                filters["location"] = loc.title()
+                break
 
     return filters
 
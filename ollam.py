@@ -1,8 +1,13 @@
 # nl_parser.py
+import hashlib
 import re
 import requests
 import json
 
+import database
+import gazetteer
+import landmarks
+
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 
 
@@ -13,6 +18,11 @@ def _split_location_and_keywords(location_str):
     """
     location_str = location_str.strip()
 
+    # The most specific location the gazetteer knows is the query; other words are keywords
+    known = gazetteer.split_location(location_str)
+    if known:
+        return known
+
     # Common separators for nested locations
     split_words = [" in ", ", "]
 
@@ -366,6 +376,14 @@ def parse_natural_query(query):
         r"dubai\s+mall": ("Downtown Dubai", "Dubai Mall")
     }
     
+    # Landmarks in the gazetteer can be answered as a radius search
+    near = landmarks.find_landmark(query)
+    if near:
+        filters["near"] = near
+        radius_km = landmarks.parse_radius_km(query)
+        if radius_km:
+            filters["radius_km"] = radius_km
+
     # Look for landmarks in the query
     for landmark_pattern, (area, keyword) in landmark_map.items():
         if re.search(landmark_pattern, query, re.IGNORECASE):
@@ -556,6 +574,13 @@ def llama_fallback(query):
         "stream": False
     }
 
+    # Parses are shared through the cache backend, keyed by model and normalized query
+    normalized_query = re.sub(r"\s+", " ", query.strip().lower())
+    cache_key = hashlib.sha1(f"{payload['model']}:{normalized_query}".encode('utf-8')).hexdigest()
+    cached = database.cache_get('llm_parse', cache_key)
+    if cached is not None:
+        return cached
+
     try:
         response = requests.post(OLLAMA_API_URL, json=payload, timeout=60)
         response.raise_for_status()
@@ -564,7 +589,9 @@ def llama_fallback(query):
         # Extract JSON only
         json_match = re.search(r"\{.*\}", output, re.DOTALL)
         if json_match:
-            return json.loads(json_match.group(0))
+            parsed = json.loads(json_match.group(0))
+            database.cache_set('llm_parse', cache_key, parsed)
+            return parsed
         else:
             print("❌ Failed to extract JSON from LLaMA output.")
             return {"is_question": False, "filters": {}}
@@ -37,6 +37,7 @@ PROPERTY_TYPE_MAP = {
 FILTERS_MAP = {
     "amenities": "filter[amenities]",
     "bathrooms": "filter[number_of_bathrooms]",
+    "baths": "filter[number_of_bathrooms]",
     "beds": "filter[number_of_bedrooms]",
     "furnished": "filter[furnished]",
     "virtual_viewings": "filter[virtual_viewings]",
@@ -58,6 +59,16 @@ FILTERS_MAP = {
     "sort": "sort"
 }
 
+# Listings per page served by the Property Finder search endpoint
+PF_PAGE_SIZE = 25
+
+
+def property_type_ids(value):
+    """The `t` search parameter for one property type or a list of them (comma-separated IDs), or None."""
+    property_types = value if isinstance(value, list) else [value]
+    ids = [PROPERTY_TYPE_MAP.get(str(property_type).lower()) for property_type in property_types]
+    return ','.join(pt_id for pt_id in ids if pt_id) or None
+
 
 # ----------------------------------
 # Helper Function for Data Mapping
@@ -115,6 +126,22 @@ def _map_pf_data_to_db_schema(pf_listing):
     }
 
 
+def map_pf_listing_details(pf_listing):
+    """
+    Like _map_pf_data_to_db_schema, plus the fields the listing warehouse keeps:
+    property type, description, the full location path and the listing date.
+    """
+    listing = _map_pf_data_to_db_schema(pf_listing)
+    if listing is None:
+        return None
+    property_data = pf_listing.get("property", {})
+    listing["property_type"] = property_data.get("property_type")
+    listing["description"] = property_data.get("description")
+    listing["location_path"] = property_data.get("location", {}).get("full_name")
+    listing["listed_at"] = property_data.get("listed_date")
+    return listing
+
+
 # ----------------------------------
 # Initialise the API Token Key (return the build_id)
 # ----------------------------------
@@ -130,7 +157,7 @@ def initialise(filters: dict):
     if "purpose" in filters:
         url_params["c"] = "1" if filters["purpose"] == "sale" else "2"
     if "property_type" in filters:
-        pt_id = PROPERTY_TYPE_MAP.get(filters["property_type"].lower())
+        pt_id = property_type_ids(filters["property_type"])
         if pt_id:
             url_params["t"] = pt_id
     if "location_id" in filters:
@@ -164,23 +191,39 @@ def search_location(query: str, limit: int = 20):
     return res.json()
 
 
+def list_locations(page: int, limit: int = 100):
+    """
+    One page of the full location list (every emirate, community,
+    sub-community and tower), as the locations API's attribute dicts.
+    """
+    url = "https://www.propertyfinder.ae/api/pwa/locations"
+    params = {"locale": "en", "pagination.page": page, "pagination.limit": limit}
+    res = requests.get(url, params=params, headers={"User-Agent": "Mozilla/5.0"}, timeout=30)
+    res.raise_for_status()
+    return res.json().get("data", {}).get("attributes", [])
+
+
 # ----------------------------------
 # Fetch Listings
 # ----------------------------------
-def fetch_propertyfinder_listings(filters: dict, build_id: str):
+def fetch_propertyfinder_page(filters: dict, build_id: str, mapper=_map_pf_data_to_db_schema,
+                              raise_errors: bool = False):
     """
-    Fetch listings from Property Finder and map them to the database schema.
+    Fetch one page of listings from Property Finder, mapped to the database schema
+    (by `mapper`; None returns the raw listings), together with the search totals
+    reported by the API. Returns (listings, total_count, page_count).
+    Request errors are logged and give an empty page unless raise_errors is set.
     """
     if not build_id:
         print("❌ Build ID is missing. Cannot fetch listings.")
-        return []
+        return [], 0, 0
 
     url = f"https://www.propertyfinder.ae/search/_next/data/{build_id}/en/search.json"
     api_params = {"ob": "mr", "fu": "0", "c": "1"}
 
     for key, value in filters.items():
         if key == "property_type":
-            pt_id = PROPERTY_TYPE_MAP.get(value.lower())
+            pt_id = property_type_ids(value)
             if pt_id:
                 api_params["t"] = pt_id
         elif key == "purpose":
@@ -198,62 +241,80 @@ def fetch_propertyfinder_listings(filters: dict, build_id: str):
                     api_params[api_key] = value
 
     try:
-        res = requests.get(url, params=api_params, headers=NEXT_HEADERS)
+        res = requests.get(url, params=api_params, headers=NEXT_HEADERS, timeout=30)
         res.raise_for_status()
         data = res.json()
     except requests.exceptions.RequestException as e:
+        if raise_errors:
+            raise
         print(f"Error fetching data from Property Finder API: {e}")
-        return []
+        return [], 0, 0
 
-    listings = data.get("pageProps", {}).get("searchResult", {}).get("listings", [])
+    search_result = data.get("pageProps", {}).get("searchResult", {})
+    listings = search_result.get("listings", [])
+    meta = search_result.get("meta", {})
 
     mapped_results = []
     for r in listings:
         if r['listing_type'] == 'property':
-            mapped_item = _map_pf_data_to_db_schema(r)
+            mapped_item = mapper(r) if mapper else r
             if mapped_item:
                 mapped_results.append(mapped_item)
 
-    return mapped_results
+    total_count = meta.get("total_count", len(mapped_results))
+    page_count = meta.get("page_count", 1 if mapped_results else 0)
+    return mapped_results, total_count, page_count
+
+
+def fetch_propertyfinder_listings(filters: dict, build_id: str):
+    """
+    Fetch listings from Property Finder and map them to the database schema.
+    """
+    listings, _, _ = fetch_propertyfinder_page(filters, build_id)
+    return listings
 
 
 # ----------------------------------
 # Main Search Function
 # ----------------------------------
-def property_finder_search(search_filters: dict):
+def property_finder_search_with_totals(search_filters: dict, build_id: str = None):
     """
-    Main function to execute the full search workflow with keywords.
+    Runs the full search workflow for one page and returns
+    (listings, total_count, page_count). A known build_id skips the lookup.
     """
-    # Use the main location query for the initial location search
-    print(f"print filters ff {search_filters}")
-    query = search_filters['filters'].get("location_query", "dubai")
-    print(f"querry of location {query}")
-    print(f"query ff {query}")
-    locations = search_location(query)
-    # print(f"locations {locations}")
-    attributes = locations.get("data", {}).get("attributes", [])
-    first_location = attributes[0] if attributes else None
-    
-    if not first_location:
-        print(f"Could not find location for query: {query}.")
-        return []
-
-    search_filters["location_id"] = first_location["id"]
-    print(f"Found city ID: {search_filters['location_id']}")
-
-    # Add the keywords filter if it exists in the parsed filters
-    keywords = search_filters.get("keywords")
-    if keywords:
-        search_filters["keywords"] = keywords  # 'keywords' is the key in our `FILTERS_MAP`
-
-    build_id = initialise(search_filters)
+    # The API expects a flat filter dict, so merge the parsed filters with the resolved location
+    api_filters = dict(search_filters['filters'])
+    if "location_id" not in api_filters:
+        # Use the main location query for the initial location search
+        query = api_filters.get("location_query", "dubai")
+        print(f"query ff {query}")
+        locations = search_location(query)
+        attributes = locations.get("data", {}).get("attributes", [])
+        first_location = attributes[0] if attributes else None
+
+        if not first_location:
+            print(f"Could not find location for query: {query}.")
+            return [], 0, 0
+
+        api_filters["location_id"] = first_location["id"]
+        print(f"Found city ID: {api_filters['location_id']}")
+
+    build_id = build_id or initialise(api_filters)
     if not build_id:
         print("Could not get build ID. The website structure may have changed.")
-        return []
+        return [], 0, 0
 
-    page = search_filters.get("page", 1)
+    page = api_filters.get("page", 1)
     print(f"Fetching listings for page {page}...")
-    listings = fetch_propertyfinder_listings(search_filters, build_id)
-    print(f"Found {len(listings)} properties on page {page}")
+    listings, total_count, page_count = fetch_propertyfinder_page(api_filters, build_id)
+    print(f"Found {len(listings)} properties on page {page} ({total_count} in total)")
+
+    return listings, total_count, page_count
 
-    return listings
\ No newline at end of file
+
+def property_finder_search(search_filters: dict):
+    """
+    Main function to execute the full search workflow with keywords.
+    """
+    listings, _, _ = property_finder_search_with_totals(search_filters)
+    return listings
@@ -0,0 +1,137 @@
+"""
+Cost-based choice of where a search is answered from.
+
+A search can be answered from any of these sources:
+
+    cache      the query's own cached segments
+    contained  a complete cached result set that subsumes the query
+    warehouse  the listing warehouse, inside the scope of a complete crawl
+    upstream   the live portal
+
+How old the data may be depends on the intent behind the search: counts and
+averages tolerate a day, browsing an hour, and "new listings today" only a
+few minutes. The planner tries the local sources cheapest first, by their
+observed latency, and uses the first whose data is fresh enough; the portal
+is the last resort. Every decision is printed and logged to query_plans, in
+batches of LOG_BATCH_SIZE.
+"""
+import re
+import threading
+import time
+
+import cache_policy
+import database
+
+RECENT = 'recent'
+LISTINGS = 'listings'
+ANALYTICS = 'analytics'
+# Oldest data each intent accepts
+MAX_AGE_SECONDS = {
+    RECENT: 15 * cache_policy.MINUTE,
+    LISTINGS: 1 * cache_policy.HOUR,
+    ANALYTICS: 1 * cache_policy.DAY,
+}
+
+LOCAL_SOURCES = ('cache', 'contained', 'warehouse')
+# Expected latency until a source has been observed; then a moving average
+DEFAULT_LATENCY_MS = {'cache': 5.0, 'contained': 25.0, 'warehouse': 40.0, 'upstream': 1500.0}
+_LATENCY_WEIGHT = 0.2
+# Decisions buffered per process before they are written to query_plans
+LOG_BATCH_SIZE = 50
+
+# Questions about what is new right now
+_RECENCY_PATTERN = re.compile(
+    r"\b(today|tonight|this morning|just listed|newly listed|new listings?|latest|last hour|right now)\b")
+
+_latency_ms = dict(DEFAULT_LATENCY_MS)
+_lock = threading.Lock()
+_pending_log = []
+
+
+def classify_intent(query, analytical=False):
+    """The intent of a natural-language query: RECENT, ANALYTICS or LISTINGS."""
+    if query and _RECENCY_PATTERN.search(query.lower()):
+        return RECENT
+    return ANALYTICS if analytical else LISTINGS
+
+
+def max_age(intent):
+    return MAX_AGE_SECONDS.get(intent, MAX_AGE_SECONDS[LISTINGS])
+
+
+def expected_latency_ms(source):
+    with _lock:
+        return _latency_ms[source]
+
+
+def local_sources_by_cost():
+    """The local sources, cheapest (lowest expected latency) first."""
+    with _lock:
+        return sorted(LOCAL_SOURCES, key=_latency_ms.get)
+
+
+def _observe(source, elapsed_ms):
+    with _lock:
+        _latency_ms[source] += _LATENCY_WEIGHT * (elapsed_ms - _latency_ms[source])
+
+
+class Decision:
+    """
+    The sources considered for one search and the one that answered it.
+    Call begin(source) before trying each source, so only the time spent on
+    the chosen source feeds its latency estimate.
+    """
+
+    def __init__(self, namespace, query_string, intent):
+        self.namespace = namespace
+        self.query_string = query_string
+        self.intent = intent if intent in MAX_AGE_SECONDS else LISTINGS
+        self.max_age = MAX_AGE_SECONDS[self.intent]
+        self.candidates = []
+        self.chosen = None
+        self.age = None
+        self._attempt = None
+        self._started = self._attempt_started = time.perf_counter()
+
+    def begin(self, source):
+        self._attempt = source
+        self._attempt_started = time.perf_counter()
+
+    def _add(self, source, outcome, age):
+        self.candidates.append({'source': source, 'outcome': outcome,
+                                'expected_ms': round(expected_latency_ms(source), 1),
+                                'age_seconds': round(age) if age is not None else None})
+
+    def skip(self, source, reason, age=None):
+        self._add(source, reason, age)
+
+    def choose(self, source, age=None):
+        self._add(source, 'chosen', age)
+        self.chosen = source
+        self.age = age
+
+    def record(self):
+        """Logs the decision and feeds the chosen source's own latency into its estimate."""
+        now = time.perf_counter()
+        elapsed_ms = (now - self._started) * 1000
+        # Without a begin() for the chosen source, the whole plan is its best estimate
+        source_ms = (now - (self._attempt_started if self._attempt == self.chosen else self._started)) * 1000
+        _observe(self.chosen, source_ms)
+        age = f"{self.age:.0f}s old" if self.age is not None else "age unknown"
+        print(f"Query plan: {self.chosen} ({age}, {source_ms:.1f} ms of {elapsed_ms:.1f} ms) for {self.intent} "
+              f"search (max age {self.max_age}s): {self.query_string}")
+        with _lock:
+            _pending_log.append((time.time(), self.namespace, self.query_string, self.intent, self.max_age,
+                                 self.chosen, self.age, self.candidates, elapsed_ms))
+            full = len(_pending_log) >= LOG_BATCH_SIZE
+        if full:
+            flush_log()
+
+
+def flush_log():
+    """Writes the buffered decisions to query_plans (needs an app context)."""
+    with _lock:
+        plans = _pending_log[:]
+        del _pending_log[:]
+    if plans:
+        database.record_query_plans(plans)
@@ -1,16 +1,18 @@
-DROP TABLE IF EXISTS cached_properties;
-DROP TABLE IF EXISTS search_queries;
-
-CREATE TABLE search_queries (
+CREATE TABLE IF NOT EXISTS search_queries (
     query_id INTEGER PRIMARY KEY AUTOINCREMENT,
     query_string TEXT UNIQUE NOT NULL,
+    filters_json TEXT,
+    total_hits INTEGER,
+    total_pages INTEGER,
+    segment_size INTEGER,
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     expires_at TIMESTAMP NOT NULL
 );
 
-CREATE TABLE cached_properties (
+CREATE TABLE IF NOT EXISTS cached_properties (
     id TEXT NOT NULL,
     query_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
     title TEXT NOT NULL,
     price REAL,
     area REAL,
@@ -22,7 +24,8 @@ CREATE TABLE cached_properties (
     longitude REAL,
     location_name TEXT,
     cover_photo_url TEXT,
-    all_image_urls TEXT,
+    image_template_id INTEGER,
+    image_ids TEXT,
     agency_name TEXT,
     contact_name TEXT,
     mobile_number TEXT,
@@ -30,4 +33,245 @@ CREATE TABLE cached_properties (
     down_payment_percentage REAL,
     PRIMARY KEY (id, query_id),
     FOREIGN KEY (query_id) REFERENCES search_queries (query_id)
-);
\ No newline at end of file
+);
+
+-- Image URLs are stored as a JSON array of the part that varies (the image ID)
+-- plus the prefix/suffix they share, interned here. image_template_id is NULL
+-- when a listing's URLs have no usable common shape; image_ids then holds full URLs.
+CREATE TABLE IF NOT EXISTS cached_image_templates (
+    template_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prefix TEXT NOT NULL,
+    suffix TEXT NOT NULL,
+    UNIQUE (prefix, suffix)
+);
+
+-- One row per upstream page fetched for a query. A page request is served
+-- from cached_properties only when every segment it overlaps is present.
+CREATE TABLE IF NOT EXISTS cached_segments (
+    query_id INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (query_id, segment),
+    FOREIGN KEY (query_id) REFERENCES search_queries (query_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_cached_properties_position ON cached_properties (query_id, position);
+CREATE INDEX IF NOT EXISTS idx_cached_properties_id ON cached_properties (id);
+
+-- Blob storage format (CACHE_STORAGE=blob): each segment's listings as one
+-- compressed JSON blob, plus a thin index of the columns predicates filter on.
+CREATE TABLE IF NOT EXISTS cached_blobs (
+    query_id INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    start_position INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    dictionary_id INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (query_id, segment),
+    FOREIGN KEY (query_id) REFERENCES search_queries (query_id)
+);
+
+CREATE TABLE IF NOT EXISTS cached_listing_index (
+    id TEXT NOT NULL,
+    query_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    price REAL,
+    area REAL,
+    rooms INTEGER,
+    baths INTEGER,
+    PRIMARY KEY (id, query_id),
+    FOREIGN KEY (query_id) REFERENCES search_queries (query_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_cached_listing_index_position ON cached_listing_index (query_id, position);
+CREATE INDEX IF NOT EXISTS idx_cached_blobs_position ON cached_blobs (query_id, start_position);
+
+-- Full-text index over cached listings (either storage format), filled as
+-- segments are saved. listing_id/query_id/position point back at the listing.
+CREATE VIRTUAL TABLE IF NOT EXISTS listing_search USING fts5(
+    title, location_name, agency_name, description,
+    listing_id UNINDEXED, query_id UNINDEXED, position UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+-- Spatial index over cached listing coordinates (points stored as degenerate
+-- boxes), filled as segments are saved. Backs bounding-box map queries.
+CREATE VIRTUAL TABLE IF NOT EXISTS listing_geo USING rtree(
+    geo_id, min_lat, max_lat, min_lng, max_lng,
+    +listing_id TEXT, +query_id INTEGER, +position INTEGER
+);
+
+-- Listing quadkeys at geo_grid.MAX_ZOOM. Any map grid cell is a key prefix,
+-- so clustering a tile is one range scan on idx_listing_tiles_quadkey.
+CREATE TABLE IF NOT EXISTS listing_tiles (
+    listing_id TEXT NOT NULL,
+    query_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    quadkey TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    price REAL,
+    FOREIGN KEY (query_id) REFERENCES search_queries (query_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_listing_tiles_quadkey ON listing_tiles (quadkey);
+CREATE INDEX IF NOT EXISTS idx_listing_tiles_position ON listing_tiles (query_id, position);
+
+-- Query planner decisions (query_planner.Decision): which source answered a
+-- search, the candidates it considered (JSON) and how long it took.
+CREATE TABLE IF NOT EXISTS query_plans (
+    plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    planned_at REAL NOT NULL,
+    namespace TEXT NOT NULL,
+    query_string TEXT NOT NULL,
+    intent TEXT NOT NULL,
+    max_age_seconds INTEGER NOT NULL,
+    chosen TEXT NOT NULL,
+    data_age_seconds REAL,
+    candidates_json TEXT NOT NULL,
+    elapsed_ms REAL NOT NULL
+);
+
+-- Key-value entries (location IDs, build IDs, LLM parses, ...) for the sqlite cache backend
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+-- Trained compression dictionaries. Kept across restarts: IDs are never reused.
+CREATE TABLE IF NOT EXISTS cache_dictionaries (
+    dictionary_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data BLOB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Local listing warehouse, filled by bulk ingestion (ingestion.py).
+-- Listings are upserted by (source, listing_id); content_hash tells a
+-- changed listing from one that was only seen again.
+CREATE TABLE IF NOT EXISTS warehouse_listings (
+    row_id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    listing_id TEXT NOT NULL,
+    title TEXT,
+    price REAL,
+    area REAL,
+    rooms INTEGER,
+    baths INTEGER,
+    purpose TEXT,
+    property_type TEXT,
+    completion_status TEXT,
+    latitude REAL,
+    longitude REAL,
+    location_name TEXT,
+    location_path TEXT,
+    cover_photo_url TEXT,
+    all_image_urls TEXT,
+    agency_name TEXT,
+    contact_name TEXT,
+    mobile_number TEXT,
+    whatsapp_number TEXT,
+    down_payment_percentage REAL,
+    description TEXT,
+    listed_at REAL,
+    content_hash TEXT NOT NULL,
+    first_seen_at REAL NOT NULL,
+    last_seen_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (source, listing_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_warehouse_price ON warehouse_listings (source, purpose, price);
+CREATE INDEX IF NOT EXISTS idx_warehouse_rooms ON warehouse_listings (source, rooms);
+CREATE INDEX IF NOT EXISTS idx_warehouse_listing_id ON warehouse_listings (listing_id);
+CREATE INDEX IF NOT EXISTS idx_warehouse_listed ON warehouse_listings (source, listed_at);
+
+-- Full-text and spatial indexes over the warehouse, keyed by row_id
+CREATE VIRTUAL TABLE IF NOT EXISTS warehouse_search USING fts5(
+    title, location_path, agency_name, description,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS warehouse_geo USING rtree(
+    row_id, min_lat, max_lat, min_lng, max_lng
+);
+
+-- One row per crawl. A finished crawl lets the warehouse answer searches
+-- within its scope (canonical filters) until it is older than the policy TTL.
+CREATE TABLE IF NOT EXISTS warehouse_crawls (
+    crawl_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    scope_json TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    listing_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Resumable crawl jobs. A job plans its partitions once, then checkpoints
+-- each partition's progress so a restarted crawl skips the pages it has.
+CREATE TABLE IF NOT EXISTS crawl_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    filters_json TEXT NOT NULL,
+    partitioned INTEGER NOT NULL DEFAULT 1,
+    crawl_id INTEGER NOT NULL,
+    status TEXT NOT NULL,  -- planning, running, partial, complete or cancelled
+    listing_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+-- Pages below next_page are all fetched; done_pages (JSON) lists the ones
+-- above it fetched out of order.
+CREATE TABLE IF NOT EXISTS crawl_job_partitions (
+    job_id INTEGER NOT NULL,
+    partition_index INTEGER NOT NULL,
+    filters_json TEXT NOT NULL,
+    oversize INTEGER NOT NULL DEFAULT 0,
+    total_hits INTEGER,
+    total_pages INTEGER,
+    next_page INTEGER NOT NULL DEFAULT 0,
+    done_pages TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL,
+    PRIMARY KEY (job_id, partition_index)
+);
+
+-- Listings a full sweep of a crawl scope no longer found upstream. Search
+-- and detail reads skip them; an upsert of the listing lifts the mark.
+CREATE TABLE IF NOT EXISTS warehouse_delisted (
+    row_id INTEGER PRIMARY KEY,
+    delisted_at REAL NOT NULL
+);
+
+-- Incremental sync state per crawl scope: later syncs fetch only listings
+-- updated after the watermark; swept_at is the start of the last full sweep.
+CREATE TABLE IF NOT EXISTS warehouse_sync (
+    source TEXT NOT NULL,
+    scope_json TEXT NOT NULL,
+    watermark REAL NOT NULL,
+    swept_at REAL NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (source, scope_json)
+);
+
+-- Location hierarchy (gazetteer.py), synced in bulk from the locations API.
+-- Kept across restarts; `sync-locations` replaces it as a whole.
+CREATE TABLE IF NOT EXISTS gazetteer_locations (
+    location_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    level TEXT NOT NULL,
+    parent_id TEXT,
+    latitude REAL,
+    longitude REAL,
+    synced_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_gazetteer_locations_parent ON gazetteer_locations (parent_id);
+
+-- Normalized names and aliases; a name can refer to several locations
+CREATE TABLE IF NOT EXISTS gazetteer_aliases (
+    alias TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    PRIMARY KEY (alias, location_id)
+);
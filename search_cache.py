@@ -0,0 +1,274 @@
+"""
+Read-through search cache.
+
+Upstream result pages are cached as fixed-size segments together with the
+totals the provider reported, so any page/limit combination is served from
+SQLite with a bounded read and only the missing segments go upstream.
+Which local source answers a search, if any, is left to query_planner.
+"""
+import time
+
+import requests
+
+import cache_policy
+import canonical_filters
+import database
+import json_fragments
+import landmarks
+import memory_cache
+import property_finder
+import query_planner
+import warehouse
+
+
+def answer_from_containing_query(namespace, canonical, page, limit, include_images=True, max_age=None):
+    """
+    Containment planner: if a complete cached result set subsumes the query,
+    evaluates the residual predicates over its rows instead of going upstream.
+    Result sets fetched more than max_age seconds ago are not used.
+    Returns ((properties, total_hits), query_id), or None when no cached set contains the query.
+    """
+    for query_id, broad in database.find_complete_queries(namespace):
+        if broad == canonical or not canonical_filters.subsumes(broad, canonical):
+            continue
+        if max_age is not None and database.get_query_age(query_id) > max_age:
+            continue
+        predicates = canonical_filters.residual_predicates(broad, canonical)
+        print(f"Answering from cached query {query_id} with residual predicates {predicates}")
+        return database.get_filtered_page(query_id, predicates, (page - 1) * limit, limit,
+                                          include_images), query_id
+    return None
+
+
+def answer_near_landmark(canonical, page, limit, include_images=True):
+    """
+    Radius search: listings within `radius_km` of the `near` landmark, nearest
+    first, from every live cached result set and the listing warehouse. The
+    R*Tree indexes narrow the candidates to the enclosing box; the remaining
+    filters are evaluated per listing.
+    Returns (properties, total_hits), or None for an unknown landmark.
+    """
+    place = landmarks.lookup(canonical["near"])
+    if place is None:
+        return None
+    latitude, longitude, _ = place
+    radius_km = min(canonical.get("radius_km") or landmarks.DEFAULT_RADIUS_KM, landmarks.MAX_RADIUS_KM)
+    # The landmark's own name is how the parsers describe it, not text the listing must contain
+    ignored_terms = canonical_filters.keyword_terms(canonical["near"])
+
+    def keep(listing):
+        return canonical_filters.matches(listing, canonical, ignored_terms)
+
+    cached, _ = database.get_listings_near(latitude, longitude, radius_km, 0, None, keep, include_images)
+    # Cached copies come from live searches, so they win over the warehouse's
+    by_id = {str(listing['id']): listing for listing in cached}
+    for listing in warehouse.listings_near(latitude, longitude, radius_km, include_images):
+        if str(listing['id']) not in by_id and keep(listing):
+            by_id[str(listing['id'])] = listing
+    nearby = sorted(by_id.values(), key=lambda listing: listing['distance_km'])
+    return nearby[(page - 1) * limit:page * limit], len(nearby)
+
+
+def read_through(namespace, canonical, page, limit, segment_size, fetch_segment, include_images=True,
+                 intent=query_planner.LISTINGS):
+    """
+    Returns (properties, total_hits) for rows [(page - 1) * limit, page * limit)
+    of a query, fetching only the segments that are not cached yet.
+
+    fetch_segment(segment) must return (properties, total_hits, total_pages)
+    for the zero-based upstream page `segment` of `segment_size` rows.
+    Complete pages are kept in the in-process L1 until their SQLite entry expires.
+    `intent` (a query_planner intent) bounds how old the answer may be.
+    With include_images=False listings come back without all_image_urls.
+    """
+    query_string = canonical_filters.cache_key(canonical, namespace)
+    l1_key = (query_string, page, limit, include_images)
+    # L1 and shared pages live as long as the SQLite entry; intents that need fresher data skip them
+    use_shared_pages = query_planner.max_age(intent) >= cache_policy.get('search_results').ttl_seconds
+    cached = memory_cache.result_cache.get(l1_key) if use_shared_pages else None
+    if cached is not None:
+        return cached
+
+    # A remote backend shares pages between replicas, ahead of the local SQLite tables
+    shared_key = f"{query_string}:{page}:{limit}" + ("" if include_images else ":noimages")
+    if use_shared_pages and database.get_cache_backend().remote:
+        shared = database.cache_get('search_page', shared_key)
+        if shared is not None:
+            properties, total_hits, expires_at = shared
+            result = json_fragments.encode_listings(properties), total_hits
+            memory_cache.result_cache.put(l1_key, result, expires_at)
+            return result
+
+    result, query_id = _read_through_sqlite(query_string, namespace, canonical, page, limit,
+                                            segment_size, fetch_segment, include_images, intent)
+    properties, total_hits = result
+    is_complete_page = len(properties) == limit or (page - 1) * limit + len(properties) >= total_hits
+    if query_id and is_complete_page:
+        expires_at = database.get_query_expiry(query_id)
+        if expires_at:
+            # Encoded once here, so every L1 hit is spliced into responses without re-encoding
+            result = json_fragments.encode_listings(properties), total_hits
+            memory_cache.result_cache.put(l1_key, result, expires_at.timestamp())
+            if database.get_cache_backend().remote:
+                ttl_seconds = expires_at.timestamp() - time.time()
+                database.cache_set('search_page', shared_key, [properties, total_hits, expires_at.timestamp()],
+                                   ttl_seconds)
+    return result
+
+
+def _read_through_sqlite(query_string, namespace, canonical, page, limit, segment_size, fetch_segment,
+                         include_images=True, intent=query_planner.LISTINGS):
+    """
+    SQLite (L2) half of read_through. Tries the local sources cheapest first
+    and answers from the first holding data fresh enough for the intent; only
+    otherwise are the missing segments fetched upstream.
+    Returns ((properties, total_hits), query_id), where query_id is the cached query the rows were read from.
+    """
+    offset = (page - 1) * limit
+    first_segment = offset // segment_size
+    last_segment = (offset + limit - 1) // segment_size
+    decision = query_planner.Decision(namespace, query_string, intent)
+
+    query_id = database.find_cached_query(query_string)
+    stale_query_id = None
+    cached_segments = set()
+    total_hits = None
+    cache_age = None
+    if query_id:
+        cache_age = database.get_query_age(query_id)
+        if cache_age > decision.max_age:
+            # Too old for this intent: refetched, but still served if the portal returns nothing
+            stale_query_id, query_id = query_id, None
+        else:
+            cached_segments = database.get_cached_segments(query_id)
+            total_hits, _ = database.get_query_totals(query_id)
+    needed_segments = [segment for segment in range(first_segment, last_segment + 1)
+                       if total_hits is None or segment * segment_size < total_hits]
+
+    def from_cache():
+        if stale_query_id:
+            decision.skip('cache', 'too old', cache_age)
+        elif not query_id:
+            decision.skip('cache', 'not cached')
+        elif not cached_segments.issuperset(needed_segments):
+            decision.skip('cache', 'segments missing', cache_age)
+        else:
+            decision.choose('cache', cache_age)
+            print(f"Serving page {page} (limit {limit}) of query from cache: {query_string}")
+            return (database.get_cached_page(query_id, offset, limit, include_images), total_hits or 0), query_id
+        return None
+
+    def from_containing_query():
+        contained = answer_from_containing_query(namespace, canonical, page, limit, include_images,
+                                                 decision.max_age)
+        if contained is None:
+            decision.skip('contained', 'no fresh cached superset')
+            return None
+        decision.choose('contained', database.get_query_age(contained[1]))
+        return contained
+
+    def from_warehouse():
+        # A fresh bulk crawl covering the filters answers without going upstream
+        age = warehouse.data_age(namespace, canonical)
+        if age is None:
+            decision.skip('warehouse', 'no covering crawl')
+        elif age > decision.max_age:
+            decision.skip('warehouse', 'too old', age)
+        else:
+            stored = warehouse.answer(namespace, canonical, offset, limit, include_images)
+            if stored is not None:
+                decision.choose('warehouse', age)
+                print(f"Serving page {page} (limit {limit}) of query from the listing warehouse: {query_string}")
+                return stored, None
+            decision.skip('warehouse', 'filters not evaluable locally', age)
+        return None
+
+    local_sources = {'cache': from_cache, 'contained': from_containing_query, 'warehouse': from_warehouse}
+    for source in query_planner.local_sources_by_cost():
+        decision.begin(source)
+        answered = local_sources[source]()
+        if answered is not None:
+            decision.record()
+            return answered
+
+    decision.begin('upstream')
+    decision.choose('upstream', 0)
+    refresh = stale_query_id is not None
+    for segment in range(first_segment, last_segment + 1):
+        if segment in cached_segments:
+            continue
+        if total_hits is not None and segment * segment_size >= total_hits:
+            break
+
+        print(f"Cache miss for segment {segment} of query: {query_string}. Fetching live...")
+        properties, total_hits, total_pages = fetch_segment(segment)
+        if not properties:
+            break
+
+        query_id = database.save_query(query_string, total_hits, total_pages, canonical, refresh=refresh)
+        refresh = False
+        database.save_segment(query_id, segment, segment_size, properties)
+        if len(properties) < segment_size:
+            break
+    decision.record()
+
+    if not query_id and stale_query_id:
+        print(f"Upstream returned nothing; serving older cached results for query: {query_string}")
+        query_id = stale_query_id
+        total_hits, _ = database.get_query_totals(query_id)
+    if not query_id:
+        return ([], 0), None
+
+    print(f"Serving page {page} (limit {limit}) of query from cache: {query_string}")
+    return (database.get_cached_page(query_id, offset, limit, include_images), total_hits or 0), query_id
+
+
+def property_finder_build_id(filters):
+    """Returns the Property Finder build ID, shared through the cache backend."""
+    build_id = database.cache_get('build_id', 'propertyfinder')
+    if build_id:
+        return build_id
+    try:
+        build_id = property_finder.initialise(filters)
+    except requests.exceptions.RequestException as e:
+        print(f"Error refreshing Property Finder build ID: {e}")
+        return database.cache_get('build_id', 'propertyfinder', allow_stale=True)
+    if build_id:
+        database.cache_set('build_id', 'propertyfinder', build_id)
+    return build_id
+
+
+def search_property_finder(filters, page=1, limit=50, intent=query_planner.LISTINGS):
+    """
+    Cached Property Finder search. Returns (properties, total_hits) for the requested page.
+    `intent` is the query_planner intent bounding how old the results may be.
+    """
+    # Pagination is served from cached segments, so it is not part of the key
+    page = filters.get('page', page)
+    canonical = canonical_filters.canonicalize(filters)
+
+    if "near" in canonical:
+        nearby = answer_near_landmark(canonical, page, limit)
+        if nearby is not None and nearby[1]:
+            print(f"Answering radius search near '{canonical['near']}' from the local geo index")
+            return nearby
+        # Nothing cached around it yet: search the landmark's community upstream instead
+        place = landmarks.lookup(canonical["near"])
+        canonical = {key: value for key, value in canonical.items() if key not in canonical_filters.GEO_KEYS}
+        if place is not None and "query" not in canonical:
+            canonical = canonical_filters.canonicalize(dict(canonical, query=place[2]))
+
+    def fetch_segment(segment):
+        # Property Finder expects 'location_query' and 1-based page numbers
+        upstream_filters = dict(canonical)
+        if 'query' in upstream_filters:
+            upstream_filters['location_query'] = upstream_filters.pop('query')
+        upstream_filters['page'] = segment + 1
+        result = property_finder.property_finder_search_with_totals(
+            {"filters": upstream_filters}, build_id=property_finder_build_id(upstream_filters))
+        if not result[0]:
+            # An empty page may mean the cached build ID went stale after a deploy
+            database.cache_delete('build_id', 'propertyfinder')
+        return result
+
+    return read_through('pf', canonical, page, limit, property_finder.PF_PAGE_SIZE, fetch_segment, intent=intent)
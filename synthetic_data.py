@@ -0,0 +1,255 @@
+"""
+Synthetic listings for scale testing, modelled on the sample CSVs in tests/.
+
+learn() fits a smoothed bootstrap of the samples. Each synthetic listing
+starts from a random sample row, keeping its purpose, rooms, baths and
+location together. Its area is drawn from a log-space kernel density
+around that row. It is priced by the per-purpose log-price/log-area
+regression plus the row's own residual, which carries the location's
+premium. Its coordinates scatter within the spread of the row's location.
+
+Listings are generated in vectorized batches, so 10M rows stream in
+bounded memory: to CSV (write_csv) or into the listing warehouse (bulk_load).
+"""
+import csv
+import glob
+import math
+import os
+import re
+import time
+from collections import Counter
+
+import click
+import numpy as np
+
+import gazetteer
+import warehouse
+
+SAMPLE_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', '*.csv')
+BATCH_ROWS = 10000
+# Far above real portal IDs, so synthetic listings never collide with crawled ones
+ID_BASE = 900000000
+# Coordinate scatter around a location (degrees): its observed spread, within these bounds
+MIN_SPREAD_DEGREES = 0.0015
+MAX_SPREAD_DEGREES = 0.015
+# Extra log-price noise on top of the sample row's residual
+PRICE_NOISE = 0.05
+LISTED_WITHIN_SECONDS = 365 * 24 * 3600
+# Same columns as the sample CSVs, plus the fields the warehouse keeps
+CSV_COLUMNS = ('id',) + warehouse.WAREHOUSE_FIELDS
+
+# Property type named in a title, most specific first; anything else is an apartment
+_TITLE_PROPERTY_TYPES = ('penthouse', 'townhouse', 'villa', 'duplex')
+_TEXT_FIELDS = ('purpose', 'completion_status', 'property_type', 'location_name', 'location_path', 'cover_photo_url',
+                'all_image_urls', 'agency_name', 'contact_name', 'mobile_number', 'whatsapp_number',
+                'down_payment_percentage')
+_VOCABULARY_SIZE = 300
+# Title words the generated title already spells out
+_TITLE_STOPWORDS = {'bedroom', 'bedrooms', 'studio', 'apartment', 'apartments', 'with', 'from', 'dubai'} | set(
+    _TITLE_PROPERTY_TYPES)
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _property_type(title):
+    words = set(re.findall(r"[a-z]+", title.casefold()))
+    return next((kind for kind in _TITLE_PROPERTY_TYPES if kind in words or kind + 's' in words), 'apartment')
+
+
+def _location_path(location_name):
+    # The gazetteer knows the communities and emirate above a building; the samples only name the building
+    known = gazetteer.resolve(location_name)
+    if known:
+        return ", ".join(location['name'] for location in gazetteer.ancestors(known['id']))
+    return location_name
+
+
+def learn(paths=None):
+    """
+    Fits the generator to sample listing CSVs (default: tests/*.csv).
+    Rows without a price, area or coordinates are skipped. Returns the model.
+    """
+    paths = paths or sorted(glob.glob(SAMPLE_FILES))
+    samples = {}
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                price, area = _number(row.get('price')), _number(row.get('area'))
+                latitude, longitude = _number(row.get('latitude')), _number(row.get('longitude'))
+                if not price or not area or price <= 0 or area <= 0 or latitude is None or longitude is None:
+                    continue
+                row.update(price=price, area=area, latitude=latitude, longitude=longitude,
+                           rooms=int(_number(row.get('rooms')) or 0), baths=int(_number(row.get('baths')) or 1),
+                           property_type=_property_type(row.get('title') or ''))
+                samples[row.get('id') or len(samples)] = row
+    rows = list(samples.values())
+    if len(rows) < 2:
+        raise ValueError(f"Not enough usable sample listings in {paths}")
+
+    log_area = np.log([row['area'] for row in rows])
+    log_price = np.log([row['price'] for row in rows])
+    purposes = sorted({row['purpose'] for row in rows})
+    purpose_index = np.array([purposes.index(row['purpose']) for row in rows])
+
+    # log(price) = intercept + slope * log(area), per purpose; too few rows share the pooled fit
+    pooled = np.polyfit(log_area, log_price, 1)
+    coefficients = np.empty((len(purposes), 2))
+    for index in range(len(purposes)):
+        selected = purpose_index == index
+        fits = selected.sum() >= 3 and np.ptp(log_area[selected]) > 0
+        coefficients[index] = np.polyfit(log_area[selected], log_price[selected], 1) if fits else pooled
+    slope, intercept = coefficients[purpose_index, 0], coefficients[purpose_index, 1]
+    residual = log_price - (intercept + slope * log_area)
+
+    # Coordinate spread of each location, shared by its rows
+    by_location = {}
+    for index, row in enumerate(rows):
+        by_location.setdefault(row['location_name'], []).append(index)
+    latitude = np.array([row['latitude'] for row in rows])
+    longitude = np.array([row['longitude'] for row in rows])
+    spread = np.empty(len(rows))
+    for indexes in by_location.values():
+        observed = max(latitude[indexes].std(), longitude[indexes].std()) if len(indexes) > 1 else 0.0
+        spread[indexes] = min(max(observed, MIN_SPREAD_DEGREES), MAX_SPREAD_DEGREES)
+
+    # Title words that are not place names, by frequency, for generated titles and descriptions
+    place_words = {word for name in by_location for word in re.findall(r"[a-z]+", str(name).casefold())}
+    vocabulary = Counter(word for row in rows for word in re.findall(r"[a-z]{4,}", (row['title'] or '').casefold())
+                         if word not in place_words and word not in _TITLE_STOPWORDS)
+    words, counts = zip(*vocabulary.most_common(_VOCABULARY_SIZE)) if vocabulary else (('modern',), (1,))
+
+    location_paths = {name: _location_path(name) for name in by_location}
+    for row in rows:
+        row['location_path'] = location_paths[row['location_name']]
+    return {
+        'rows': [{field: row.get(field) or None for field in _TEXT_FIELDS} for row in rows],
+        'rooms': np.array([row['rooms'] for row in rows]),
+        'baths': np.array([row['baths'] for row in rows]),
+        'log_area': log_area,
+        'residual': residual,
+        'purpose_index': purpose_index,
+        'coefficients': coefficients,
+        # Silverman's rule of thumb for the area kernel
+        'bandwidth': 1.06 * log_area.std() * len(rows) ** -0.2,
+        'latitude': latitude,
+        'longitude': longitude,
+        'spread': spread,
+        'words': np.array(words),
+        'word_weights': np.array(counts) / sum(counts),
+    }
+
+
+def _beds_label(rooms):
+    return "Studio" if rooms == 0 else f"{rooms}BR"
+
+
+def generate(model, count, seed=None, start_id=ID_BASE, batch_size=BATCH_ROWS):
+    """Yields lists of up to `batch_size` synthetic listings, `count` in total, in the warehouse schema."""
+    rng = np.random.default_rng(seed)
+    # Listing dates count back from midnight, so a seed gives the same dataset all day
+    now = time.time() // 86400 * 86400
+    for offset in range(0, count, batch_size):
+        size = min(batch_size, count - offset)
+        seeds = rng.integers(0, len(model['rows']), size)
+        log_area = model['log_area'][seeds] + model['bandwidth'] * rng.standard_normal(size)
+        slope, intercept = model['coefficients'][model['purpose_index'][seeds]].T
+        log_price = intercept + slope * log_area + model['residual'][seeds] + PRICE_NOISE * rng.standard_normal(size)
+        prices = np.round(np.exp(log_price), -3)
+        areas = np.round(np.exp(log_area), 2)
+        spread = model['spread'][seeds]
+        latitudes = model['latitude'][seeds] + spread * rng.standard_normal(size)
+        longitudes = model['longitude'][seeds] + spread * rng.standard_normal(size)
+        listed_at = now - rng.uniform(0, LISTED_WITHIN_SECONDS, size)
+        words = rng.choice(model['words'], size=(size, 6), p=model['word_weights'])
+
+        batch = []
+        for i, sample in enumerate(seeds):
+            row = model['rows'][sample]
+            rooms, baths = int(model['rooms'][sample]), int(model['baths'][sample])
+            kind = row['property_type'].title()
+            title = f"{words[i, 0].title()} {words[i, 1].title()} {_beds_label(rooms)} {kind} in {row['location_name']}"
+            listing = dict(row)
+            listing.update({
+                'id': start_id + offset + i,
+                'title': title,
+                'price': float(prices[i]),
+                'area': float(areas[i]),
+                'rooms': rooms,
+                'baths': baths,
+                'latitude': round(float(latitudes[i]), 6),
+                'longitude': round(float(longitudes[i]), 6),
+                'all_image_urls': [url.strip() for url in (row['all_image_urls'] or '').split(',') if url.strip()],
+                'description': f"{title}. {areas[i]:g} sqm, {baths} bathrooms, {row['completion_status'] or 'ready'}. "
+                               + " ".join(words[i, 2:]),
+                'listed_at': float(listed_at[i]),
+            })
+            batch.append(listing)
+        yield batch
+
+
+def write_csv(model, path, count, seed=None, start_id=ID_BASE):
+    """Streams `count` synthetic listings into a CSV at `path` (written under a temporary name). Returns count."""
+    written = 0
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(CSV_COLUMNS)
+        for batch in generate(model, count, seed, start_id):
+            for listing in batch:
+                listing['all_image_urls'] = ", ".join(listing['all_image_urls'])
+                writer.writerow([listing.get(column) for column in CSV_COLUMNS])
+            written += len(batch)
+    os.replace(path + '.tmp', path)
+    return written
+
+
+def bulk_load(model, count, source='bayut', seed=None, start_id=ID_BASE, as_crawl=False):
+    """
+    Generates `count` listings straight into the listing warehouse in
+    BATCH_ROWS batches. With as_crawl they are recorded as a complete crawl
+    of everything, so the warehouse answers searches from them.
+    Returns (inserted, updated, unchanged).
+    """
+    crawl_id = warehouse.start_crawl(source, {}) if as_crawl else None
+    totals = [0, 0, 0]
+    started = time.time()
+    for batch in generate(model, count, seed, start_id):
+        for index, value in enumerate(warehouse.upsert_listings(source, batch)):
+            totals[index] += value
+        loaded = sum(totals)
+        print(f"Loaded {loaded} of {count} synthetic listings ({loaded / (time.time() - started):.0f}/s)")
+    if crawl_id is not None:
+        warehouse.finish_crawl(crawl_id, count)
+    return tuple(totals)
+
+
+@click.command('generate-listings')
+@click.argument('count', type=click.IntRange(1))
+@click.option('--csv', 'csv_path', help="Stream the listings into this CSV file.")
+@click.option('--load', 'load', is_flag=True, help="Bulk-load the listings into the listing warehouse.")
+@click.option('--source', type=click.Choice(warehouse.SOURCES), default='bayut', show_default=True,
+              help="Warehouse source to load them as.")
+@click.option('--as-crawl', is_flag=True, help="Record the load as a complete crawl, so searches are answered from it.")
+@click.option('--seed', type=int, help="Random seed, for a reproducible dataset.")
+@click.option('--start-id', default=ID_BASE, show_default=True, help="ID of the first listing.")
+@click.option('--samples', multiple=True, help="Sample CSV to learn from; may be repeated (default: tests/*.csv).")
+def generate_listings_command(count, csv_path, load, source, as_crawl, seed, start_id, samples):
+    """Generate realistic synthetic listings for scale testing."""
+    if not csv_path and not load:
+        raise click.UsageError("Choose --csv PATH, --load or both.")
+    model = learn(list(samples) or None)
+    click.echo(f"Learned from {len(model['rows'])} sample listings.")
+    if csv_path:
+        click.echo(f"Wrote {write_csv(model, csv_path, count, seed, start_id)} listings to {csv_path}.")
+    if load:
+        inserted, updated, unchanged = bulk_load(model, count, source, seed, start_id, as_crawl)
+        click.echo(f"Loaded {count} listings as {source}: {inserted} new, {updated} changed, {unchanged} unchanged.")
+
+
+def init_app(app):
+    app.cli.add_command(generate_listings_command)
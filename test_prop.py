@@ -1,12 +1,11 @@
 import io
 import math
 import requests
-from urllib.parse import urlencode
 from flask import Flask, request, jsonify, send_file, abort, render_template
 
 import database
+import search_cache
 from ollam import parse_natural_query
-import property_finder
 
 import sqlite3
 from datetime import datetime, timedelta
@@ -29,55 +28,8 @@ def search_properties(filters, page=1, limit=50):
     Fetches property listings using the Property Finder API and caches them.
     """
     print(f"search filters in ppd {filters}")
-    # 1. Prepare filters for the cache key.
-    #    Remove empty or invalid filters before creating the cache key string.
-    cleaned_filters = {k: v for k, v in filters.items() if v and v != ['']}
-
-    # 2. Add 'page' and 'limit' to the cache key to ensure unique cache entries for different paginations.
-    cleaned_filters['page'] = page
-    cleaned_filters['limit'] = limit
-
-    # 3. Create a unique query string for caching.
-    #    'doseq=True' is crucial for handling lists like beds=['3', '4'].
-    sorted_filters = sorted(cleaned_filters.items())
-    query_string = urlencode(sorted_filters, doseq=True)
-
-    # 4. Check the cache.
-    query_id = database.find_cached_query(query_string)
-
-    if query_id:
-        print(f"Cache hit for query: {query_string}")
-        # Retrieve paginated properties from the cache
-        properties_data = database.get_properties_for_query(query_id)
-
-        # Calculate pagination details
-        total_properties = len(properties_data)
-        start = (page - 1) * limit
-        end = start + limit
-        paginated_properties = properties_data[start:end]
-
-        return paginated_properties
-    else:
-        print(f"Cache miss for query: {query_string}. Fetching live from Property Finder...")
-
-        # 5. Fetch live data from Property Finder.
-        #    Note: The Property Finder API itself does not have a 'limit' parameter,
-        #    so you can pass the 'page' and other filters directly.
-        # Wrap filters in the expected structure for property_finder_search
-        # Convert 'query' to 'location_query' for Property Finder API
-        if 'query' in cleaned_filters:
-            cleaned_filters['location_query'] = cleaned_filters.pop('query')
-        
-        search_params = {"filters": cleaned_filters}
-        properties = property_finder.property_finder_search(search_params)
-
-
-
-        if properties:
-            # 6. Save the live data to the database.
-            database.save_query_and_properties(query_string, properties)
-
-        return properties
+    properties, _ = search_cache.search_property_finder(filters, page, limit)
+    return properties
 # --- Flask Routes ---
 @app.route("/")
 def home():
@@ -230,26 +182,13 @@ def api_property_detail(property_id):
     Returns a single property's details as a JSON object,
     retrieved from the cache (now populated with PF data).
     """
-    db = database.get_db()
-    cursor = db.cursor()
-
-    # Ensure the ID is a string when querying the database.
-    # The URL route is defined with <int:property_id>, so we need to convert it.
-    cursor.execute("SELECT * FROM cached_properties WHERE id = ?", (str(property_id),))
-    property_row = cursor.fetchone()
-
-    if property_row is None:
+    property_dict = database.get_cached_property(property_id)
+    if property_dict is None:
         # If the property is not in the database, you could attempt
         # to fetch it live from the API and cache it, but this adds
         # complexity. For now, a 404 is a reasonable response.
         abort(404, description="Property not found in cache.")
 
-    property_dict = dict(property_row)
-    if property_dict.get('all_image_urls'):
-        property_dict['all_image_urls'] = property_dict['all_image_urls'].split(',')
-    else:
-        property_dict['all_image_urls'] = []
-
     return jsonify(property_dict)
 
 @app.route("/map_view")
@@ -1,3 +1,4 @@
+import csv
 import json
 import pandas as pd
 import requests
@@ -126,6 +127,120 @@ def _fetch_bayut_api_response(
         return {}
 
 
+# --- Streaming collection ---
+
+PROPERTY_COLUMNS = [
+    'id', 'title', 'price', 'area', 'rooms', 'baths', 'purpose', 'completion_status', 'latitude', 'longitude',
+    'location_name', 'cover_photo_url', 'all_image_urls', 'agency_name', 'contact_name', 'mobile_number',
+    'whatsapp_number', 'down_payment_percentage'
+]
+
+
+def _extract_property(prop):
+    """Flattens one API hit into a CSV-ready record (image URLs as a comma-separated string)."""
+    return {
+        'id': prop.get('id'),
+        'title': prop.get('title'),
+        'price': prop.get('price'),
+        'area': prop.get('area'),
+        'rooms': prop.get('rooms'),
+        'baths': prop.get('baths'),
+        'purpose': prop.get('purpose'),
+        'completion_status': prop.get('completionStatus'),
+        'latitude': prop.get('geography', {}).get('lat'),
+        'longitude': prop.get('geography', {}).get('lng'),
+        'location_name': prop.get('location')[-1].get('name') if prop.get('location') else None,
+        'cover_photo_url': prop.get('coverPhoto', {}).get('url'),
+        'all_image_urls': ', '.join(f"https://images.bayut.com/thumbnails/{img_id}-400x300.webp" for img_id in prop.get('photoIDs', [])),
+        'agency_name': prop.get('agency', {}).get('name'),
+        'contact_name': prop.get('contactName'),
+        'mobile_number': prop.get('phoneNumber', {}).get('mobile'),
+        'whatsapp_number': prop.get('phoneNumber', {}).get('whatsapp'),
+        'down_payment_percentage': prop.get('paymentPlanSummaries', [{}])[0].get('breakdown', {}).get('downPaymentPercentage')
+    }
+
+
+def iter_bayut_property_pages(
+    purposes: list or str = None,
+    location_query: str = "",
+    property_types: list or str = None,
+    completion_status: str = None,
+    rent_frequency: str = None,
+    max_pages_to_fetch: int = None,
+    initial_hits_per_page: int = 100,
+    delay_seconds: float = 0.1
+):
+    """
+    Generator behind get_bayut_property_data(): yields the extracted records
+    of one page at a time, so callers can write them out as they arrive
+    instead of holding the whole collection in memory.
+    """
+    print("--- Initiating Bayut Property Data Collection ---")
+    # Step 1: Make an initial call to get pagination information
+    print("  Making initial API call to determine pagination limits...")
+    initial_response_data = _fetch_bayut_api_response(
+        purposes=purposes,
+        location_query=location_query,
+        property_types=property_types,
+        completion_status=completion_status,
+        rent_frequency=rent_frequency,
+        page=0,
+        hits_per_page=initial_hits_per_page
+    )
+
+    if not initial_response_data:
+        print("  Initial API call failed or returned no data.")
+        return
+
+    total_nb_hits = initial_response_data.get('nbHits', 0)
+    total_nb_pages = initial_response_data.get('nbPages', 0)
+    effective_hits_per_page = initial_response_data.get('hitsPerPage', initial_hits_per_page)
+
+    print(f"  API reports: Total Hits = {total_nb_hits}, Total Pages = {total_nb_pages} (at {effective_hits_per_page} hits/page).")
+
+    # Determine the actual number of pages to fetch
+    pages_to_fetch = total_nb_pages
+    if max_pages_to_fetch is not None and max_pages_to_fetch < total_nb_pages:
+        pages_to_fetch = max_pages_to_fetch
+        print(f"  Fetching limited to {max_pages_to_fetch} pages as requested.")
+    else:
+        print(f"  Attempting to fetch up to {pages_to_fetch} pages based on API report.")
+
+
+    # Step 2: Iterate through pages and fetch data
+    current_properties_count = 0
+    collected_pages_count = 0
+
+    for p in range(pages_to_fetch):
+        print(f"  Fetching page {p}...")
+        page_result = _fetch_bayut_api_response(
+            purposes=purposes,
+            location_query=location_query,
+            property_types=property_types,
+            completion_status=completion_status,
+            rent_frequency=rent_frequency,
+            page=p,
+            hits_per_page=effective_hits_per_page
+        )
+
+        page_properties = page_result.get('hits', []) # Extract hits from the result
+
+        if not page_properties:
+            print(f"  Page {p} returned 0 properties. End of data or API limit reached for these filters. Stopping pagination.")
+            break # Stop if a page returns no properties
+        else:
+            num_properties_on_page = len(page_properties)
+            print(f"  Page {p} returned {num_properties_on_page} properties.")
+            current_properties_count += num_properties_on_page
+            collected_pages_count += 1
+
+        # Extract relevant fields and hand the page to the caller
+        yield [_extract_property(prop) for prop in page_properties]
+        time.sleep(delay_seconds) # Pause to respect rate limits
+
+    print(f"\nCollection complete. Actually collected {current_properties_count} properties across {collected_pages_count} pages.")
+
+
 # --- Main Function to Get Bayut Property Data ---
 
 def get_bayut_property_data(
@@ -199,103 +314,39 @@ def get_bayut_property_data(
         - Ensure you have 'pandas', 'requests', 'matplotlib', and 'seaborn' installed:
           `pip install pandas requests matplotlib seaborn`
     """
-    all_extracted_data = []
-
-    print("--- Initiating Bayut Property Data Collection ---")
-
-    # Step 1: Make an initial call to get pagination information
-    print("  Making initial API call to determine pagination limits...")
-    initial_response_data = _fetch_bayut_api_response(
+    records = (record for page in iter_bayut_property_pages(
         purposes=purposes,
         location_query=location_query,
         property_types=property_types,
         completion_status=completion_status,
         rent_frequency=rent_frequency,
-        page=0,
-        hits_per_page=initial_hits_per_page
-    )
-
-    if not initial_response_data:
-        print("  Initial API call failed or returned no data. Returning empty DataFrame.")
-        return pd.DataFrame() # Return empty DataFrame if initial call fails
-
-    total_nb_hits = initial_response_data.get('nbHits', 0)
-    total_nb_pages = initial_response_data.get('nbPages', 0)
-    effective_hits_per_page = initial_response_data.get('hitsPerPage', initial_hits_per_page)
-
-    print(f"  API reports: Total Hits = {total_nb_hits}, Total Pages = {total_nb_pages} (at {effective_hits_per_page} hits/page).")
-
-    # Determine the actual number of pages to fetch
-    pages_to_fetch = total_nb_pages
-    if max_pages_to_fetch is not None and max_pages_to_fetch < total_nb_pages:
-        pages_to_fetch = max_pages_to_fetch
-        print(f"  Fetching limited to {max_pages_to_fetch} pages as requested.")
-    else:
-        print(f"  Attempting to fetch up to {pages_to_fetch} pages based on API report.")
-
-
-    # Step 2: Iterate through pages and fetch data
-    current_properties_count = 0
-    collected_pages_count = 0
-
-    for p in range(pages_to_fetch):
-        print(f"  Fetching page {p}...")
-        page_result = _fetch_bayut_api_response(
-            purposes=purposes,
-            location_query=location_query,
-            property_types=property_types,
-            completion_status=completion_status,
-            rent_frequency=rent_frequency,
-            page=p,
-            hits_per_page=effective_hits_per_page
-        )
-
-        page_properties = page_result.get('hits', []) # Extract hits from the result
-
-        if not page_properties:
-            print(f"  Page {p} returned 0 properties. End of data or API limit reached for these filters. Stopping pagination.")
-            break # Stop if a page returns no properties
-        else:
-            num_properties_on_page = len(page_properties)
-            print(f"  Page {p} returned {num_properties_on_page} properties.")
-            current_properties_count += num_properties_on_page
-            collected_pages_count += 1
-
-        # Extract relevant fields and append to master list
-        for prop in page_properties:
-            all_extracted_data.append({
-                'id': prop.get('id'),
-                'title': prop.get('title'),
-                'price': prop.get('price'),
-                'area': prop.get('area'),
-                'rooms': prop.get('rooms'),
-                'baths': prop.get('baths'),
-                'purpose': prop.get('purpose'),
-                'completion_status': prop.get('completionStatus'),
-                'latitude': prop.get('geography', {}).get('lat'),
-                'longitude': prop.get('geography', {}).get('lng'),
-                'location_name': prop.get('location')[-1].get('name') if prop.get('location') else None,
-                'cover_photo_url': prop.get('coverPhoto', {}).get('url'),
-                'all_image_urls': [f"https://images.bayut.com/thumbnails/{img_id}-400x300.webp" for img_id in prop.get('photoIDs', [])],
-                'agency_name': prop.get('agency', {}).get('name'),
-                'contact_name': prop.get('contactName'),
-                'mobile_number': prop.get('phoneNumber', {}).get('mobile'),
-                'whatsapp_number': prop.get('phoneNumber', {}).get('whatsapp'),
-                'down_payment_percentage': prop.get('paymentPlanSummaries', [{}])[0].get('breakdown', {}).get('downPaymentPercentage')
-            })
-        time.sleep(delay_seconds) # Pause to respect rate limits
+        max_pages_to_fetch=max_pages_to_fetch,
+        initial_hits_per_page=initial_hits_per_page,
+        delay_seconds=delay_seconds
+    ) for record in page)
+    df = pd.DataFrame.from_records(records, columns=PROPERTY_COLUMNS)
+    if df.empty:
+        print("No properties were collected. Returning empty DataFrame.")
+    return df
 
-    print(f"\nCollection complete. Actually collected {len(all_extracted_data)} properties across {collected_pages_count} pages.")
 
-    # Step 3: Convert to DataFrame and return
-    if all_extracted_data:
-        df = pd.DataFrame(all_extracted_data)
-        # Convert list of image URLs into a comma-separated string for CSV export
-        df['all_image_urls'] = df['all_image_urls'].apply(lambda x: ', '.join(x) if x else '')
-        return df
-    else:
-        print("No properties were collected. Returning empty DataFrame.")
-        return pd.DataFrame()
+def save_bayut_property_data_csv(path: str, **filters) -> int:
+    """
+    Streams the same collection as get_bayut_property_data() straight into a
+    CSV file, one page at a time, so memory stays flat however many pages a
+    broad query returns and everything fetched so far is on disk if the run
+    dies. Takes the same keyword arguments. Returns the number of rows written.
+    """
+    rows_written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=PROPERTY_COLUMNS)
+        writer.writeheader()
+        for page in iter_bayut_property_pages(**filters):
+            writer.writerows(page)
+            csv_file.flush()
+            rows_written += len(page)
+    print(f"Saved {rows_written} properties to {path}")
+    return rows_written
 
 
 # --- Example Usage (in your main script or another module) ---
@@ -341,18 +392,19 @@ if __name__ == "__main__":
 
     # Example 3: Get all "for-sale" OR "for-rent" properties for all UAE, all types (dynamic pages)
     # This will attempt to fetch up to 500 pages (max reported by API), resulting in ~1700 properties
-    df_uae_all = get_bayut_property_data(
+    rows_saved = save_bayut_property_data_csv(
+        "uae_all_properties.csv",
         purposes=["for-sale", "for-rent"],
         location_query="",
         property_types=[], # All types
         delay_seconds=0.1 # Short delay
     )
     print("\n--- All UAE Properties (For Sale OR For Rent) ---")
-    if not df_uae_all.empty:
+    if rows_saved:
+        # Load back only the columns the plots need
+        df_uae_all = pd.read_csv("uae_all_properties.csv", usecols=['price', 'purpose', 'location_name'])
         print(f"Collected {len(df_uae_all)} properties.")
         print(df_uae_all.head())
-        df_uae_all.to_csv("uae_all_properties.csv", index=False)
-        print("Saved to uae_all_properties.csv")
 
         # Basic Plotting for the large dataset
         print("\n--- Generating plots for All UAE Properties ---")
@@ -0,0 +1,93 @@
+import math
+
+import pytest
+
+import bayut
+import canonical_filters
+import ingestion
+import warehouse
+from conftest import listing
+
+FILTERS = {'purpose': 'for-sale'}
+
+
+class FakeAlgolia:
+    """Stands in for bayut.fetch_algolia_page over a fixed list of hits."""
+
+    def __init__(self, count):
+        self.hits = [listing(i, location_path="Dubai Marina, Dubai", listed_at=1700000000 + i)
+                     for i in range(count)]
+        self.pages = []
+
+    def fetch(self, filters, page, hits_per_page, mapper=None, attributes=None):
+        if hits_per_page > 1:  # not a partition probe
+            self.pages.append(page)
+        hits = self.hits[page * hits_per_page:(page + 1) * hits_per_page]
+        if attributes:
+            hits = [{key: hit[key] for key in attributes} for hit in hits]
+        return hits, len(self.hits), math.ceil(len(self.hits) / hits_per_page)
+
+
+@pytest.fixture
+def algolia(app, monkeypatch):
+    fake = FakeAlgolia(250)
+    monkeypatch.setattr(bayut, 'fetch_algolia_page', fake.fetch)
+    monkeypatch.setattr(bayut, 'map_algolia_hit_details', dict)
+    return fake
+
+
+def _search_total():
+    canonical = canonical_filters.canonicalize({'purpose': 'sale'}, resolve_locations=False)
+    return warehouse.search('bayut', canonical, 0, 10)[1]
+
+
+def test_crawl_resumes_from_its_checkpoints(algolia):
+    first = ingestion.crawl('bayut', FILTERS, max_pages=1, map_workers=0)
+    assert not first['complete']
+    assert warehouse.get_job(first['job_id'])['status'] == 'partial'
+    assert warehouse.search('bayut', canonical_filters.canonicalize(FILTERS, resolve_locations=False), 0, 10) is None
+
+    algolia.pages.clear()
+    second = ingestion.crawl('bayut', FILTERS, map_workers=0)
+    assert second['job_id'] == first['job_id']
+    assert sorted(algolia.pages) == [1, 2]
+    assert second['complete']
+    assert warehouse.get_job(second['job_id'])['listing_count'] == 250
+    assert _search_total() == 250
+
+
+def test_page_that_fails_to_map_is_fetched_again_on_resume(algolia, monkeypatch):
+    failures = []
+
+    def flaky(hit):
+        if hit['id'] == 150 and not failures:
+            failures.append(hit['id'])
+            raise ValueError("unexpected hit")
+        return dict(hit)
+
+    monkeypatch.setattr(bayut, 'map_algolia_hit_details', flaky)
+    first = ingestion.crawl('bayut', FILTERS, map_workers=0)
+    assert (first['map_errors'], first['failed_pages'], first['complete']) == (1, [(0, 1)], False)
+    assert warehouse.get_job(first['job_id'])['status'] == 'partial'
+
+    algolia.pages.clear()
+    second = ingestion.crawl('bayut', FILTERS, map_workers=0)
+    assert second['job_id'] == first['job_id']
+    assert algolia.pages == [1]
+    assert second['complete']
+    assert _search_total() == 250
+
+
+def test_sweep_delists_listings_gone_upstream(algolia):
+    assert ingestion.crawl('bayut', FILTERS, map_workers=0)['complete']
+    removed, algolia.hits = algolia.hits[:10], algolia.hits[10:]
+
+    summary = ingestion.sweep('bayut', FILTERS)
+    assert (summary['seen'], summary['unknown'], summary['delisted']) == (240, 0, 10)
+    assert _search_total() == 240
+    assert warehouse.get_listing(str(removed[0]['id'])) is None
+
+    # Seen again, they are listed again
+    algolia.hits = removed + algolia.hits
+    assert ingestion.sweep('bayut', FILTERS)['delisted'] == 0
+    assert _search_total() == 250
@@ -0,0 +1,131 @@
+import pytest
+
+import canonical_filters
+import database
+import search_cache
+from conftest import listing
+
+SEGMENT_SIZE = 10
+
+
+@pytest.fixture(params=database.STORAGE_FORMATS)
+def storage_format(request, app, monkeypatch):
+    monkeypatch.setattr(database, '_storage_format', request.param)
+    return request.param
+
+
+def _ids(properties):
+    return [str(prop['id']) for prop in properties]
+
+
+def test_pages_do_not_overlap_across_duplicate_gaps(storage_format):
+    query_id = database.save_query('algolia:pages', 29, 3)
+    database.save_segment(query_id, 0, SEGMENT_SIZE, [listing(i) for i in range(10)])
+    # Listing 5 shifted onto the next upstream page: its second copy is dropped, leaving a gap at position 12
+    database.save_segment(query_id, 1, SEGMENT_SIZE, [listing(i) for i in (10, 11, 5, 13, 14, 15, 16, 17, 18, 19)])
+    database.save_segment(query_id, 2, SEGMENT_SIZE, [listing(i) for i in range(20, 30)])
+
+    pages = [_ids(database.get_cached_page(query_id, offset, SEGMENT_SIZE)) for offset in (0, 10, 20)]
+    assert pages[0] == [str(i) for i in range(10)]
+    assert pages[1] == ['10', '11', '13', '14', '15', '16', '17', '18', '19']
+    assert pages[2] == [str(i) for i in range(20, 30)]
+    # Smaller pages straddling the gap stay disjoint too
+    assert _ids(database.get_cached_page(query_id, 8, 5)) == ['8', '9', '10', '11']
+    assert _ids(database.get_cached_page(query_id, 13, 5)) == ['13', '14', '15', '16', '17']
+
+
+def test_read_through_fetches_only_missing_segments(app):
+    upstream = [listing(i) for i in range(25)]
+    fetched = []
+
+    def fetch_segment(segment):
+        fetched.append(segment)
+        return upstream[segment * SEGMENT_SIZE:(segment + 1) * SEGMENT_SIZE], len(upstream), 3
+
+    canonical = canonical_filters.canonicalize({'query': 'dubai marina'}, resolve_locations=False)
+    properties, total = search_cache.read_through('algolia', canonical, 1, 5, SEGMENT_SIZE, fetch_segment)
+    assert (_ids(properties), total) == ([str(i) for i in range(5)], 25)
+    properties, _ = search_cache.read_through('algolia', canonical, 2, 10, SEGMENT_SIZE, fetch_segment)
+    assert _ids(properties) == [str(i) for i in range(10, 20)]
+    assert fetched == [0, 1]
+
+
+def test_equivalent_filters_share_a_cache_key():
+    spellings = [
+        {'location': 'JVC', 'rooms': ['3', 2], 'bathrooms': '2', 'purpose': 'buy',
+         'property_types': ['Villas', 'flat']},
+        {'query': 'jumeirah village circle', 'beds': [2, 3], 'baths': 2, 'property_type': ['apartment', 'villa'],
+         'page': 4},
+        {'location_query': ' Jumeirah  Village Circle ', 'bedrooms': [3, 2, 3], 'baths': 2.0, 'purpose': 'sale',
+         'property_type': ['villa', 'apartment'], 'sort': 'mr'},
+    ]
+    keys = {canonical_filters.cache_key(canonical_filters.canonicalize(filters, resolve_locations=False), 'pf')
+            for filters in spellings}
+    assert len(keys) == 1
+
+    different = canonical_filters.canonicalize(dict(spellings[0], purpose='rent'), resolve_locations=False)
+    assert canonical_filters.cache_key(different, 'pf') not in keys
+
+
+def test_containment_residuals():
+    broad = canonical_filters.canonicalize({'query': 'dubai marina', 'beds': [1, 2, 3]}, resolve_locations=False)
+    narrow = canonical_filters.canonicalize({'query': 'Marina', 'rooms': 2, 'min_price': 1500000},
+                                            resolve_locations=False)
+    assert canonical_filters.subsumes(broad, narrow)
+    assert not canonical_filters.subsumes(narrow, broad)
+    assert canonical_filters.residual_predicates(broad, narrow) == [('rooms', 'IN', [2]), ('price', '>=', 1500000)]
+
+    # Filters that cannot be evaluated over cached rows must match exactly
+    villas = dict(narrow, property_type='villa')
+    assert not canonical_filters.subsumes(broad, villas)
+
+
+def test_narrower_query_is_answered_from_a_complete_cached_set(app):
+    upstream = [listing(i, rooms=i % 3 + 1, price=1000000 + 100000 * i) for i in range(20)]
+    broad = canonical_filters.canonicalize({'query': 'dubai marina'}, resolve_locations=False)
+
+    def fetch_broad(segment):
+        return upstream[segment * SEGMENT_SIZE:(segment + 1) * SEGMENT_SIZE], len(upstream), 2
+
+    for page in (1, 2):
+        search_cache.read_through('algolia', broad, page, SEGMENT_SIZE, SEGMENT_SIZE, fetch_broad)
+
+    def fetch_narrow(segment):
+        raise AssertionError("the narrower query went upstream")
+
+    narrow = dict(broad, beds=2, min_price=1500000)
+    properties, total = search_cache.read_through('algolia', narrow, 1, 50, SEGMENT_SIZE, fetch_narrow)
+    expected = [item for item in upstream if item['rooms'] == 2 and item['price'] >= 1500000]
+    assert total == len(expected)
+    assert sorted(_ids(properties)) == sorted(str(item['id']) for item in expected)
+
+
+def test_snapshot_round_trip(storage_format, app, tmp_path):
+    query_id = database.save_query('algolia:snapshot', 15, 2, filters={'query': 'dubai marina'})
+    database.save_segment(query_id, 0, SEGMENT_SIZE, [listing(i, all_image_urls=[
+        f"https://images.example.com/thumbnails/{i}{n}-800x600.jpeg" for n in range(3)]) for i in range(10)])
+    # A duplicate dropped from the second segment
+    database.save_segment(query_id, 1, SEGMENT_SIZE, [listing(i) for i in (10, 11, 3, 13, 14)])
+    database.cache_set('build_id', 'propertyfinder', 'build-123')
+    before = [database.get_cached_page(query_id, offset, SEGMENT_SIZE) for offset in (0, 10)]
+
+    path = str(tmp_path / 'snapshot.jsonl.gz')
+    assert database.export_cache_snapshot(path) == (1, 14)
+
+    app.config['DATABASE'] = str(tmp_path / 'replica.db')
+    database.close_db()
+    database.init_db()
+    assert database.find_cached_query('algolia:snapshot') is None
+
+    assert database.import_cache_snapshot(path) == (1, 14)
+    imported_id = database.find_cached_query('algolia:snapshot')
+    assert database.get_query_totals(imported_id) == (15, 2)
+    assert database.get_cached_segments(imported_id) == {0, 1}
+    after = [database.get_cached_page(imported_id, offset, SEGMENT_SIZE) for offset in (0, 10)]
+    strip = ('query_id', 'position')
+    assert ([[{key: value for key, value in prop.items() if key not in strip} for prop in page] for page in after]
+            == [[{key: value for key, value in prop.items() if key not in strip} for prop in page] for page in before])
+    assert database.cache_get('build_id', 'propertyfinder') == 'build-123'
+
+    # Importing again leaves the live entry alone
+    assert database.import_cache_snapshot(path) == (0, 0)
@@ -0,0 +1,598 @@
+"""
+Local listing warehouse.
+
+Bulk ingestion (ingestion.py) crawls the portals into warehouse_listings,
+upserting by (source, listing_id). Searches whose filters fall inside the
+scope of a recently finished crawl are answered here instead of upstream;
+detail pages fall back to it for listings no cached search holds.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import cache_policy
+import canonical_filters
+import database
+import geo_grid
+
+SOURCES = ('bayut', 'propertyfinder')
+# Search cache namespace -> the source whose crawls can answer it
+NAMESPACE_SOURCES = {'algolia': 'bayut', 'pf': 'propertyfinder'}
+
+# Stored listing fields (besides the ID), in column order
+WAREHOUSE_FIELDS = (
+    'title', 'price', 'area', 'rooms', 'baths', 'purpose', 'property_type', 'completion_status',
+    'latitude', 'longitude', 'location_name', 'location_path', 'cover_photo_url', 'all_image_urls',
+    'agency_name', 'contact_name', 'mobile_number', 'whatsapp_number', 'down_payment_percentage',
+    'description', 'listed_at',
+)
+# Columns returned in search pages; detail reads return every field
+_PAGE_COLUMNS = ('listing_id', 'source', 'title', 'price', 'area', 'rooms', 'baths', 'purpose', 'property_type',
+                 'completion_status', 'latitude', 'longitude', 'location_name', 'cover_photo_url', 'agency_name',
+                 'contact_name', 'mobile_number', 'whatsapp_number', 'down_payment_percentage')
+
+# Canonical filter -> (column, operator) evaluated in SQL
+_COLUMN_FILTERS = {key: spec for key, spec in canonical_filters.RESIDUAL_FILTERS.items() if spec[1] != 'MATCH'}
+
+# Crawl jobs in these states can be resumed
+RESUMABLE_JOB_STATUSES = ('planning', 'running', 'partial')
+
+# Existing rows are looked up this many listings at a time
+_LOOKUP_BATCH = 500
+# Listings per file written by export_csv()
+EXPORT_CHUNK_ROWS = 50000
+
+
+def _timestamp(value):
+    """Epoch seconds from a portal date (epoch number or ISO 8601 string), or None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _property_type(value):
+    if not value:
+        return None
+    return canonical_filters.canonicalize({'property_type': value}, resolve_locations=False)['property_type']
+
+
+def _values(listing):
+    values = {field: listing.get(field) for field in WAREHOUSE_FIELDS}
+    values['property_type'] = _property_type(values['property_type'])
+    values['all_image_urls'] = json.dumps(list(values['all_image_urls'] or []))
+    values['listed_at'] = _timestamp(values['listed_at'])
+    return values
+
+
+def _content_hash(values):
+    encoded = json.dumps(values, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def _index_rows(cursor, rows, replace):
+    """(Re)writes the full-text and spatial index entries of (row_id, values) pairs."""
+    if replace:
+        cursor.executemany("DELETE FROM warehouse_search WHERE rowid = ?", [(row_id,) for row_id, _ in rows])
+        cursor.executemany("DELETE FROM warehouse_geo WHERE row_id = ?", [(row_id,) for row_id, _ in rows])
+    cursor.executemany("""
+        INSERT INTO warehouse_search (rowid, title, location_path, agency_name, description)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(row_id, values['title'], values['location_path'] or values['location_name'], values['agency_name'],
+           values['description']) for row_id, values in rows])
+    cursor.executemany("INSERT INTO warehouse_geo (row_id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)",
+                       [(row_id, values['latitude'], values['latitude'], values['longitude'], values['longitude'])
+                        for row_id, values in rows
+                        if values['latitude'] is not None and values['longitude'] is not None])
+
+
+def _existing_rows(cursor, source, listing_ids):
+    """listing_id -> (row_id, content_hash) of the listings already stored."""
+    existing = {}
+    for start in range(0, len(listing_ids), _LOOKUP_BATCH):
+        batch = listing_ids[start:start + _LOOKUP_BATCH]
+        cursor.execute(f"""
+            SELECT listing_id, row_id, content_hash FROM warehouse_listings
+            WHERE source = ? AND listing_id IN ({', '.join('?' for _ in batch)})
+        """, [source] + batch)
+        existing.update((row['listing_id'], (row['row_id'], row['content_hash'])) for row in cursor.fetchall())
+    return existing
+
+
+def upsert_listings(source, listings, seen_at=None):
+    """
+    Inserts new listings and updates changed ones (by content hash); listings
+    seen again unchanged only get their last_seen_at bumped. Each kind of
+    write is one executemany batch. Returns (inserted, updated, unchanged).
+    """
+    seen_at = seen_at or time.time()
+    by_id = {}
+    for listing in listings:
+        if listing and listing.get('id') is not None:
+            by_id[str(listing['id'])] = listing
+
+    db = database.get_db()
+    cursor = db.cursor()
+    existing = _existing_rows(cursor, source, list(by_id))
+
+    new_rows, changed_rows, unchanged_ids = [], [], []
+    for listing_id, listing in by_id.items():
+        values = _values(listing)
+        content_hash = _content_hash(values)
+        row_id, old_hash = existing.get(listing_id, (None, None))
+        if old_hash == content_hash:
+            unchanged_ids.append(row_id)
+            continue
+        if row_id is None:
+            new_rows.append((listing_id, values, content_hash))
+        else:
+            changed_rows.append((row_id, values, content_hash))
+
+    columns = ', '.join(WAREHOUSE_FIELDS)
+    cursor.executemany(f"""
+        INSERT INTO warehouse_listings (source, listing_id, {columns}, content_hash,
+                                        first_seen_at, last_seen_at, updated_at)
+        VALUES (?, ?, {', '.join('?' for _ in WAREHOUSE_FIELDS)}, ?, ?, ?, ?)
+    """, [[source, listing_id, *(values[field] for field in WAREHOUSE_FIELDS), content_hash,
+           seen_at, seen_at, seen_at] for listing_id, values, content_hash in new_rows])
+    if new_rows:
+        # executemany() gives no lastrowid, so the new row IDs are looked up
+        row_ids = _existing_rows(cursor, source, [listing_id for listing_id, *_ in new_rows])
+        _index_rows(cursor, [(row_ids[listing_id][0], values) for listing_id, values, *_ in new_rows], replace=False)
+
+    assignments = ', '.join(f"{field} = ?" for field in WAREHOUSE_FIELDS)
+    cursor.executemany(f"""
+        UPDATE warehouse_listings SET {assignments}, content_hash = ?, last_seen_at = ?, updated_at = ?
+        WHERE row_id = ?
+    """, [[*(values[field] for field in WAREHOUSE_FIELDS), content_hash, seen_at, seen_at, row_id]
+          for row_id, values, content_hash in changed_rows])
+    _index_rows(cursor, [(row_id, values) for row_id, values, *_ in changed_rows], replace=True)
+
+    cursor.executemany("UPDATE warehouse_listings SET last_seen_at = ? WHERE row_id = ?",
+                       [(seen_at, row_id) for row_id in unchanged_ids])
+    cursor.executemany("DELETE FROM warehouse_delisted WHERE row_id = ?",
+                       [(row_id,) for row_id, *_ in changed_rows] + [(row_id,) for row_id in unchanged_ids])
+    db.commit()
+    return len(new_rows), len(changed_rows), len(unchanged_ids)
+
+
+def start_crawl(source, scope):
+    """Records the start of a crawl over `scope` (canonical filters). Returns the crawl ID."""
+    db = database.get_db()
+    cursor = db.execute("INSERT INTO warehouse_crawls (source, scope_json, started_at) VALUES (?, ?, ?)",
+                        (source, json.dumps(scope, sort_keys=True), time.time()))
+    db.commit()
+    return cursor.lastrowid
+
+
+def finish_crawl(crawl_id, listing_count, complete=True):
+    """
+    Records a crawl's outcome. Only complete crawls (every upstream result
+    fetched) get a finished_at, so only they can answer searches.
+    """
+    db = database.get_db()
+    db.execute("UPDATE warehouse_crawls SET listing_count = ?, finished_at = ? WHERE crawl_id = ?",
+               (listing_count, time.time() if complete else None, crawl_id))
+    db.commit()
+
+
+def create_job(source, filters, partitioned, crawl_id):
+    """Records a new crawl job over portal-level `filters`, not yet planned. Returns the job ID."""
+    now = time.time()
+    db = database.get_db()
+    cursor = db.execute("""
+        INSERT INTO crawl_jobs (source, filters_json, partitioned, crawl_id, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'planning', ?, ?)
+    """, (source, json.dumps(filters, sort_keys=True), int(partitioned), crawl_id, now, now))
+    db.commit()
+    return cursor.lastrowid
+
+
+def _job_from_row(row):
+    job = dict(row)
+    job['filters'] = json.loads(job.pop('filters_json'))
+    job['partitioned'] = bool(job['partitioned'])
+    return job
+
+
+def get_job(job_id):
+    db = database.get_db()
+    row = db.execute("SELECT * FROM crawl_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return _job_from_row(row) if row else None
+
+
+def find_resumable_job(source, filters, partitioned, since):
+    """The newest unfinished job for the same crawl created after `since`, or None."""
+    db = database.get_db()
+    row = db.execute(f"""
+        SELECT * FROM crawl_jobs
+        WHERE source = ? AND filters_json = ? AND partitioned = ? AND created_at > ?
+          AND status IN ({', '.join('?' for _ in RESUMABLE_JOB_STATUSES)})
+        ORDER BY created_at DESC LIMIT 1
+    """, (source, json.dumps(filters, sort_keys=True), int(partitioned), since, *RESUMABLE_JOB_STATUSES)).fetchone()
+    return _job_from_row(row) if row else None
+
+
+def list_jobs(limit=20):
+    """The newest jobs with their page progress (pages_total is None until every partition has started)."""
+    db = database.get_db()
+    rows = db.execute("""
+        SELECT j.*, COUNT(p.partition_index) AS partitions,
+               SUM(p.next_page + json_array_length(p.done_pages)) AS pages_done,
+               CASE WHEN COUNT(p.total_pages) = COUNT(p.partition_index) THEN SUM(p.total_pages) END AS pages_total
+        FROM crawl_jobs j LEFT JOIN crawl_job_partitions p ON p.job_id = j.job_id
+        GROUP BY j.job_id ORDER BY j.job_id DESC LIMIT ?
+    """, (limit,)).fetchall()
+    return [_job_from_row(row) for row in rows]
+
+
+def set_job_status(job_id, status, listing_count=None):
+    db = database.get_db()
+    db.execute("""
+        UPDATE crawl_jobs SET status = ?, listing_count = COALESCE(?, listing_count), updated_at = ?
+        WHERE job_id = ?
+    """, (status, listing_count, time.time(), job_id))
+    db.commit()
+
+
+def cancel_job(job_id):
+    """Cancels an unfinished job; a crawler running it stops at its next progress check. Returns False if finished."""
+    db = database.get_db()
+    cursor = db.execute(f"""
+        UPDATE crawl_jobs SET status = 'cancelled', updated_at = ?
+        WHERE job_id = ? AND status IN ({', '.join('?' for _ in RESUMABLE_JOB_STATUSES)})
+    """, (time.time(), job_id, *RESUMABLE_JOB_STATUSES))
+    db.commit()
+    return cursor.rowcount > 0
+
+
+def save_job_plan(job_id, partitions, oversize):
+    """Stores a job's planned partitions (filter dicts) and marks it running."""
+    db = database.get_db()
+    db.execute("DELETE FROM crawl_job_partitions WHERE job_id = ?", (job_id,))
+    db.executemany("""
+        INSERT INTO crawl_job_partitions (job_id, partition_index, filters_json, oversize) VALUES (?, ?, ?, ?)
+    """, [(job_id, index, json.dumps(partition, sort_keys=True), int(partition in oversize))
+          for index, partition in enumerate(partitions)])
+    db.execute("UPDATE crawl_jobs SET status = 'running', updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+    db.commit()
+
+
+def job_partitions(job_id):
+    """A job's partitions in order, with their checkpoints (done_pages as a set)."""
+    db = database.get_db()
+    rows = db.execute("SELECT * FROM crawl_job_partitions WHERE job_id = ? ORDER BY partition_index",
+                      (job_id,)).fetchall()
+    partitions = []
+    for row in rows:
+        partition = dict(row)
+        partition['filters'] = json.loads(partition.pop('filters_json'))
+        partition['oversize'] = bool(partition['oversize'])
+        partition['done_pages'] = set(json.loads(partition['done_pages']))
+        partitions.append(partition)
+    return partitions
+
+
+def checkpoint_partition(job_id, partition, new_listings=0):
+    """Saves a partition's totals and page checkpoint, adding `new_listings` to the job's count."""
+    now = time.time()
+    db = database.get_db()
+    db.execute("""
+        UPDATE crawl_job_partitions SET total_hits = ?, total_pages = ?, next_page = ?, done_pages = ?,
+               updated_at = ?
+        WHERE job_id = ? AND partition_index = ?
+    """, (partition['total_hits'], partition['total_pages'], partition['next_page'],
+          json.dumps(sorted(partition['done_pages'])), now, job_id, partition['partition_index']))
+    db.execute("UPDATE crawl_jobs SET listing_count = listing_count + ?, updated_at = ? WHERE job_id = ?",
+               (new_listings, now, job_id))
+    db.commit()
+
+
+def touch_listings(source, listing_ids, seen_at=None):
+    """
+    Marks listings as seen upstream without rewriting them (a sweep saw
+    their IDs). Returns the IDs not in the warehouse.
+    """
+    seen_at = seen_at or time.time()
+    listing_ids = [str(listing_id) for listing_id in listing_ids]
+    db = database.get_db()
+    cursor = db.cursor()
+    existing = _existing_rows(cursor, source, listing_ids)
+    row_ids = [(row_id,) for row_id, _ in existing.values()]
+    cursor.executemany("UPDATE warehouse_listings SET last_seen_at = ? WHERE row_id = ?",
+                       [(seen_at, row_id) for row_id, in row_ids])
+    cursor.executemany("DELETE FROM warehouse_delisted WHERE row_id = ?", row_ids)
+    db.commit()
+    return [listing_id for listing_id in listing_ids if listing_id not in existing]
+
+
+def mark_delisted(source, scope, swept_at, priced_only=False):
+    """
+    After a full sweep of `scope` that started at `swept_at`, marks the
+    listings in scope it did not see as delisted. Returns how many.
+    priced_only leaves listings without a price alone, for sweeps split
+    by price range (which never see them).
+    """
+    where, params = _where(source, scope)
+    if priced_only:
+        where += " AND price IS NOT NULL"
+    now = time.time()
+    db = database.get_db()
+    cursor = db.execute(f"""
+        INSERT OR IGNORE INTO warehouse_delisted (row_id, delisted_at)
+        SELECT row_id, ? FROM warehouse_listings WHERE {where} AND last_seen_at < ?
+    """, [now] + params + [swept_at])
+    db.commit()
+    return cursor.rowcount
+
+
+def sync_state(source, scope):
+    """The incremental sync state (watermark, swept_at, synced_at) of a crawl scope, or None."""
+    db = database.get_db()
+    row = db.execute("SELECT * FROM warehouse_sync WHERE source = ? AND scope_json = ?",
+                     (source, json.dumps(scope, sort_keys=True))).fetchone()
+    return dict(row) if row else None
+
+
+def save_sync_state(source, scope, watermark, swept_at=None):
+    """Advances a scope's watermark, and its sweep time when a full sweep finished."""
+    now = time.time()
+    db = database.get_db()
+    db.execute("""
+        INSERT INTO warehouse_sync (source, scope_json, watermark, swept_at, synced_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (source, scope_json) DO UPDATE SET
+            watermark = excluded.watermark, synced_at = excluded.synced_at,
+            swept_at = COALESCE(?, warehouse_sync.swept_at)
+    """, (source, json.dumps(scope, sort_keys=True), watermark, swept_at or now, now, swept_at))
+    db.commit()
+
+
+def _scope_covers(scope, canonical):
+    # Every filter the crawl was restricted by must be in the search too; a list allows any of its values
+    return all(key == 'sort' or canonical.get(key) == value
+               or (isinstance(value, list) and canonical.get(key) in value) for key, value in scope.items())
+
+
+def _covering_crawl(source, canonical):
+    """Returns (scope, finished_at) of the newest fresh, complete crawl that covers the filters, or None."""
+    db = database.get_db()
+    cursor = db.execute("""
+        SELECT scope_json, finished_at FROM warehouse_crawls
+        WHERE source = ? AND finished_at > ?
+        ORDER BY finished_at DESC
+    """, (source, time.time() - cache_policy.get('warehouse').ttl_seconds))
+    for row in cursor.fetchall():
+        scope = json.loads(row['scope_json'])
+        if _scope_covers(scope, canonical):
+            return scope, row['finished_at']
+    return None
+
+
+def covering_scope(source, canonical):
+    """Returns the scope of the newest fresh, complete crawl that covers the filters, or None."""
+    crawl = _covering_crawl(source, canonical)
+    return crawl[0] if crawl else None
+
+
+def data_age(namespace, canonical):
+    """
+    Seconds since the newest fresh crawl covering the filters finished, or
+    None if answer() could not use the warehouse for them.
+    """
+    source = NAMESPACE_SOURCES.get(namespace)
+    crawl = _covering_crawl(source, canonical) if source else None
+    return time.time() - crawl[1] if crawl else None
+
+
+def _row_to_listing(row, include_images=True):
+    listing = dict(row)
+    listing['id'] = listing.pop('listing_id')
+    if 'all_image_urls' in listing:
+        if include_images:
+            listing['all_image_urls'] = json.loads(listing['all_image_urls'] or '[]')
+        else:
+            del listing['all_image_urls']
+    return listing
+
+
+def _phrase(text):
+    """An FTS5 phrase matching the words of `text` in order."""
+    words = re.findall(r"\w+", canonical_filters.normalize_text(text))
+    return '"' + " ".join(words) + '"' if words else None
+
+
+def _where(source, canonical, covered=None):
+    """
+    SQL conditions and parameters selecting a source's listings that match
+    canonical filters, skipping those in `covered` (a crawl scope every row
+    already satisfies). Returns None if a filter cannot be evaluated locally.
+    """
+    clauses = ["source = ?"]
+    params = [source]
+    matches = []
+    for key, value in canonical.items():
+        if covered and key in covered and covered[key] == value and key != 'sort':
+            continue  # every crawled listing already satisfies it
+        if key == 'sort':
+            if value != canonical_filters.DEFAULTS['sort']:
+                return None
+        elif key == 'location_id':
+            if 'query' not in canonical:
+                return None
+        elif key == 'query':
+            phrase = _phrase(value)
+            if phrase:
+                matches.append(f"location_path : {phrase}")
+        elif key == 'keywords':
+            keywords = database.fts_query(value)
+            if keywords:
+                matches.append(keywords)
+        elif key == 'purpose':
+            purposes = sorted({synonym for synonym, purpose in canonical_filters.PURPOSE_SYNONYMS.items()
+                               if purpose == value} | {value})
+            clauses.append(f"lower(purpose) IN ({', '.join('?' for _ in purposes)})")
+            params.extend(purposes)
+        elif key == 'property_type':
+            # Crawl scopes may list several types
+            values = value if isinstance(value, list) else [value]
+            clauses.append(f"property_type IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        elif key in _COLUMN_FILTERS:
+            column, operator = _COLUMN_FILTERS[key]
+            if operator == 'IN':
+                values = sorted(value) if isinstance(value, list) else [value]
+                clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+            else:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        else:
+            return None
+    if matches:
+        clauses.append("row_id IN (SELECT rowid FROM warehouse_search WHERE warehouse_search MATCH ?)")
+        params.append(" AND ".join(f"({match})" for match in matches))
+    return " AND ".join(clauses), params
+
+
+def search(source, canonical, offset, limit, include_images=True):
+    """
+    Answers canonical search filters from the warehouse, newest listings first.
+    Returns (properties, total_hits), or None when no fresh crawl covers the
+    filters or one of them cannot be evaluated locally.
+    """
+    scope = covering_scope(source, canonical)
+    if scope is None:
+        return None
+    condition = _where(source, canonical, covered=scope)
+    if condition is None:
+        return None
+    where, params = condition
+    where += " AND last_seen_at > ? AND row_id NOT IN (SELECT row_id FROM warehouse_delisted)"
+    params = params + [time.time() - cache_policy.get('warehouse').ttl_seconds]
+
+    db = database.get_db()
+    cursor = db.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM warehouse_listings WHERE {where}", params)
+    total = cursor.fetchone()[0]
+    columns = ', '.join(_PAGE_COLUMNS + (('all_image_urls',) if include_images else ()))
+    cursor.execute(f"""
+        SELECT {columns} FROM warehouse_listings WHERE {where}
+        ORDER BY listed_at IS NULL, listed_at DESC, row_id DESC LIMIT ? OFFSET ?
+    """, params + [limit, offset])
+    return [_row_to_listing(row, include_images) for row in cursor.fetchall()], total
+
+
+def listings_near(latitude, longitude, radius_km, include_images=True):
+    """
+    Listed warehouse listings seen within the warehouse TTL that lie within
+    `radius_km` of a point, nearest first, each with a `distance_km`.
+    Candidates come from the warehouse_geo R*Tree.
+    """
+    south, west, north, east = geo_grid.radius_bounds(latitude, longitude, radius_km)
+    columns = ', '.join(f"w.{column}" for column in _PAGE_COLUMNS + (('all_image_urls',) if include_images else ()))
+    db = database.get_db()
+    rows = db.execute(f"""
+        SELECT {columns} FROM warehouse_geo g JOIN warehouse_listings w ON w.row_id = g.row_id
+        WHERE g.min_lat <= ? AND g.max_lat >= ? AND g.min_lng <= ? AND g.max_lng >= ?
+          AND w.last_seen_at > ? AND w.row_id NOT IN (SELECT row_id FROM warehouse_delisted)
+    """, (north, south, east, west, time.time() - cache_policy.get('warehouse').ttl_seconds)).fetchall()
+    indexes, distances = geo_grid.nearest_within(latitude, longitude, [row['latitude'] for row in rows],
+                                                 [row['longitude'] for row in rows], radius_km)
+    listings = []
+    for index, distance in zip(indexes, distances):
+        listing = _row_to_listing(rows[index], include_images)
+        listing['distance_km'] = round(distance, 3)
+        listings.append(listing)
+    return listings
+
+
+def answer(namespace, canonical, offset, limit, include_images=True):
+    """search() for a search cache namespace; None if no warehouse source backs it."""
+    source = NAMESPACE_SOURCES.get(namespace)
+    if source is None:
+        return None
+    return search(source, canonical, offset, limit, include_images)
+
+
+def get_listing(listing_id):
+    """Returns the most recently seen warehouse copy of a listing still listed upstream, or None."""
+    db = database.get_db()
+    row = db.execute(f"""
+        SELECT listing_id, source, {', '.join(WAREHOUSE_FIELDS)} FROM warehouse_listings
+        WHERE listing_id = ? AND row_id NOT IN (SELECT row_id FROM warehouse_delisted)
+        ORDER BY last_seen_at DESC LIMIT 1
+    """, (str(listing_id),)).fetchone()
+    return _row_to_listing(row) if row else None
+
+
+def stats():
+    """Per-source listing counts (delisted ones separately) and the time of the last finished crawl."""
+    db = database.get_db()
+    rows = db.execute("""
+        SELECT source, COUNT(*) AS listings, COUNT(d.row_id) AS delisted,
+               (SELECT MAX(finished_at) FROM warehouse_crawls c WHERE c.source = w.source) AS last_crawl
+        FROM warehouse_listings w LEFT JOIN warehouse_delisted d ON d.row_id = w.row_id GROUP BY source
+    """).fetchall()
+    return {row['source']: {'listings': row['listings'] - row['delisted'], 'delisted': row['delisted'],
+                            'last_crawl': row['last_crawl']} for row in rows}
+
+
+def iter_listings(source=None, batch_size=1000, listed_only=False):
+    """
+    Yields every stored listing (as a row) in batches of `batch_size`, reading
+    the table incrementally. listed_only skips listings marked delisted.
+    """
+    db = database.get_db()
+    columns = ', '.join(('listing_id', 'source') + WAREHOUSE_FIELDS + ('first_seen_at', 'last_seen_at'))
+    listed = "AND row_id NOT IN (SELECT row_id FROM warehouse_delisted)" if listed_only else ""
+    last_row_id = 0
+    while True:
+        # Keyset pagination keeps every read short instead of holding one cursor open across the export
+        rows = db.execute(f"""
+            SELECT row_id, {columns} FROM warehouse_listings
+            WHERE row_id > ? AND (? IS NULL OR source = ?) {listed}
+            ORDER BY row_id LIMIT ?
+        """, (last_row_id, source, source, batch_size)).fetchall()
+        if not rows:
+            return
+        last_row_id = rows[-1]['row_id']
+        yield rows
+
+
+def export_csv(directory, source=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Streams the warehouse into CSV files of at most `chunk_rows` listings
+    (listings-00001.csv, ...) in `directory`. Each chunk is written to a
+    temporary name and renamed when complete. Returns (listings, files).
+    """
+    os.makedirs(directory, exist_ok=True)
+    header = ('listing_id', 'source') + WAREHOUSE_FIELDS + ('first_seen_at', 'last_seen_at')
+    count, paths = 0, []
+    out = writer = None
+    try:
+        for rows in iter_listings(source, batch_size=min(chunk_rows, 1000)):
+            for row in rows:
+                if count % chunk_rows == 0:
+                    if out is not None:
+                        out.close()
+                        os.replace(out.name, paths[-1])
+                    paths.append(os.path.join(directory, f"listings-{len(paths) + 1:05d}.csv"))
+                    out = open(paths[-1] + '.tmp', 'w', newline='', encoding='utf-8')
+                    writer = csv.writer(out)
+                    writer.writerow(header)
+                writer.writerow([row[column] for column in header])
+                count += 1
+    finally:
+        if out is not None:
+            out.close()
+    if out is not None:
+        os.replace(out.name, paths[-1])
+    return count, paths